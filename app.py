@@ -1,10 +1,21 @@
 import os
+import zlib
+import heapq
 import logging
 import json
 import ipaddress
 from datetime import datetime, timedelta
-from flask import Flask, render_template, request, flash, session, jsonify
-from rdap_service import RDAPService, GeolocationService, ASNService, BatchService
+from flask import Flask, render_template, request, flash, session, jsonify, redirect, Response, stream_with_context, g
+from rdap_service import RDAPService, GeolocationService, ASNService, BatchService, EnhancedLookupService
+from transport import HTTPTransport
+from disk_cache import DiskCache
+from asn_index import AsnIndex
+from geo_db import open_geo_db
+from jobs import JobManager, JobLost
+from records import as_dict
+from metrics import REGISTRY
+import timing
+from timing import phase
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -13,11 +24,57 @@ logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
 
-# Initialize services
-rdap_service = RDAPService()
-geo_service = GeolocationService()
-asn_service = ASNService()
-batch_service = BatchService(rdap_service)
+# Initialize services on one pooled keep-alive transport and optional shared disk cache
+transport = HTTPTransport.from_env()
+disk_cache = DiskCache.from_env()
+rdap_service = RDAPService(transport=transport, disk_cache=disk_cache)
+geo_service = GeolocationService(transport, disk_cache, open_geo_db())
+asn_service = ASNService(transport, disk_cache, AsnIndex.from_env())
+batch_service = BatchService(rdap_service, geo_service, asn_service)
+enhanced_service = EnhancedLookupService(rdap_service, geo_service, asn_service)
+
+# Background batch jobs persist in SQLite so any worker can resume them
+job_manager = JobManager.from_env(batch_service, os.path.join(app.instance_path, 'jobs.db'))
+
+# Batch results shown inline; the full set is exported from the job store
+RESULT_PREVIEW_SIZE = 50
+
+# Optional sampling profiler for slow requests (RIPESCANNER_PROFILE_SLOW_MS)
+profiler = timing.SamplingProfiler.from_env()
+
+@app.before_request
+def start_request_timer():
+    """Time the request's phases and, when enabled, start sampling its thread"""
+    g.request_timer = timing.start_request()
+    if profiler:
+        profiler.begin()
+
+@app.after_request
+def add_server_timing(response):
+    """Expose phase timings as a Server-Timing header, and in JSON bodies on request"""
+    timer = g.get('request_timer')
+    if timer is None:
+        return response
+    
+    # Streamed responses are timed up to the start of the body
+    total = timer.elapsed()
+    response.headers['Server-Timing'] = timer.server_timing(total)
+    
+    wants_timings = request_flag('timings') or (request.is_json and json_body().get('timings'))
+    if wants_timings and response.is_json and not response.is_streamed:
+        data = response.get_json()
+        if isinstance(data, dict):
+            data['timings'] = timer.as_dict(total)
+            response.set_data(app.json.dumps(data))
+    return response
+
+@app.teardown_request
+def finish_request_timer(error=None):
+    """Stop timing; slow requests leave a profile behind when the profiler is on"""
+    timer = g.get('request_timer')
+    if timer is not None and profiler:
+        profiler.end(f'{request.method} {request.path}', timer.elapsed())
+    timing.finish_request()
 
 @app.route('/')
 def index():
@@ -39,21 +96,25 @@ def lookup():
         # Check if enhanced lookup is requested
         enhanced_mode = request.form.get('enhanced_lookup') == 'true'
         
-        # Perform RDAP lookup
-        result = rdap_service.lookup(ip_input)
+        # Perform RDAP lookup (lean=true leaves out the raw RDAP payload); enhanced mode
+        # fetches geolocation and ASN data alongside it under one deadline
+        lean = bool(request_flag('lean'))
+        if enhanced_mode:
+            combined = enhanced_service.lookup(ip_input, request_deadline(), lean=lean)
+            result = combined['rdap']
+        else:
+            with phase('rdap'):
+                result = rdap_service.lookup(ip_input, lean=lean)
         
         if 'error' in result:
             flash(f'Registry scan failed: {result["error"]}', 'error')
             return render_template('index.html', history=session.get('search_history', []))
         
-        # Enhanced data collection if requested
         if enhanced_mode:
-            geo_data = geo_service.get_location_data(ip_input)
-            asn_data = asn_service.get_asn_data(ip_input)
-            
             result['enhanced'] = True
-            result['geolocation'] = geo_data
-            result['asn_info'] = asn_data
+            result['geolocation'] = combined['geolocation']
+            result['asn_info'] = combined['asn']
+            result['sources'] = combined['sources']
         
         # Add to search history
         if 'search_history' not in session:
@@ -71,10 +132,11 @@ def lookup():
         session['search_history'] = session['search_history'][:10]
         session.modified = True
         
-        return render_template('index.html', 
-                             result=result, 
-                             query=ip_input,
-                             history=session.get('search_history', []))
+        with phase('render'):
+            return render_template('index.html', 
+                                 result=result, 
+                                 query=ip_input,
+                                 history=session.get('search_history', []))
         
     except Exception as e:
         logging.error(f"Error during RDAP lookup: {str(e)}")
@@ -99,15 +161,31 @@ def clear_history():
     flash('Search history cleared', 'success')
     return render_template('index.html', history=[])
 
-@app.route('/batch_lookup', methods=['POST'])
-def batch_lookup():
-    """Handle batch IP address processing"""
-    ip_list_text = request.form.get('ip_list', '').strip()
-    
-    if not ip_list_text:
-        return jsonify({'success': False, 'error': 'Please provide IP addresses to process'})
-    
-    # Parse IP list (support multiple formats)
+def request_flag(name):
+    """Read a true/false option from the form or query string; None when absent"""
+    value = request.values.get(name)
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+def json_body():
+    """The request's JSON object; {} when the body is missing, invalid or not an object"""
+    payload = request.get_json(silent=True)
+    return payload if isinstance(payload, dict) else {}
+
+def request_deadline():
+    """Overall deadline in seconds for an enhanced lookup or range scan, from the form, query or JSON body"""
+    value = request.values.get('deadline')
+    if value is None and request.is_json:
+        value = json_body().get('deadline')
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        return None
+    return deadline if deadline > 0 else None
+
+def parse_ip_list(ip_list_text):
+    """Split batch input into addresses (one per line, comma-separated, # comments)"""
     ip_addresses = []
     for line in ip_list_text.split('\n'):
         line = line.strip()
@@ -116,52 +194,188 @@ def batch_lookup():
                 ip_addresses.extend([ip.strip() for ip in line.split(',')])
             else:  # Line-separated
                 ip_addresses.append(line)
+    return ip_addresses
+
+@app.route('/batch_lookup', methods=['POST'])
+def batch_lookup():
+    """Handle batch IP address processing"""
+    ip_list_text = request.form.get('ip_list', '').strip()
+    
+    if not ip_list_text:
+        return jsonify({'success': False, 'error': 'Please provide IP addresses to process'})
+    
+    ip_addresses = parse_ip_list(ip_list_text)
+    
+    lines = [ip.strip() for ip in ip_addresses if ip.strip()]
+    # Owned and heartbeated by this worker, so no watchdog reclaims it while the request runs
+    store, owner = job_manager.store, job_manager.owner
+    job_id = store.create(lines, owner=owner)
     
     try:
-        # Process batch
-        results = batch_service.process_batch(ip_addresses)
+        # Results go to the job store as they complete; only the first page is kept in memory
+        preview = []
+        pending = []
+        total_processed = 0
+        total_errors = 0
+        plan = None
         
-        # Store results in session for export
-        session['batch_results'] = results
+        with job_manager.hold(job_id) as lost:
+            for event in batch_service.iter_batch(lines, progress_interval=float('inf'),
+                                                  lean=request_flag('lean'), records=True):
+                if lost.is_set():
+                    raise JobLost(job_id)
+                if event['type'] == 'plan':
+                    plan = {key: value for key, value in event.items() if key != 'type'}
+                elif event['type'] in ('result', 'error'):
+                    pending.append((event['index'], event['type'], as_dict(event[event['type']])))
+                    if event['type'] == 'result':
+                        total_processed += 1
+                        # Max-heap on position holding the lowest-positioned results
+                        if len(preview) < RESULT_PREVIEW_SIZE:
+                            heapq.heappush(preview, (-event['index'], event['result']))
+                        elif event['index'] < -preview[0][0]:
+                            heapq.heapreplace(preview, (-event['index'], event['result']))
+                    else:
+                        total_errors += 1
+                
+                if len(pending) >= 500:
+                    store.add_results(job_id, pending, owner)
+                    pending = []
+            
+            if pending:
+                store.add_results(job_id, pending, owner)
+            store.finish(job_id, 'done', owner=owner)
+        
+        # Only the job id goes into the signed session cookie
+        session.pop('batch_results', None)
+        session['batch_job'] = job_id
         session.modified = True
         
         return jsonify({
             'success': True,
-            'total_processed': results['total_processed'],
-            'total_errors': results['total_errors'],
-            'results': results['results'][:50],  # Limit display results
-            'has_more': len(results['results']) > 50
+            'job_id': job_id,
+            'total_processed': total_processed,
+            'total_errors': total_errors,
+            'results': [result.to_dict() for _, result in sorted(preview, key=lambda item: -item[0])],
+            'has_more': total_processed > RESULT_PREVIEW_SIZE,
+            'plan': plan
         })
         
+    except JobLost:
+        # Another worker resumed the job after this one stopped heartbeating; it finishes it
+        logging.warning(f"Batch job {job_id} was taken over by another worker; stopping")
+        return jsonify({'success': False, 'job_id': job_id,
+                        'error': f'Batch was taken over by another worker; follow it at /jobs/{job_id}'})
     except Exception as e:
         logging.error(f"Batch processing error: {str(e)}")
+        store.finish(job_id, 'failed', str(e), owner=owner)
         return jsonify({'success': False, 'error': f'Batch processing failed: {str(e)}'})
 
+@app.route('/batch_lookup/stream', methods=['POST'])
+def batch_lookup_stream():
+    """Stream batch results as NDJSON (default) or Server-Sent Events as they complete"""
+    ip_list_text = request.form.get('ip_list', '').strip()
+    
+    if not ip_list_text:
+        return jsonify({'success': False, 'error': 'Please provide IP addresses to process'})
+    
+    ip_addresses = parse_ip_list(ip_list_text)
+    use_sse = (request.args.get('format') == 'sse' or
+               request.accept_mimetypes.best == 'text/event-stream')
+    lean = request_flag('lean')
+    
+    def generate():
+        try:
+            for event in batch_service.iter_batch(ip_addresses, lean=lean):
+                payload = json.dumps(event)
+                if use_sse:
+                    yield f"event: {event['type']}\ndata: {payload}\n\n"
+                else:
+                    yield payload + '\n'
+        except Exception as e:
+            logging.error(f"Batch stream error: {str(e)}")
+            payload = json.dumps({'type': 'error', 'error': f'Batch processing failed: {str(e)}'})
+            yield f"event: error\ndata: {payload}\n\n" if use_sse else payload + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a batch as a background job"""
+    payload = json_body()
+    if isinstance(payload.get('ips'), list):
+        ip_addresses = [str(ip) for ip in payload['ips']]
+    else:
+        ip_addresses = parse_ip_list(payload.get('ip_list') or request.form.get('ip_list', ''))
+    
+    if not ip_addresses:
+        return jsonify({'success': False, 'error': 'Please provide IP addresses to process'}), 400
+    
+    job_id = job_manager.submit(ip_addresses)
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}',
+        'results_url': f'/jobs/{job_id}/results'
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Report job progress, throughput and ETA"""
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return jsonify(dict(status, success=True))
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    """Fetch one page of job results in input order"""
+    if job_manager.store.get(job_id) is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = min(1000, max(1, request.args.get('limit', 100, type=int)))
+    page = job_manager.store.results(job_id, offset, limit)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'offset': offset,
+        'results': page,
+        'next_offset': page[-1]['index'] + 1 if len(page) == limit else None
+    })
+
 @app.route('/enhanced_lookup', methods=['POST'])
 def enhanced_lookup():
     """Enhanced IP lookup with geolocation and ASN data"""
-    ip_input = request.json.get('ip_address', '').strip()
+    payload = json_body()
+    ip_input = str(payload.get('ip_address') or '').strip()
     
     if not ip_input:
         return jsonify({'success': False, 'error': 'Please provide an IP address'})
     
     try:
         # Validate IP
-        validation = rdap_service.validate_ip(ip_input)
+        with phase('validate'):
+            validation = rdap_service.validate_ip(ip_input)
         if not validation['valid']:
             return jsonify({'success': False, 'error': validation['message']})
         
-        # Get all data
-        rdap_result = rdap_service.lookup(ip_input)
-        geo_data = geo_service.get_location_data(ip_input)
-        asn_data = asn_service.get_asn_data(ip_input)
+        # Get all data concurrently; sources still running at the deadline come back as errors
+        combined = enhanced_service.lookup(ip_input, request_deadline(), lean=bool(payload.get('lean')))
         
         return jsonify({
             'success': True,
             'ip': ip_input,
-            'rdap': rdap_result,
-            'geolocation': geo_data,
-            'asn': asn_data,
+            'rdap': combined['rdap'],
+            'geolocation': combined['geolocation'],
+            'asn': combined['asn'],
+            'sources': combined['sources'],
+            'partial': combined['partial'],
             'timestamp': datetime.now().isoformat()
         })
         
@@ -169,6 +383,27 @@ def enhanced_lookup():
         logging.error(f"Enhanced lookup error: {str(e)}")
         return jsonify({'success': False, 'error': f'Enhanced lookup failed: {str(e)}'})
 
+@app.route('/scan_range', methods=['POST'])
+def scan_range():
+    """Map the distinct RDAP allocations inside a CIDR prefix"""
+    data = json_body() or request.form
+    prefix = (data.get('prefix') or '').strip()
+    if not prefix:
+        return jsonify({'success': False, 'error': 'Please provide a network prefix'})
+    
+    try:
+        workers = min(int(data.get('workers') or 8), 16)
+        max_lookups = int(data.get('max_lookups') or 0) or None
+        scan = rdap_service.scan_range(prefix, max_workers=workers, max_lookups=max_lookups,
+                                       deadline=request_deadline(), cursor=(data.get('cursor') or '').strip())
+    except Exception as e:
+        logging.error(f"Range scan error: {str(e)}")
+        return jsonify({'success': False, 'error': f'Range scan failed: {str(e)}'})
+    
+    if 'error' in scan:
+        return jsonify({'success': False, 'error': scan['error']})
+    return jsonify(dict(scan, success=True))
+
 @app.route('/geolocation/<ip_address>')
 def geolocation(ip_address):
     """Get geolocation data for IP address"""
@@ -187,36 +422,120 @@ def asn_lookup(ip_address):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/export/<format_type>')
-def export_results(format_type):
-    """Export batch results in various formats"""
-    results = session.get('batch_results', {})
+@app.route('/api/rate_limits')
+def api_rate_limits():
+    """API endpoint for per-upstream rate limiter state"""
+    limiter = transport.rate_limiter
+    return jsonify(limiter.snapshot() if limiter else {})
+
+@app.route('/api/cache_stats')
+def api_cache_stats():
+    """API endpoint for cache and request coalescing counters"""
+    return jsonify({
+        'rdap_range_cache': rdap_service.range_cache.stats(),
+        'rdap_route_overrides': rdap_service.route_overrides.stats(),
+        'disk_cache': disk_cache.stats() if disk_cache else None,
+        'coalesced': {
+            'rdap': rdap_service.inflight.stats(),
+            'geolocation': geo_service.inflight.stats(),
+            'asn': asn_service.inflight.stats()
+        }
+    })
+
+def service_state_metrics():
+    """Rate limiter, request coalescing and range cache state, read when /metrics is scraped"""
+    limiter = transport.rate_limiter
+    buckets = limiter.snapshot() if limiter else {}
+    for name, field, type_name, documentation in (
+        ('ripescanner_rate_limit_tokens', 'tokens', 'gauge', 'Tokens left in each upstream bucket (negative means queued)'),
+        ('ripescanner_rate_limit_blocked_seconds', 'blocked_for', 'gauge', 'Remaining Retry-After hold per upstream'),
+        ('ripescanner_rate_limit_delayed_total', 'delayed', 'counter', 'Requests that waited for a token'),
+        ('ripescanner_rate_limit_throttled_total', 'throttled', 'counter', 'Throttling responses (429) per upstream'),
+        ('ripescanner_rate_limit_wait_seconds_total', 'wait_seconds', 'counter', 'Time spent waiting for tokens')
+    ):
+        yield name, type_name, documentation, [({'upstream': key}, state[field]) for key, state in buckets.items()]
     
-    if not results:
-        flash('No batch results to export', 'error')
-        return redirect('/')
+    coalesced = {'rdap': rdap_service.inflight, 'geolocation': geo_service.inflight, 'asn': asn_service.inflight}
+    stats = {name: flight.stats() for name, flight in coalesced.items()}
+    yield ('ripescanner_singleflight_executed_total', 'counter', 'Lookups that went upstream',
+           [({'upstream': name}, state['executed']) for name, state in stats.items()])
+    yield ('ripescanner_singleflight_saved_total', 'counter', 'Lookups that shared an in-flight request',
+           [({'upstream': name}, state['saved']) for name, state in stats.items()])
+    yield ('ripescanner_singleflight_in_flight', 'gauge', 'Distinct lookups currently in flight',
+           [({'upstream': name}, state['in_flight']) for name, state in stats.items()])
+    
+    range_cache = rdap_service.range_cache.stats()
+    yield ('ripescanner_range_cache_entries', 'gauge', 'RDAP responses held in the range cache',
+           [({}, range_cache['entries'])])
+    yield ('ripescanner_rdap_learned_routes', 'gauge', 'Address ranges routed by learned RDAP referrals',
+           [({}, len(rdap_service.route_overrides))])
+
+REGISTRY.register_collector(service_state_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text-format metrics for upstreams, caches and batches"""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def gzip_stream(chunks):
+    """Gzip a stream of text chunks on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_job(job_id, format_type):
+    """Stream a stored batch as CSV or JSON, gzipped when ?compress=gzip"""
+    job = job_manager.store.get(job_id) if job_id else None
+    if job is None:
+        return None
+    
+    format_type = 'csv' if format_type == 'csv' else 'json'
+    store = job_manager.store
+    summary = {
+        'total_processed': job['completed'] - job['errors'],
+        'total_errors': job['errors'],
+        'success': job['status'] != 'failed'
+    }
+    chunks = batch_service.iter_export(store.iter_results(job_id, 'result'), format_type,
+                                       store.iter_results(job_id, 'error'), summary)
+    
+    filename = f'ripescanner_results.{format_type}'
+    mimetype = 'text/csv' if format_type == 'csv' else 'application/json'
+    if request.args.get('compress') == 'gzip':
+        chunks = gzip_stream(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
     
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/export/<format_type>')
+def export_results(format_type):
+    """Export the last batch of this session in various formats"""
     try:
-        export_data = batch_service.export_results(results, format_type)
-        
-        if format_type == 'csv':
-            from flask import Response
-            return Response(
-                export_data,
-                mimetype='text/csv',
-                headers={'Content-Disposition': 'attachment; filename=ripescanner_results.csv'}
-            )
-        else:  # JSON
-            from flask import Response
-            return Response(
-                export_data,
-                mimetype='application/json',
-                headers={'Content-Disposition': 'attachment; filename=ripescanner_results.json'}
-            )
-            
+        response = export_job(request.args.get('job') or session.get('batch_job'), format_type)
     except Exception as e:
         flash(f'Export failed: {str(e)}', 'error')
         return redirect('/')
+    
+    if response is None:
+        flash('No batch results to export', 'error')
+        return redirect('/')
+    return response
+
+@app.route('/jobs/<job_id>/export/<format_type>')
+def job_export(job_id, format_type):
+    """Export a job's results as CSV or JSON"""
+    response = export_job(job_id, format_type)
+    if response is None:
+        return jsonify({'success': False, 'error': 'Unknown job'}), 404
+    return response
 
 @app.route('/analytics')
 def analytics():
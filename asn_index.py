@@ -0,0 +1,140 @@
+import os
+import re
+import gzip
+import socket
+import struct
+import logging
+import ipaddress
+from typing import Any, Dict, Iterable, List, Optional
+
+from prefix_index import PrefixIndex, np
+
+# The first AS number in an origin field ("13335", "64500_64501", "{64500,64501}")
+_ORIGIN_ASN = re.compile(r'\d+')
+
+
+def _open_text(path: str):
+    """Open a plain or gzip-compressed text file"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def parse_pfx2as(lines: Iterable[str]) -> Iterable[tuple]:
+    """Yield (version, first, last, origin) ranges from RouteViews/CAIDA pfx2as lines
+
+    Each line is "prefix<TAB>length<TAB>origin", where origin is an AS number,
+    a multi-origin list joined by '_' or an AS set joined by ','.
+    """
+    for line in lines:
+        parts = line.split()
+        if len(parts) != 3 or line.startswith('#'):
+            continue
+        address, length, origin = parts
+        try:
+            length = int(length)
+            if ':' in address:
+                value = int.from_bytes(socket.inet_pton(socket.AF_INET6, address), 'big')
+                bits = 128
+                version = 6
+            else:
+                value = struct.unpack('!I', socket.inet_aton(address))[0]
+                bits = 32
+                version = 4
+        except (OSError, ValueError):
+            continue
+        if not 0 <= length <= bits or not _ORIGIN_ASN.search(origin):
+            continue
+
+        host_mask = (1 << (bits - length)) - 1
+        first = value & ~host_mask
+        yield version, first, first | host_mask, origin
+
+
+def parse_as_names(lines: Iterable[str]) -> Dict[int, str]:
+    """Parse "AS13335 CLOUDFLARENET, US" or "13335<TAB>name" lines into {asn: name}"""
+    names = {}
+    for line in lines:
+        parts = line.strip().split(None, 1)
+        if len(parts) != 2 or line.startswith('#'):
+            continue
+        number = parts[0].upper()
+        if number.startswith('AS'):
+            number = number[2:]
+        if number.isdigit():
+            names[int(number)] = parts[1].strip()
+    return names
+
+
+class AsnIndex:
+    """Offline IP-to-ASN lookups over a local prefix-to-AS dataset"""
+
+    def __init__(self, ranges: Iterable[tuple], names: Optional[Dict[int, str]] = None):
+        self.index = PrefixIndex.from_ranges(ranges)
+        self.names = names or {}
+
+    @classmethod
+    def load(cls, pfx2as_paths: List[str], names_path: Optional[str] = None) -> 'AsnIndex':
+        """Load one or more pfx2as files (IPv4 and IPv6) and an optional AS names file"""
+        def ranges():
+            for path in pfx2as_paths:
+                with _open_text(path) as handle:
+                    yield from parse_pfx2as(handle)
+
+        names = None
+        if names_path:
+            with _open_text(names_path) as handle:
+                names = parse_as_names(handle)
+        return cls(ranges(), names)
+
+    @classmethod
+    def from_env(cls) -> Optional['AsnIndex']:
+        """Load the index from ASN_PFX2AS_PATH (comma-separated) and ASN_NAMES_PATH, if configured"""
+        paths = [path.strip() for path in os.environ.get('ASN_PFX2AS_PATH', '').split(',') if path.strip()]
+        if not paths:
+            return None
+        try:
+            index = cls.load(paths, os.environ.get('ASN_NAMES_PATH'))
+        except OSError as e:
+            logging.error(f"Failed to load offline ASN data: {str(e)}")
+            return None
+        logging.info(f"Loaded offline ASN index with {len(index.index)} segments")
+        return index
+
+    def origin(self, ip: Any) -> Optional[str]:
+        """Return the raw origin field of the most specific prefix containing an ipaddress object"""
+        return self.index.lookup(ip)
+
+    def origins_many(self, ips: Any) -> List[Optional[str]]:
+        """Return origin fields for many addresses, vectorized when NumPy is available"""
+        labels = self.index.labels
+        if np is not None:
+            return [labels[code] if code >= 0 else None for code in self.index.classify_many(ips).tolist()]
+
+        origins = []
+        for ip in ips:
+            try:
+                address = ipaddress.ip_network(ip, strict=False).network_address
+            except (ValueError, TypeError):
+                origins.append(None)
+                continue
+            origins.append(self.index.lookup(address))
+        return origins
+
+    def to_result(self, ip: str, origin: str) -> Optional[Dict[str, Any]]:
+        """Build an ASNService-shaped answer from an origin field; None if it names no AS"""
+        # Multi-origin prefixes and AS sets report the first origin listed
+        match = _ORIGIN_ASN.search(origin)
+        if match is None:
+            return None
+        asn = int(match.group())
+        asn_name = self.names.get(asn, 'Unknown')
+        return {
+            'ip': ip,
+            'asn_number': f'AS{asn}',
+            'asn_name': asn_name,
+            'asn_full': f'AS{asn} {asn_name}',
+            'origins': origin,
+            'source': 'pfx2as',
+            'success': True
+        }
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Enrich large IP lists outside Flask, streaming results to stdout
+Usage: python batch_cli.py [INPUT|-] [--format ndjson|csv] [--checkpoint FILE] [--chunk-size 5000]
+                           [--workers 16] [--full] [--errors FILE] [--stats-interval 2]
+
+Input is one address or prefix per line (blank lines and # comments skipped; .gz accepted).
+Results come out in input order. With --checkpoint, the number of input lines written is
+saved every few seconds; rerunning with the same checkpoint skips them, so a killed run
+resumes without querying completed lines again. Lines written after the last checkpoint
+may be written twice (at-least-once output); set RIPESCANNER_CACHE_PATH so those are
+answered from the disk cache.
+"""
+
+import os
+import sys
+import csv
+import gzip
+import json
+import time
+import signal
+import argparse
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from rdap_service import RDAPService, GeolocationService, ASNService, BatchService
+from transport import HTTPTransport
+from disk_cache import DiskCache
+from asn_index import AsnIndex
+from geo_db import open_geo_db
+from records import as_dict
+
+
+def open_input(path: str) -> TextIO:
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+def read_chunks(handle: TextIO, chunk_size: int, skip: int = 0) -> Iterator[Tuple[List[str], List[int]]]:
+    """Yield (entries, input line numbers) chunks, skipping the first `skip` input lines"""
+    entries, numbers = [], []
+    for number, line in enumerate(handle, 1):
+        if number <= skip:
+            continue
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        entries.append(line)
+        numbers.append(number)
+        if len(entries) >= chunk_size:
+            yield entries, numbers
+            entries, numbers = [], []
+    if entries:
+        yield entries, numbers
+
+
+class Checkpoint:
+    """Count of input lines whose output has been written, saved atomically"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.lines_done = 0
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                self.lines_done = json.load(handle).get('lines_done', 0)
+
+    def save(self, lines_done: int, stats: Dict[str, Any]):
+        if not self.path:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as handle:
+            json.dump(dict(stats, lines_done=lines_done, updated_at=datetime.now().isoformat()), handle)
+        os.replace(temp_path, self.path)
+
+
+class Stats:
+    """Counters shared between the pipeline and the stderr reporter"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.results = 0
+        self.errors = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        written = self.results + self.errors
+        return {
+            'written': written,
+            'results': self.results,
+            'errors': self.errors,
+            'elapsed': round(elapsed, 1),
+            'rate': round(written / elapsed, 1) if elapsed else 0.0
+        }
+
+
+def report_stats(stats: Stats, interval: float, stop: threading.Event):
+    """Print throughput to stderr until stopped"""
+    last_written, last_time = 0, time.monotonic()
+    while not stop.wait(interval):
+        snapshot = stats.snapshot()
+        now = time.monotonic()
+        recent = (snapshot['written'] - last_written) / (now - last_time)
+        last_written, last_time = snapshot['written'], now
+        print(f"[batch] {snapshot['written']:,} lines ({snapshot['errors']:,} errors) in {snapshot['elapsed']}s  "
+              f"{recent:,.0f} lines/s now, {snapshot['rate']:,.0f} avg", file=sys.stderr, flush=True)
+
+
+def ordered_events(service: BatchService, entries: List[str], lean: bool) -> Iterator[Dict[str, Any]]:
+    """Run one chunk and yield its result/error events in input order
+
+    Lookups finish out of order; a reorder buffer holds early finishers until every line
+    before them is out, so it never grows past one chunk.
+    """
+    buffered = {}
+    next_index = 0
+    for event in service.iter_batch(entries, progress_interval=float('inf'), lean=lean, records=True):
+        if event['type'] not in ('result', 'error'):
+            continue
+        buffered[event['index']] = event
+        while next_index in buffered:
+            yield buffered.pop(next_index)
+            next_index += 1
+
+
+def build_service(workers: Optional[int]) -> BatchService:
+    """Services wired like the web app: pooled transport, rate limits, disk cache, local databases"""
+    transport = HTTPTransport.from_env()
+    disk_cache = DiskCache.from_env()
+    rdap_service = RDAPService(transport=transport, disk_cache=disk_cache)
+    geo_service = GeolocationService(transport, disk_cache, open_geo_db())
+    asn_service = ASNService(transport, disk_cache, AsnIndex.from_env())
+    return BatchService(rdap_service, geo_service, asn_service, max_workers=workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enrich IP addresses with RDAP, geolocation and ASN data')
+    parser.add_argument('input', nargs='?', default='-', help='input file (.gz accepted) or - for stdin')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson', help='output format')
+    parser.add_argument('--checkpoint', help='progress file; an existing one resumes the run')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0, help='seconds between checkpoints')
+    parser.add_argument('--chunk-size', type=int, default=5000,
+                        help='lines planned and held in memory at once (default 5000)')
+    parser.add_argument('--workers', type=int, help='concurrent upstream requests (default BATCH_MAX_WORKERS)')
+    parser.add_argument('--full', action='store_true', help='keep the raw RDAP payload in NDJSON results')
+    parser.add_argument('--errors', help='also write failed lines as NDJSON to this file (CSV output omits them)')
+    parser.add_argument('--stats-interval', type=float, default=2.0, help='seconds between stderr stats (0 disables)')
+    args = parser.parse_args()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if checkpoint.lines_done:
+        print(f"[batch] resuming after input line {checkpoint.lines_done:,}", file=sys.stderr)
+    service = build_service(args.workers)
+    stats = Stats()
+
+    # SIGTERM unwinds like Ctrl-C so the last checkpoint is still written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    out = sys.stdout
+    csv_writer = csv.writer(out) if args.format == 'csv' else None
+    if csv_writer and not checkpoint.lines_done:
+        csv_writer.writerow(BatchService.CSV_HEADER)
+    errors_out = open(args.errors, 'a', encoding='utf-8') if args.errors else None
+
+    stop = threading.Event()
+    if args.stats_interval > 0:
+        threading.Thread(target=report_stats, args=(stats, args.stats_interval, stop), daemon=True).start()
+
+    # Input lines written to stdout, and those known to have been flushed past our buffer
+    lines_done = flushed = checkpoint.lines_done
+    last_checkpoint = time.monotonic()
+    exit_code = 0
+    try:
+        with open_input(args.input) as handle:
+            for entries, numbers in read_chunks(handle, args.chunk_size, checkpoint.lines_done):
+                for event in ordered_events(service, entries, lean=not args.full):
+                    if event['type'] == 'result':
+                        stats.results += 1
+                        result = as_dict(event['result'])
+                        if csv_writer:
+                            csv_writer.writerow(service.csv_row(result))
+                        else:
+                            out.write(json.dumps(result) + '\n')
+                    else:
+                        stats.errors += 1
+                        error = {'ip': entries[event['index']], 'error': event['error']}
+                        if errors_out:
+                            errors_out.write(json.dumps(error) + '\n')
+                        if not csv_writer:
+                            out.write(json.dumps(error) + '\n')
+                    lines_done = numbers[event['index']]
+
+                    if time.monotonic() - last_checkpoint >= args.checkpoint_interval:
+                        # Output (and the error log) must reach the reader before the checkpoint claims it
+                        out.flush()
+                        if errors_out:
+                            errors_out.flush()
+                        flushed = lines_done
+                        checkpoint.save(flushed, stats.snapshot())
+                        last_checkpoint = time.monotonic()
+    except (KeyboardInterrupt, SystemExit) as e:
+        exit_code = e.code if isinstance(e, SystemExit) else 130
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head)
+        exit_code = 1
+    finally:
+        stop.set()
+        try:
+            out.flush()
+            flushed = lines_done
+        except BrokenPipeError:
+            # Point stdout at devnull so the interpreter's final flush does not fail again
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        if errors_out:
+            errors_out.close()
+        checkpoint.save(flushed, stats.snapshot())
+
+    snapshot = stats.snapshot()
+    print(f"[batch] done: {snapshot['results']:,} results, {snapshot['errors']:,} errors in "
+          f"{snapshot['elapsed']}s ({snapshot['rate']:,.0f} lines/s); input lines done: {flushed:,}",
+          file=sys.stderr)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
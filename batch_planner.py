@@ -0,0 +1,127 @@
+import ipaddress
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def canonicalize(ip_input: str) -> Tuple[Optional[Any], Optional[str]]:
+    """Return the canonical query for an input line, or a validation error
+
+    Plain addresses and host routes become an address. Wider prefixes stay an interface:
+    RDAP queries its network address while geolocation and ASN look up the host part.
+    """
+    try:
+        if '/' in ip_input:
+            interface = ipaddress.ip_interface(ip_input)
+            if interface.network.prefixlen == interface.max_prefixlen:
+                return interface.ip, None
+            return interface, None
+        return ipaddress.ip_address(ip_input), None
+    except ValueError as e:
+        return None, f'Invalid IP address or network: {str(e)}'
+
+
+def rdap_address(query: Any) -> Any:
+    """The address RDAP is queried with for a canonical query"""
+    if isinstance(query, (ipaddress.IPv4Interface, ipaddress.IPv6Interface)):
+        return query.network.network_address
+    return query
+
+
+def allocation_block(address: Any) -> int:
+    """The /24 (IPv4) or /48 (IPv6) containing an address, the smallest block registries allocate"""
+    return int(address) >> (8 if address.version == 4 else 80)
+
+
+class BatchPlan:
+    """Deduplicated, normalized work plan built before any network call"""
+
+    def __init__(self, ip_list: Iterable[str], rdap_service: Any):
+        # Non-empty input lines, in order; results fan back out to each of them
+        self.lines: List[str] = []
+        self.errors: Dict[int, str] = {}
+
+        # Canonical query addresses and the line positions each one answers
+        self.queries: List[str] = []
+        self.positions: List[List[int]] = []
+
+        # (rir, IP version, routing segment start) -> query indexes
+        self.groups: Dict[Tuple[str, int, int], List[int]] = {}
+        # Per query, the RDAP gates it waits behind: its routing group, then its allocation
+        # block. The first lookup through a gate runs alone; the rest follow once it has
+        # filled the range cache
+        self.gates: List[Tuple[Tuple[str, int, int], Tuple[int, int]]] = []
+        # Uncached allocation blocks, i.e. the RDAP calls the gated lookups are expected to make
+        self.rdap_blocks = 0
+        self.rir_breakdown: Dict[str, int] = {}
+        self.rdap_cached = 0
+        # Answers resolved from local databases, filled in by the batch service
+        self.offline = {'geolocation': 0, 'asn': 0}
+
+        unique: Dict[Any, List[int]] = {}
+        for ip in ip_list:
+            ip = ip.strip()
+            if not ip:
+                continue
+            position = len(self.lines)
+            self.lines.append(ip)
+
+            address, error = canonicalize(ip)
+            if error:
+                self.errors[position] = f"{ip}: {error}"
+            else:
+                unique.setdefault(address, []).append(position)
+
+        # Order queries by registry and routing segment so neighbouring addresses
+        # run back to back and later ones can be answered from the range cache
+        keyed = []
+        rir_index = rdap_service.rir_index
+        for query in unique:
+            address = rdap_address(query)
+            segment = rir_index.segment_int(int(address), address.version)
+            rir = rdap_service.learned_rir(address) or (segment[2] if segment else 'ARIN')
+            segment_start = segment[0] if segment else 0
+            keyed.append(((rir, address.version, segment_start), int(address), query, address))
+        keyed.sort(key=lambda item: (item[0], item[1]))
+
+        range_cache = rdap_service.range_cache
+        uncached_blocks = set()
+        for group, _, query, address in keyed:
+            index = len(self.queries)
+            block = (address.version, allocation_block(address))
+            self.queries.append(str(query))
+            self.positions.append(unique[query])
+            self.gates.append((group, block))
+            self.groups.setdefault(group, []).append(index)
+            self.rir_breakdown[group[0]] = self.rir_breakdown.get(group[0], 0) + 1
+            if range_cache.covers(address):
+                self.rdap_cached += 1
+            else:
+                uncached_blocks.add(block)
+        self.rdap_blocks = len(uncached_blocks)
+
+    @property
+    def expected_upstream_calls(self) -> Dict[str, int]:
+        """Upstream requests this plan is expected to issue
+
+        RDAP assumes one call per uncached allocation block; an allocation wider than a
+        block costs fewer, addresses in assignments narrower than one cost more.
+        """
+        calls = {
+            'rdap': self.rdap_blocks,
+            'geolocation': len(self.queries) - self.offline['geolocation'],
+            'asn': len(self.queries) - self.offline['asn']
+        }
+        calls['total'] = sum(calls.values())
+        return calls
+
+    def summary(self) -> Dict[str, Any]:
+        """Plan statistics reported alongside batch results"""
+        valid_lines = len(self.lines) - len(self.errors)
+        return {
+            'input_lines': len(self.lines),
+            'invalid_lines': len(self.errors),
+            'unique_queries': len(self.queries),
+            'duplicates_removed': valid_lines - len(self.queries),
+            'routing_groups': len(self.groups),
+            'rir_breakdown': self.rir_breakdown,
+            'expected_upstream_calls': self.expected_upstream_calls
+        }
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark scalar detect_rir against the vectorized detect_rir_many
+Usage: python benchmarks/bench_detect_rir.py [count]
+"""
+
+import os
+import sys
+import time
+import random
+import ipaddress
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rdap_service import RDAPService
+
+
+def generate_ips(count, seed=42):
+    """Generate a reproducible mix of IPv4 and IPv6 addresses"""
+    rng = random.Random(seed)
+    ips = []
+    for i in range(count):
+        if i % 10 == 0:
+            ips.append(str(ipaddress.IPv6Address((0x2000 + rng.getrandbits(12)) << 112 | rng.getrandbits(112))))
+        else:
+            ips.append(str(ipaddress.IPv4Address(rng.getrandbits(32))))
+    return ips
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    service = RDAPService()
+    ips = generate_ips(count)
+
+    start = time.perf_counter()
+    scalar = [service.detect_rir(ip) for ip in ips]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes = service.detect_rir_many(ips)
+    vector_time = time.perf_counter() - start
+
+    mismatches = sum(1 for rir, code in zip(scalar, codes) if service.rir_codes[code] != rir)
+
+    print(f"addresses:        {count}")
+    print(f"detect_rir:       {scalar_time:.3f}s ({count / scalar_time:,.0f} ips/s)")
+    print(f"detect_rir_many:  {vector_time:.3f}s ({count / vector_time:,.0f} ips/s)")
+    print(f"speedup:          {scalar_time / vector_time:.1f}x")
+    print(f"mismatches:       {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
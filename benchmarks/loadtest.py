@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Load driver reporting latency percentiles and throughput per endpoint
+Usage: python benchmarks/loadtest.py [--url http://127.0.0.1:5000 | --spawn] [--concurrency 16]
+                                     [--duration 30 | --requests N] [--endpoints lookup,enhanced,batch]
+
+--spawn starts the upstream simulator and serves the app in-process against it, so nothing
+reaches the real registries; the simulator takes the same latency and fault options as
+benchmarks/upstream_stub.py.
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import threading
+import statistics
+from itertools import cycle
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream_stub import UpstreamStub, Profile
+from run import sample_ips
+
+
+def _lookup(session, base_url, ips):
+    response = session.post(f'{base_url}/lookup', data={'ip_address': next(ips)})
+    # The form page renders errors as flash messages rather than status codes
+    return response.status_code == 200 and 'Registry scan failed' not in response.text
+
+
+def _enhanced(session, base_url, ips):
+    response = session.post(f'{base_url}/enhanced_lookup', json={'ip_address': next(ips), 'lean': True})
+    return response.status_code == 200 and response.json().get('success', False)
+
+
+def _geolocation(session, base_url, ips):
+    response = session.get(f'{base_url}/geolocation/{next(ips)}')
+    return response.status_code == 200 and response.json().get('success', False)
+
+
+def _asn(session, base_url, ips):
+    response = session.get(f'{base_url}/asn/{next(ips)}')
+    return response.status_code == 200 and response.json().get('success', False)
+
+
+def _batch(session, base_url, ips, size=20):
+    lines = '\n'.join(next(ips) for _ in range(size))
+    response = session.post(f'{base_url}/batch_lookup', data={'ip_list': lines, 'lean': 'true'})
+    return response.status_code == 200 and response.json().get('success', False)
+
+
+# name -> request function(session, base_url, ip iterator) returning whether it succeeded
+ENDPOINTS = {
+    'lookup': _lookup,
+    'enhanced': _enhanced,
+    'geolocation': _geolocation,
+    'asn': _asn,
+    'batch': _batch
+}
+
+
+class Recorder:
+    """Thread-safe latency samples and error counts per endpoint"""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, wall_time):
+        report = {}
+        for name, samples in sorted(self.latencies.items()):
+            # quantiles needs two samples; a single one is every percentile
+            cuts = statistics.quantiles(samples, n=100, method='inclusive') if len(samples) > 1 else samples * 99
+            report[name] = {
+                'requests': len(samples),
+                'errors': self.errors.get(name, 0),
+                'rps': round(len(samples) / wall_time, 2),
+                'p50_ms': round(cuts[49] * 1000, 2),
+                'p95_ms': round(cuts[94] * 1000, 2),
+                'p99_ms': round(cuts[98] * 1000, 2),
+                'max_ms': round(max(samples) * 1000, 2)
+            }
+        return report
+
+
+def run_load(base_url, endpoints, concurrency, duration=None, total=None, ip_pool=1000, batch_size=20):
+    """Drive the endpoints round-robin from `concurrency` workers; return (recorder, wall time)"""
+    recorder = Recorder()
+    pool = sample_ips(ip_pool, seed=99)
+    deadline = time.monotonic() + duration if duration else None
+    remaining = [total]
+    lock = threading.Lock()
+
+    def claim():
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        if remaining[0] is None:
+            return True
+        with lock:
+            if remaining[0] <= 0:
+                return False
+            remaining[0] -= 1
+            return True
+
+    def worker(offset):
+        session = requests.Session()
+        ips = cycle(pool[offset:] + pool[:offset])
+        names = cycle(endpoints[offset % len(endpoints):] + endpoints[:offset % len(endpoints)])
+        while claim():
+            name = next(names)
+            start = time.perf_counter()
+            try:
+                if name == 'batch':
+                    ok = _batch(session, base_url, ips, batch_size)
+                else:
+                    ok = ENDPOINTS[name](session, base_url, ips)
+            except (requests.RequestException, ValueError):
+                ok = False
+            recorder.record(name, time.perf_counter() - start, ok)
+        session.close()
+
+    # Spread the workers across the address pool so they do not all hit the same ranges
+    step = max(1, ip_pool // concurrency)
+    threads = [threading.Thread(target=worker, args=(i * step % ip_pool,), daemon=True)
+               for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def spawn_app(stub, rate_limits=None):
+    """Serve the app in-process against the simulator; return the werkzeug server"""
+    from werkzeug.serving import make_server
+
+    os.environ.update(stub.environment())
+    os.environ.setdefault('RIPESCANNER_JOBS_PATH', os.path.join(tempfile.mkdtemp(), 'jobs.db'))
+    if rate_limits is not None:
+        os.environ['RATE_LIMITS'] = rate_limits
+    # Services read the environment when the app module is imported
+    import logging
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test RIPEScanner endpoints')
+    parser.add_argument('--url', help='base URL of a running app')
+    parser.add_argument('--spawn', action='store_true', help='serve the app in-process against the simulator')
+    parser.add_argument('--endpoints', default='lookup,enhanced,batch',
+                        help=f'comma-separated mix of {", ".join(ENDPOINTS)}')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, help='seconds to run (default 30 unless --requests is given)')
+    parser.add_argument('--requests', type=int, help='total requests to send')
+    parser.add_argument('--ip-pool', type=int, default=1000, help='distinct addresses to query')
+    parser.add_argument('--batch-size', type=int, default=20, help='addresses per /batch_lookup request')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    simulator = parser.add_argument_group('simulator (--spawn)')
+    simulator.add_argument('--latency', default='lognormal:0.05:0.5', help='upstream latency distribution')
+    simulator.add_argument('--error-429', type=float, default=0.0)
+    simulator.add_argument('--error-5xx', type=float, default=0.0)
+    simulator.add_argument('--timeout-rate', type=float, default=0.0)
+    simulator.add_argument('--config', help='JSON profiles per upstream')
+    simulator.add_argument('--rate-limits', help='RATE_LIMITS for the spawned app, e.g. "rdap=1000/1000"')
+    simulator.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if not args.url and not args.spawn:
+        parser.error('pass --url or --spawn')
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error(f'unknown endpoints: {", ".join(unknown)}')
+    duration = args.duration or (None if args.requests else 30)
+
+    stub = server = None
+    base_url = args.url
+    if args.spawn:
+        if args.config:
+            stub = UpstreamStub.from_config(args.config, seed=args.seed)
+        else:
+            default = Profile(args.latency, args.error_429, args.error_5xx, args.timeout_rate)
+            stub = UpstreamStub(profiles={'default': default}, seed=args.seed)
+        stub.start()
+        server = spawn_app(stub, args.rate_limits)
+        base_url = f'http://127.0.0.1:{server.server_port}'
+
+    try:
+        recorder, wall_time = run_load(base_url.rstrip('/'), endpoints, args.concurrency, duration,
+                                       args.requests, args.ip_pool, args.batch_size)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if stub is not None:
+            stub.stop()
+
+    report = recorder.summary(wall_time)
+    if args.json:
+        output = {'concurrency': args.concurrency, 'wall_time': round(wall_time, 2), 'endpoints': report}
+        if stub is not None:
+            output['upstream'] = stub.outcomes
+        print(json.dumps(output, indent=2))
+        return 0
+
+    print(f"{'endpoint':12} {'requests':>9} {'errors':>7} {'req/s':>9} "
+          f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, row in report.items():
+        print(f"{name:12} {row['requests']:9d} {row['errors']:7d} {row['rps']:9.1f} "
+              f"{row['p50_ms']:9.1f} {row['p95_ms']:9.1f} {row['p99_ms']:9.1f} {row['max_ms']:9.1f}")
+    if stub is not None:
+        print('\nupstream outcomes: ' + json.dumps(stub.outcomes, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for lookup hot paths and end-to-end batch throughput
+Usage: python benchmarks/run.py [-k NAME] [--latency 0.02] [--save FILE] [--compare FILE] [--fail]
+
+Upstream calls go to a local stub server, never to the real registries. Save a run over
+benchmarks/baseline.json to record it; compare against it to spot regressions.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import ipaddress
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rdap_service import RDAPService, GeolocationService, ASNService, BatchService
+from batch_planner import BatchPlan
+from range_cache import RangeCache
+from prefix_index import np
+from transport import HTTPTransport
+from upstream_stub import UpstreamStub, rdap_response
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name -> (factory, kind); factories do their setup and return (callable, operations per call)
+BENCHMARKS = {}
+
+
+def benchmark(name, kind='micro'):
+    def register(factory):
+        BENCHMARKS[name] = (factory, kind)
+        return factory
+    return register
+
+
+def sample_ips(count, version=4, seed=42):
+    """Reproducible random public-looking addresses"""
+    rng = random.Random(seed)
+    if version == 6:
+        return [str(ipaddress.IPv6Address((0x2000 + rng.getrandbits(12)) << 112 | rng.getrandbits(112)))
+                for _ in range(count)]
+    return [str(ipaddress.IPv4Address(rng.randrange(1 << 24, 224 << 24))) for _ in range(count)]
+
+
+def make_services(stub=None, **batch_options):
+    """Fresh services with cold caches and no rate limiting, optionally wired to the stub"""
+    transport = HTTPTransport(rate_limiter=None)
+    rdap_service = RDAPService(transport=transport)
+    geo_service = GeolocationService(transport)
+    asn_service = ASNService(transport)
+    if stub is not None:
+        stub.attach(rdap_service, geo_service, asn_service)
+    return BatchService(rdap_service, geo_service, asn_service, **batch_options)
+
+
+# Micro benchmarks
+
+@benchmark('detect_rir_ipv4')
+def bench_detect_rir_ipv4(context):
+    service = context['service'].rdap_service
+    ips = sample_ips(1000)
+    return lambda: [service.detect_rir(ip) for ip in ips], len(ips)
+
+
+@benchmark('detect_rir_ipv6')
+def bench_detect_rir_ipv6(context):
+    service = context['service'].rdap_service
+    ips = sample_ips(1000, version=6)
+    return lambda: [service.detect_rir(ip) for ip in ips], len(ips)
+
+
+@benchmark('detect_rir_many')
+def bench_detect_rir_many(context):
+    if np is None:
+        return None
+    service = context['service'].rdap_service
+    ips = sample_ips(9000) + sample_ips(1000, version=6)
+    return lambda: service.detect_rir_many(ips), len(ips)
+
+
+@benchmark('validate_ip')
+def bench_validate_ip(context):
+    service = context['service'].rdap_service
+    inputs = (sample_ips(250) + sample_ips(250, version=6) +
+              [f'{ip}/24' for ip in sample_ips(250, seed=7)] + ['not-an-ip', '300.1.1.1'] * 125)
+    return lambda: [service.validate_ip(value) for value in inputs], len(inputs)
+
+
+@benchmark('parse_vcard')
+def bench_parse_vcard(context):
+    service = context['service'].rdap_service
+    vcard = rdap_response('192.0.2.1', 'ARIN')['entities'][0]['vcardArray']
+    return lambda: service.parse_vcard(vcard), 1
+
+
+@benchmark('format_rdap_response')
+def bench_format_rdap_response(context):
+    service = context['service'].rdap_service
+    data = rdap_response('192.0.2.1', 'ARIN')
+    return lambda: service.format_rdap_response(data, 'ARIN'), 1
+
+
+@benchmark('format_rdap_response_lean')
+def bench_format_rdap_response_lean(context):
+    service = context['service'].rdap_service
+    data = rdap_response('192.0.2.1', 'ARIN')
+    return lambda: service.format_rdap_response(data, 'ARIN', lean=True), 1
+
+
+@benchmark('batch_plan_10k')
+def bench_batch_plan(context):
+    service = context['service'].rdap_service
+    ips = sample_ips(8000) + sample_ips(2000, seed=1)
+    ips += ips[:2000]
+    return lambda: BatchPlan(ips, service), len(ips)
+
+
+@benchmark('range_cache_get')
+def bench_range_cache_get(context):
+    cache = RangeCache()
+    for ip in sample_ips(5000, seed=3):
+        network = ipaddress.ip_network(f'{ip}/24', strict=False)
+        cache.put(network.network_address, network.broadcast_address, ip)
+    addresses = [ipaddress.ip_address(ip) for ip in sample_ips(1000, seed=3)]
+    return lambda: [cache.get(address) for address in addresses], len(addresses)
+
+
+@benchmark('export_csv_1k')
+def bench_export_csv(context):
+    service = context['service']
+    rdap = service.rdap_service.format_rdap_response(rdap_response('192.0.2.1', 'ARIN'), 'ARIN', lean=True)
+    results = [{'ip': ip, 'rdap': rdap, 'geolocation': {'country_name': 'Germany', 'city': 'Berlin'},
+                'asn': {'asn_number': 'AS64500', 'asn_name': 'EXAMPLE'}} for ip in sample_ips(1000)]
+    return lambda: ''.join(service.iter_export(results, 'csv')), len(results)
+
+
+# End-to-end batches against the stub upstreams
+
+@benchmark('process_batch_cold_200', kind='batch')
+def bench_process_batch_cold(context):
+    stub = context['stub']
+    # Distinct /24s, so every address costs an RDAP call
+    ips = sample_ips(200, seed=11)
+
+    def run():
+        make_services(stub).process_batch(ips, lean=True)
+    return run, len(ips)
+
+
+@benchmark('process_batch_clustered_200', kind='batch')
+def bench_process_batch_clustered(context):
+    stub = context['stub']
+    # 20 networks of 10 addresses each: most RDAP answers come from the range cache
+    ips = [str(ipaddress.ip_address(base) + offset)
+           for base in sample_ips(20, seed=12) for offset in range(0, 100, 10)]
+
+    def run():
+        make_services(stub).process_batch(ips, lean=True)
+    return run, len(ips)
+
+
+def measure(fn, ops, min_time, rounds):
+    """Return per-operation timings (seconds) for each round, auto-ranging calls per round"""
+    def timed(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - start
+
+    # Warm up, then grow the call count until one round takes at least min_time
+    fn()
+    number = 1
+    elapsed = timed(number)
+    while elapsed < min_time and number < 1 << 20:
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9) * 1.1))
+        elapsed = timed(number)
+
+    timings = [elapsed]
+    timings.extend(timed(number) for _ in range(rounds - 1))
+    return [timing / number / ops for timing in timings]
+
+
+def _round(value):
+    """Three significant digits keep recorded baselines readable in diffs"""
+    return float(f'{value:.3g}')
+
+
+def run_benchmarks(names, latency, quick):
+    stub = UpstreamStub(latency).start()
+    context = {'stub': stub, 'service': make_services()}
+    results = {}
+    try:
+        for name in names:
+            factory, kind = BENCHMARKS[name]
+            prepared = factory(context)
+            if prepared is None:
+                print(f"{name:32} skipped")
+                continue
+            fn, ops = prepared
+            extra = {}
+            if kind == 'batch':
+                timings = measure(fn, ops, min_time=0, rounds=2 if quick else 5)
+                # RDAP requests per batch; the slowest upstream can hide them from the timings
+                before = stub.requests.get('rdap', 0)
+                fn()
+                extra['rdap_calls'] = stub.requests.get('rdap', 0) - before
+            else:
+                timings = measure(fn, ops, min_time=0.05 if quick else 0.2, rounds=3 if quick else 7)
+
+            median = statistics.median(timings)
+            results[name] = dict({
+                'kind': kind,
+                'median_us': _round(median * 1e6),
+                'min_us': _round(min(timings) * 1e6),
+                'ops_per_sec': _round(1 / median)
+            }, **extra)
+            calls = f"   {extra['rdap_calls']:6d} rdap calls" if extra else ''
+            print(f"{name:32} {median * 1e6:12.2f} us/op   {1 / median:14,.0f} ops/s{calls}")
+    finally:
+        stub.stop()
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the change against a recorded run; return the names that got slower than threshold"""
+    regressions = []
+    print(f"\n{'benchmark':32} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name, result in results.items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous:
+            print(f"{name:32} {'-':>12} {result['median_us']:12.2f}      new")
+            continue
+        ratio = result['median_us'] / previous['median_us']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 / threshold:
+            flag = '  faster'
+        print(f"{name:32} {previous['median_us']:12.2f} {result['median_us']:12.2f} {ratio - 1:+8.0%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run RIPEScanner benchmarks')
+    parser.add_argument('-k', dest='filter', help='only run benchmarks whose name contains this')
+    parser.add_argument('--latency', type=float, default=0.02, help='stub upstream latency in seconds')
+    parser.add_argument('--quick', action='store_true', help='fewer and shorter rounds')
+    parser.add_argument('--save', metavar='FILE', help=f'record results as JSON (e.g. {os.path.relpath(BASELINE)})')
+    parser.add_argument('--compare', metavar='FILE', nargs='?', const=BASELINE,
+                        help='compare with a recorded run (defaults to the baseline)')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression (default 1.25)')
+    parser.add_argument('--fail', action='store_true', help='exit non-zero when a regression is found')
+    args = parser.parse_args()
+
+    names = [name for name in BENCHMARKS if not args.filter or args.filter in name]
+    results = run_benchmarks(names, args.latency, args.quick)
+
+    if args.save:
+        record = {
+            'meta': {
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'numpy': np.__version__ if np is not None else None,
+                'latency': args.latency
+            },
+            'benchmarks': results
+        }
+        with open(args.save, 'w') as handle:
+            json.dump(record, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+        print(f"\nSaved {args.save}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.threshold)
+        if regressions and args.fail:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
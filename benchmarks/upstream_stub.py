@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Local upstream simulator: fake RDAP registries, ipinfo.io and hackertarget
+Usage: python benchmarks/upstream_stub.py [--port 8099] [--latency lognormal:0.08:0.5]
+                                          [--error-429 0.02] [--error-5xx 0.01] [--timeout-rate 0.005]
+                                          [--config profiles.json]
+
+Point the app at it with:
+    RDAP_ENDPOINT_TEMPLATE="http://127.0.0.1:8099/rdap/{rir}/ip/"
+    GEOLOCATION_API_URL="http://127.0.0.1:8099/ipinfo/{}/json"
+    ASN_API_URL="http://127.0.0.1:8099/aslookup/?q={}"
+
+A profiles file maps "default", an upstream kind ("rdap", "geolocation", "asn") or one
+registry ("rdap:RIPE") to Profile options, e.g.
+    {"default": {"latency": "lognormal:0.05:0.4"},
+     "rdap:LACNIC": {"latency": "uniform:0.2:0.6", "error_429": 0.05}}
+"""
+
+import json
+import math
+import time
+import random
+import socket
+import argparse
+import ipaddress
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+RIRS = ('ARIN', 'RIPE', 'APNIC', 'LACNIC', 'AFRINIC')
+
+
+def _vcard(name, kind='org'):
+    return ['vcard', [
+        ['version', {}, 'text', '4.0'],
+        ['fn', {}, 'text', name],
+        ['kind', {}, 'text', kind],
+        ['adr', {'label': 'Example Street 1\nExample City'}, 'text',
+         ['', '', 'Example Street 1', 'Example City', '', '12345', '']],
+        ['email', {}, 'text', 'noc@example.net'],
+        ['tel', {'type': 'voice'}, 'uri', 'tel:+1-555-0100']
+    ]]
+
+
+def rdap_response(ip, rir):
+    """A registry-shaped RDAP IP network answer covering the address's /24 (or /48)"""
+    address = ipaddress.ip_address(ip)
+    network = ipaddress.ip_network(f"{address}/{24 if address.version == 4 else 48}", strict=False)
+    start, end = str(network.network_address), str(network.broadcast_address)
+    links = [{'value': f'https://rdap.example/ip/{network}', 'rel': 'self', 'href': f'https://rdap.example/ip/{network}'}]
+    events = [{'eventAction': 'registration', 'eventDate': '2015-03-01T00:00:00Z'},
+              {'eventAction': 'last changed', 'eventDate': '2024-06-01T00:00:00Z'}]
+
+    def entity(handle, roles, name, nested=None):
+        item = {'objectClassName': 'entity', 'handle': handle, 'roles': roles,
+                'vcardArray': _vcard(name), 'links': links, 'events': events}
+        if nested:
+            item['entities'] = nested
+        return item
+
+    return {
+        'rdapConformance': ['rdap_level_0', 'cidr0', 'nro_rdap_profile_0'],
+        'objectClassName': 'ip network',
+        'handle': f'{start} - {end}',
+        'startAddress': start,
+        'endAddress': end,
+        'ipVersion': f'v{address.version}',
+        'name': f'{rir}-NET-{int(network.network_address) % 9973}',
+        'type': 'ASSIGNED PA',
+        'country': 'ZZ',
+        'cidr0_cidrs': [{f'v{address.version}prefix': start, 'length': network.prefixlen}],
+        'status': ['active'],
+        'port43': f'whois.{rir.lower()}.net',
+        'remarks': [{'description': ['Benchmark fixture network']}],
+        'notices': [{'title': 'Terms and Conditions', 'description': ['Synthetic data for benchmarks.']}],
+        'links': links,
+        'events': events,
+        'entities': [
+            entity('ORG-EX1', ['registrant'], 'Example Networks Ltd',
+                   [entity('ABUSE-EX1', ['abuse'], 'Example Abuse Desk')]),
+            entity('NOC-EX1', ['administrative', 'technical'], 'Example NOC')
+        ]
+    }
+
+
+def ipinfo_response(ip):
+    return {
+        'ip': ip, 'city': 'Example City', 'region': 'Example Region', 'country': 'DE',
+        'loc': '52.5200,13.4050', 'org': 'AS64500 Example Networks Ltd', 'postal': '10115',
+        'timezone': 'Europe/Berlin'
+    }
+
+
+def asn_response(ip):
+    return f'AS{64500 + int(ipaddress.ip_address(ip)) % 500} EXAMPLE-NET, ZZ'
+
+
+def parse_latency(spec):
+    """Turn "0.02", "fixed:S", "uniform:A:B", "lognormal:MEDIAN:SIGMA" or "exp:MEAN" into a sampler"""
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    name, _, args = str(spec).partition(':')
+    if not args:
+        value = float(name)
+        return lambda rng: value
+    params = [float(arg) for arg in args.split(':')]
+    if name == 'fixed':
+        return lambda rng: params[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == 'lognormal':
+        mu = math.log(params[0])
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    if name == 'exp':
+        return lambda rng: rng.expovariate(1 / params[0])
+    raise ValueError(f'Unknown latency distribution: {spec}')
+
+
+class Profile:
+    """Latency distribution and fault rates for one upstream"""
+
+    def __init__(self, latency=0.0, error_429=0.0, error_5xx=0.0, timeout=0.0, retry_after=1, hang=30.0):
+        self.latency = parse_latency(latency)
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        # Fraction of requests that hang for `hang` seconds, past any sane client timeout
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.hang = hang
+
+    def outcome(self, rng):
+        roll = rng.random()
+        for name, rate in (('timeout', self.timeout), ('429', self.error_429), ('5xx', self.error_5xx)):
+            if roll < rate:
+                return name
+            roll -= rate
+        return 'ok'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this Nagle's algorithm
+        # and delayed ACKs add ~40 ms to every keep-alive response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type='application/json', headers=None):
+        payload = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _route(self):
+        """Return (profile key, kind, responder) for the request path"""
+        parts = urlsplit(self.path)
+        segments = parts.path.strip('/').split('/')
+        # /rdap/<RIR>/ip/<address>, /ipinfo/<address>/json, /aslookup/?q=<address>
+        if segments[0] == 'rdap' and len(segments) >= 4:
+            return f'rdap:{segments[1]}', 'rdap', lambda: self._send(
+                200, json.dumps(rdap_response(segments[3], segments[1])), 'application/rdap+json')
+        if segments[0] == 'ipinfo' and len(segments) >= 2:
+            return 'geolocation', 'geolocation', lambda: self._send(200, json.dumps(ipinfo_response(segments[1])))
+        if segments[0] == 'aslookup':
+            return 'asn', 'asn', lambda: self._send(
+                200, asn_response(parse_qs(parts.query)['q'][0]), 'text/plain')
+        return None, None, None
+
+    def do_GET(self):
+        stub = self.server.stub
+        key, kind, respond = self._route()
+        if respond is None:
+            self._send(404, json.dumps({'errorCode': 404, 'title': 'Not Found'}))
+            return
+
+        profile = stub.profile(key)
+        outcome = profile.outcome(stub.rng)
+        stub.count(kind, outcome)
+        if outcome == 'timeout':
+            time.sleep(profile.hang)
+            self.close_connection = True
+            return
+
+        time.sleep(max(0.0, profile.latency(stub.rng)))
+        try:
+            if outcome == '429':
+                self._send(429, json.dumps({'errorCode': 429, 'title': 'Too Many Requests'}),
+                           headers={'Retry-After': str(profile.retry_after)})
+            elif outcome == '5xx':
+                status = stub.rng.choice((500, 502, 503))
+                self._send(status, json.dumps({'errorCode': status, 'title': 'Upstream Error'}))
+            else:
+                respond()
+        except (ValueError, KeyError, IndexError):
+            self._send(400, json.dumps({'errorCode': 400, 'title': 'Bad Request'}))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks and load tests open many connections at once
+    request_queue_size = 256
+
+
+class UpstreamStub:
+    """Threaded local server answering like the RDAP registries, ipinfo.io and hackertarget"""
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0, profiles=None, seed=None):
+        # Profiles are looked up by "rdap:<RIR>", then the kind, then "default"
+        self.profiles = {'default': Profile(latency)}
+        self.profiles.update(profiles or {})
+        self.rng = random.Random(seed)
+        self.server = _Server((host, port), _Handler)
+        self.server.stub = self
+        self.requests = {}
+        self.outcomes = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, path, **kwargs):
+        """Build a simulator from a JSON file of {key: Profile options}"""
+        with open(path) as handle:
+            config = json.load(handle)
+        return cls(profiles={key: Profile(**options) for key, options in config.items()}, **kwargs)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def profile(self, key):
+        return self.profiles.get(key) or self.profiles.get(key.split(':')[0]) or self.profiles['default']
+
+    def count(self, kind, outcome='ok'):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            outcomes = self.outcomes.setdefault(kind, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def rdap_endpoints(self):
+        return {rir: f'{self.base_url}/rdap/{rir}/ip/' for rir in RIRS}
+
+    def environment(self):
+        """Environment variables that point the app at this simulator"""
+        return {
+            'RDAP_ENDPOINT_TEMPLATE': self.base_url + '/rdap/{rir}/ip/',
+            'GEOLOCATION_API_URL': self.base_url + '/ipinfo/{}/json',
+            'ASN_API_URL': self.base_url + '/aslookup/?q={}'
+        }
+
+    def attach(self, rdap_service=None, geo_service=None, asn_service=None):
+        """Point services at this stub instead of the real upstreams"""
+        if rdap_service is not None:
+            rdap_service.rdap_endpoints = self.rdap_endpoints()
+        if geo_service is not None:
+            geo_service.ipinfo_url = self.base_url + '/ipinfo/{}/json'
+        if asn_service is not None:
+            asn_service.asn_api_url = self.base_url + '/aslookup/?q={}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate RDAP, ipinfo.io and hackertarget upstreams')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', default='0', help='seconds or a distribution, e.g. lognormal:0.08:0.5')
+    parser.add_argument('--error-429', type=float, default=0.0, help='fraction answered 429 with Retry-After')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='fraction answered 500/502/503')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='fraction that hang past client timeouts')
+    parser.add_argument('--config', help='JSON profiles per upstream (overrides the flags above)')
+    parser.add_argument('--seed', type=int, help='seed for reproducible latency and faults')
+    args = parser.parse_args()
+
+    if args.config:
+        stub = UpstreamStub.from_config(args.config, host=args.host, port=args.port, seed=args.seed)
+    else:
+        default = Profile(args.latency, args.error_429, args.error_5xx, args.timeout_rate)
+        stub = UpstreamStub(host=args.host, port=args.port, profiles={'default': default}, seed=args.seed)
+
+    print(f"Serving on {stub.base_url}; point the app at it with:")
+    for name, value in stub.environment().items():
+        print(f"  export {name}='{value}'")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.stop()
+        print(json.dumps(stub.outcomes, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import json
+import os
+import logging
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+# Snapshot of the IANA RDAP bootstrap registry shipped with the application
+BUNDLED_BOOTSTRAP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bootstrap')
+
+BOOTSTRAP_FILES = ('ipv4.json', 'ipv6.json')
+
+# Host labels identifying each registry's RDAP service
+RIR_HOST_LABELS = {
+    'arin': 'ARIN',
+    'ripe': 'RIPE',
+    'apnic': 'APNIC',
+    'lacnic': 'LACNIC',
+    'afrinic': 'AFRINIC'
+}
+
+
+def rir_for_url(url: str) -> Optional[str]:
+    """Return the RIR operating an RDAP base URL, if recognised"""
+    host = urlparse(url).hostname or ''
+    for label in host.lower().split('.'):
+        if label in RIR_HOST_LABELS:
+            return RIR_HOST_LABELS[label]
+    return None
+
+
+def parse_bootstrap(data: dict) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    """Parse an RFC 9224 bootstrap document into RIR ranges and RDAP IP endpoints"""
+    ranges: Dict[str, List[str]] = {}
+    endpoints: Dict[str, str] = {}
+
+    for service in data.get('services', []):
+        if len(service) < 2 or not service[1]:
+            continue
+        prefixes, urls = service[0], service[1]
+
+        # Prefer HTTPS when a registry publishes several base URLs
+        base_url = next((url for url in urls if url.startswith('https://')), urls[0])
+        if not base_url.endswith('/'):
+            base_url += '/'
+
+        rir = rir_for_url(base_url) or urlparse(base_url).hostname
+        ranges.setdefault(rir, []).extend(prefixes)
+        endpoints.setdefault(rir, f"{base_url}ip/")
+
+    return ranges, endpoints
+
+
+def load_bootstrap(directory: Optional[str] = None) -> Tuple[Dict[str, List[str]], Dict[str, str]]:
+    """Load ipv4.json and ipv6.json from a directory, falling back to the bundled snapshot"""
+    ranges: Dict[str, List[str]] = {}
+    endpoints: Dict[str, str] = {}
+
+    for filename in BOOTSTRAP_FILES:
+        path = os.path.join(directory, filename) if directory else None
+        if not path or not os.path.exists(path):
+            path = os.path.join(BUNDLED_BOOTSTRAP_DIR, filename)
+
+        with open(path, 'r', encoding='utf-8') as f:
+            file_ranges, file_endpoints = parse_bootstrap(json.load(f))
+
+        logging.debug(f"Loaded RDAP bootstrap file: {path}")
+        for rir, prefixes in file_ranges.items():
+            ranges.setdefault(rir, []).extend(prefixes)
+        for rir, url in file_endpoints.items():
+            endpoints.setdefault(rir, url)
+
+    if not ranges:
+        raise ValueError('RDAP bootstrap registry contains no address ranges')
+
+    return ranges, endpoints
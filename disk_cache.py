@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Persistent SQLite result cache shared by gunicorn workers and restarts
+Usage: python disk_cache.py PATH [--vacuum]   (purges expired entries)
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import logging
+import argparse
+import threading
+import ipaddress
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+
+class DiskCache:
+    """SQLite (WAL mode) cache for RDAP, geolocation and ASN results"""
+
+    # Seconds each kind of result stays valid
+    DEFAULT_TTLS = {
+        'rdap': 7 * 86400,
+        'geolocation': 86400,
+        'asn': 86400
+    }
+
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS results (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID''',
+        # Range bounds are zero-padded hex so text comparison orders them numerically. Width is
+        # the bit length of end - start: a range of width w containing an address starts less
+        # than 2**w below it, so each width is one short index seek
+        '''CREATE TABLE IF NOT EXISTS rdap_ranges (
+            version INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (version, width, start, end)
+        ) WITHOUT ROWID''',
+        # Widths present in rdap_ranges, so lookups only seek the ones in use
+        '''CREATE TABLE IF NOT EXISTS rdap_range_widths (
+            version INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            PRIMARY KEY (version, width)
+        ) WITHOUT ROWID''',
+        # Registries learned from RDAP referrals, for ranges the bootstrap routes elsewhere
+        '''CREATE TABLE IF NOT EXISTS rdap_routes (
+            version INTEGER NOT NULL,
+            start TEXT NOT NULL,
+            end TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            rir TEXT NOT NULL,
+            PRIMARY KEY (version, start, end)
+        ) WITHOUT ROWID'''
+    )
+
+    def __init__(self, path: str, ttls: Optional[Dict[str, float]] = None):
+        self.path = path
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self._local = threading.local()
+
+        conn = self._connection()
+        # Ranges cached before widths were recorded cannot be searched; they are only a cache
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(rdap_ranges)')]
+        if columns and 'width' not in columns:
+            conn.execute('DROP TABLE rdap_ranges')
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    @classmethod
+    def from_env(cls) -> Optional['DiskCache']:
+        """Build the cache from RIPESCANNER_CACHE_PATH and CACHE_TTL_* variables, if configured"""
+        path = os.environ.get('RIPESCANNER_CACHE_PATH')
+        if not path:
+            return None
+        ttls = {}
+        for kind in cls.DEFAULT_TTLS:
+            value = os.environ.get(f'CACHE_TTL_{kind.upper()}')
+            if value:
+                ttls[kind] = float(value)
+        return cls(path, ttls)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL lets readers in every worker proceed while one writer commits
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def _decode(payload: bytes) -> Any:
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        """Return a cached result, or None when missing or expired"""
+        try:
+            row = self._connection().execute(
+                'SELECT payload FROM results WHERE kind = ? AND key = ? AND expires_at > ?',
+                (kind, key, time.time())
+            ).fetchone()
+            return self._decode(row[0]) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache read failed: {str(e)}")
+            return None
+
+    def put(self, kind: str, key: str, value: Any):
+        """Store a result for its kind's TTL"""
+        try:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO results (kind, key, expires_at, payload) VALUES (?, ?, ?, ?)',
+                (kind, key, time.time() + self.ttls.get(kind, 86400), self._encode(value))
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache write failed: {str(e)}")
+
+    def get_range(self, ip: Any) -> Optional[Any]:
+        """Return the most specific cached RDAP response whose range contains an ipaddress object"""
+        value = int(ip)
+        bound = f'{value:032x}'
+        try:
+            conn = self._connection()
+            widths = [row[0] for row in conn.execute(
+                'SELECT width FROM rdap_range_widths WHERE version = ?', (ip.version,))]
+            if not widths:
+                return None
+            query = ' UNION ALL '.join(
+                '''SELECT start, end, payload FROM rdap_ranges
+                   WHERE version = ? AND width = ? AND start BETWEEN ? AND ? AND end >= ? AND expires_at > ?'''
+                for _ in widths)
+            now = time.time()
+            parameters = []
+            for width in widths:
+                parameters += (ip.version, width, f'{max(0, value - (1 << width) + 1):032x}', bound, bound, now)
+            rows = conn.execute(query, parameters).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache read failed: {str(e)}")
+            return None
+
+        if not rows:
+            return None
+        # The narrowest covering range wins; between equally wide ones, the one starting later
+        *_, payload = min(rows, key=lambda row: (int(row[1], 16) - int(row[0], 16), -int(row[0], 16)))
+        return self._decode(payload)
+
+    def put_range(self, start_ip: Any, end_ip: Any, value: Any):
+        """Store an RDAP response under the address range it describes"""
+        width = (int(end_ip) - int(start_ip)).bit_length()
+        try:
+            conn = self._connection()
+            # The width is recorded in the same transaction, so a purge never drops it under the row
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('INSERT OR IGNORE INTO rdap_range_widths (version, width) VALUES (?, ?)',
+                             (start_ip.version, width))
+                conn.execute(
+                    '''INSERT OR REPLACE INTO rdap_ranges (version, width, start, end, expires_at, payload)
+                       VALUES (?, ?, ?, ?, ?, ?)''',
+                    (start_ip.version, width, f'{int(start_ip):032x}', f'{int(end_ip):032x}',
+                     time.time() + self.ttls['rdap'], self._encode(value))
+                )
+                conn.execute('COMMIT')
+            except sqlite3.Error:
+                conn.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache write failed: {str(e)}")
+
+    def put_route(self, start_ip: Any, end_ip: Any, rir: str, ttl: float):
+        """Remember which registry answered for an address range"""
+        try:
+            self._connection().execute(
+                '''INSERT OR REPLACE INTO rdap_routes (version, start, end, expires_at, rir)
+                   VALUES (?, ?, ?, ?, ?)''',
+                (start_ip.version, f'{int(start_ip):032x}', f'{int(end_ip):032x}', time.time() + ttl, rir)
+            )
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache write failed: {str(e)}")
+
+    def iter_routes(self) -> Iterator[Tuple[Any, Any, str, float]]:
+        """Yield (start, end, rir, seconds left) for every live learned route"""
+        now = time.time()
+        try:
+            rows = self._connection().execute(
+                'SELECT version, start, end, expires_at, rir FROM rdap_routes WHERE expires_at > ?', (now,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Disk cache read failed: {str(e)}")
+            return
+        for version, start, end, expires_at, rir in rows:
+            address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+            yield address(int(start, 16)), address(int(end, 16)), rir, expires_at - now
+
+    def purge_expired(self) -> int:
+        """Delete every expired entry and return how many were removed"""
+        conn = self._connection()
+        now = time.time()
+        removed = conn.execute('DELETE FROM results WHERE expires_at <= ?', (now,)).rowcount
+        removed += conn.execute('DELETE FROM rdap_ranges WHERE expires_at <= ?', (now,)).rowcount
+        conn.execute('''DELETE FROM rdap_range_widths WHERE NOT EXISTS (
+                          SELECT 1 FROM rdap_ranges
+                          WHERE rdap_ranges.version = rdap_range_widths.version
+                            AND rdap_ranges.width = rdap_range_widths.width)''')
+        removed += conn.execute('DELETE FROM rdap_routes WHERE expires_at <= ?', (now,)).rowcount
+        return removed
+
+    def vacuum(self):
+        """Checkpoint the WAL and reclaim free pages"""
+        conn = self._connection()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+
+    def stats(self) -> Dict[str, int]:
+        """Number of cached entries per kind"""
+        conn = self._connection()
+        counts = dict(conn.execute('SELECT kind, COUNT(*) FROM results GROUP BY kind').fetchall())
+        counts['rdap_ranges'] = conn.execute('SELECT COUNT(*) FROM rdap_ranges').fetchone()[0]
+        counts['rdap_routes'] = conn.execute('SELECT COUNT(*) FROM rdap_routes').fetchone()[0]
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Purge expired entries from the RIPEScanner disk cache')
+    parser.add_argument('path', nargs='?', default=os.environ.get('RIPESCANNER_CACHE_PATH'),
+                        help='cache database (defaults to RIPESCANNER_CACHE_PATH)')
+    parser.add_argument('--vacuum', action='store_true', help='also checkpoint the WAL and VACUUM')
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error('no cache path given and RIPESCANNER_CACHE_PATH is not set')
+
+    cache = DiskCache(args.path)
+    removed = cache.purge_expired()
+    if args.vacuum:
+        cache.vacuum()
+    print(f"Removed {removed} expired entries; remaining: {cache.stats()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
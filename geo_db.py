@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Local geolocation databases read through memory maps
+Usage: python geo_db.py compile INPUT.csv OUTPUT.rsgeo
+"""
+
+import os
+import csv
+import sys
+import mmap
+import math
+import struct
+import logging
+import argparse
+import ipaddress
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from countries import country_name
+from prefix_index import PrefixIndex, np, pack_addresses
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+
+def location_result(ip: str, city: Optional[str], region: Optional[str], country: Optional[str],
+                    timezone: Optional[str], postal: Optional[str], latitude: Optional[float],
+                    longitude: Optional[float], org: Optional[str]) -> Dict[str, Any]:
+    """Shape a local answer like GeolocationService's ipinfo.io results"""
+    coordinates = {}
+    if latitude is not None and longitude is not None and not (math.isnan(latitude) or math.isnan(longitude)):
+        coordinates = {'latitude': latitude, 'longitude': longitude}
+
+    return {
+        'ip': ip,
+        'city': city or 'Unknown',
+        'region': region or 'Unknown',
+        'country': country or 'Unknown',
+        'country_name': country_name(country or ''),
+        'timezone': timezone or 'Unknown',
+        'coordinates': coordinates,
+        'postal': postal or 'Unknown',
+        'asn': org or 'Unknown',
+        'success': True
+    }
+
+
+class MMDBBackend:
+    """MaxMind-format (GeoIP2/GeoLite2, DB-IP, IPinfo) database opened in mmap mode"""
+
+    def __init__(self, path: str):
+        if maxminddb is None:
+            raise RuntimeError('The maxminddb package is required to read .mmdb databases')
+        # MODE_MMAP shares the file's pages between every worker process
+        self.reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        self.path = path
+
+    @staticmethod
+    def _name(record: Dict[str, Any], key: str) -> Optional[str]:
+        value = record.get(key)
+        if isinstance(value, dict):
+            return value.get('names', {}).get('en')
+        return value
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        record = self.reader.get(ip)
+        if not record:
+            return None
+
+        # GeoIP2 nests names and codes; IPinfo-style databases use flat fields
+        country = record.get('country') or record.get('registered_country')
+        if isinstance(country, dict):
+            country = country.get('iso_code')
+        subdivisions = record.get('subdivisions') or [{}]
+        region = (subdivisions[0].get('names') or {}).get('en') or record.get('region')
+        location = record.get('location') or {}
+        postal = record.get('postal')
+
+        return location_result(
+            ip,
+            self._name(record, 'city'),
+            region,
+            country,
+            location.get('time_zone') or record.get('timezone'),
+            postal.get('code') if isinstance(postal, dict) else postal,
+            location.get('latitude', record.get('latitude')),
+            location.get('longitude', record.get('longitude')),
+            record.get('autonomous_system_organization') or record.get('org') or record.get('as_name')
+        )
+
+    def lookup_many(self, ips: List[str]) -> List[Optional[Dict[str, Any]]]:
+        return [self.lookup(ip) for ip in ips]
+
+    def close(self):
+        self.reader.close()
+
+
+class CompiledGeoDB:
+    """Sorted range tables compiled from CSV, searched in place over a read-only mmap
+
+    Layout (little-endian): header, IPv4 starts/ends/record ids (uint32 columns),
+    IPv6 starts/ends (16-byte big-endian) and record ids, fixed-size records, string pool.
+    """
+
+    MAGIC = b'RSGEO\x00\x01\x00'
+    HEADER = struct.Struct('<8sIIII')
+    # city, region, country, timezone, postal, org string offsets, then latitude, longitude
+    RECORD = struct.Struct('<6I2f')
+    CSV_FIELDS = ('city', 'region', 'country', 'timezone', 'postal', 'org')
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.v4_count, self.v6_count, self.record_count, _ = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f'{path} is not a compiled geolocation database')
+
+        offset = self.HEADER.size
+        self._v4 = []
+        for _ in range(3):
+            self._v4.append(offset)
+            offset += 4 * self.v4_count
+        self._v6 = [offset, offset + 16 * self.v6_count, offset + 32 * self.v6_count]
+        offset += 36 * self.v6_count
+        self._records = offset
+        self._strings = offset + self.RECORD.size * self.record_count
+
+    def _string(self, offset: int) -> Optional[str]:
+        if not offset:
+            return None
+        position = self._strings + offset
+        length = struct.unpack_from('<H', self._map, position)[0]
+        return self._map[position + 2:position + 2 + length].decode('utf-8')
+
+    def _find_v4(self, value: int) -> int:
+        """Index of the IPv4 range containing value, or -1"""
+        starts, ends, _ = self._v4
+        low, high = 0, self.v4_count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<I', self._map, starts + 4 * middle)[0] <= value:
+                low = middle + 1
+            else:
+                high = middle
+        i = low - 1
+        if i >= 0 and value <= struct.unpack_from('<I', self._map, ends + 4 * i)[0]:
+            return i
+        return -1
+
+    def _find_v6(self, packed: bytes) -> int:
+        """Index of the IPv6 range containing a packed address, or -1"""
+        starts, ends, _ = self._v6
+        low, high = 0, self.v6_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._map[starts + 16 * middle:starts + 16 * middle + 16] <= packed:
+                low = middle + 1
+            else:
+                high = middle
+        i = low - 1
+        if i >= 0 and packed <= self._map[ends + 16 * i:ends + 16 * i + 16]:
+            return i
+        return -1
+
+    def _record_id(self, ip: str) -> int:
+        address = ipaddress.ip_address(ip)
+        if address.version == 4:
+            i = self._find_v4(int(address))
+            return struct.unpack_from('<I', self._map, self._v4[2] + 4 * i)[0] if i >= 0 else -1
+        i = self._find_v6(address.packed)
+        return struct.unpack_from('<I', self._map, self._v6[2] + 4 * i)[0] if i >= 0 else -1
+
+    def _result(self, ip: str, record_id: int) -> Dict[str, Any]:
+        fields = self.RECORD.unpack_from(self._map, self._records + self.RECORD.size * record_id)
+        city, region, country, timezone, postal, org = (self._string(offset) for offset in fields[:6])
+        # Coordinates are stored as float32; four decimals is what ipinfo.io reports
+        return location_result(ip, city, region, country, timezone, postal,
+                               round(fields[6], 4), round(fields[7], 4), org)
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        record_id = self._record_id(ip)
+        return self._result(ip, record_id) if record_id >= 0 else None
+
+    def lookup_many(self, ips: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Look up many addresses, searching the mapped tables in one vectorized pass when NumPy is available"""
+        if np is None:
+            return [self.lookup(ip) for ip in ips]
+
+        record_ids = np.full(len(ips), -1, dtype=np.int64)
+        v4_positions, v4_packed, v6_positions, v6_packed, _ = pack_addresses(ips)
+        for positions, packed, (starts, ends, records), count, dtype in (
+            (v4_positions, v4_packed, self._v4, self.v4_count, '<u4'),
+            (v6_positions, v6_packed, self._v6, self.v6_count, 'S16')
+        ):
+            if not positions or not count:
+                continue
+            # Zero-copy views over the mapped columns
+            start_column = np.frombuffer(self._map, dtype=dtype, count=count, offset=starts)
+            end_column = np.frombuffer(self._map, dtype=dtype, count=count, offset=ends)
+            record_column = np.frombuffer(self._map, dtype='<u4', count=count, offset=records)
+            if dtype == 'S16':
+                values = np.frombuffer(bytes(packed), dtype='S16')
+            else:
+                values = np.frombuffer(bytes(packed), dtype='>u4').astype('<u4')
+            i = np.searchsorted(start_column, values, side='right') - 1
+            clipped = np.maximum(i, 0)
+            matched = (i >= 0) & (values <= end_column[clipped])
+            record_ids[positions] = np.where(matched, record_column[clipped].astype(np.int64), -1)
+
+        return [self._result(ip, record_id) if record_id >= 0 else None
+                for ip, record_id in zip(ips, record_ids.tolist())]
+
+    def close(self):
+        self._map.close()
+
+    @classmethod
+    def compile(cls, rows: Iterable[Dict[str, str]], out_path: str) -> Tuple[int, int, int]:
+        """Compile CSV rows keyed by network (or start_ip/end_ip) plus location columns
+
+        Nested ranges resolve to the most specific one. Returns (IPv4 ranges, IPv6 ranges, records).
+        """
+        strings: Dict[str, int] = {}
+        pool = bytearray(b'\x00\x00')
+        records: Dict[bytes, int] = {}
+
+        def intern_string(value: Optional[str]) -> int:
+            if not value:
+                return 0
+            offset = strings.get(value)
+            if offset is None:
+                encoded = value.encode('utf-8')[:65535]
+                offset = strings[value] = len(pool)
+                pool.extend(struct.pack('<H', len(encoded)) + encoded)
+            return offset
+
+        def coordinate(value: Optional[str]) -> float:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return float('nan')
+
+        def ranges():
+            for row in rows:
+                try:
+                    if row.get('network'):
+                        network = ipaddress.ip_network(row['network'].strip(), strict=False)
+                        first, last = network.network_address, network.broadcast_address
+                    else:
+                        first = ipaddress.ip_address(row['start_ip'].strip())
+                        last = ipaddress.ip_address(row['end_ip'].strip())
+                except (KeyError, ValueError, AttributeError):
+                    continue
+                if first.version != last.version or int(first) > int(last):
+                    continue
+
+                record = cls.RECORD.pack(
+                    *(intern_string((row.get(field) or '').strip()) for field in cls.CSV_FIELDS),
+                    coordinate(row.get('latitude')), coordinate(row.get('longitude'))
+                )
+                record_id = records.setdefault(record, len(records))
+                yield first.version, int(first), int(last), record_id
+
+        index = PrefixIndex.from_ranges(ranges())
+        v4 = list(index.segments(4))
+        v6 = list(index.segments(6))
+
+        with open(out_path + '.tmp', 'wb') as out:
+            out.write(cls.HEADER.pack(cls.MAGIC, len(v4), len(v6), len(records), len(pool)))
+            out.write(struct.pack(f'<{len(v4)}I', *(start for start, _, _ in v4)))
+            out.write(struct.pack(f'<{len(v4)}I', *(end for _, end, _ in v4)))
+            out.write(struct.pack(f'<{len(v4)}I', *(record for _, _, record in v4)))
+            out.write(b''.join(start.to_bytes(16, 'big') for start, _, _ in v6))
+            out.write(b''.join(end.to_bytes(16, 'big') for _, end, _ in v6))
+            out.write(struct.pack(f'<{len(v6)}I', *(record for _, _, record in v6)))
+            out.write(b''.join(records))
+            out.write(pool)
+        # Replace atomically so running workers keep their old mapping intact
+        os.replace(out_path + '.tmp', out_path)
+        return len(v4), len(v6), len(records)
+
+
+def open_geo_db(path: Optional[str] = None) -> Optional[Any]:
+    """Open a .mmdb file with the MaxMind reader and anything else as a compiled database
+
+    Without a path, GEOLOCATION_DB_PATH is used; returns None when unset or unreadable.
+    """
+    path = path or os.environ.get('GEOLOCATION_DB_PATH')
+    if not path:
+        return None
+    try:
+        if path.endswith('.mmdb'):
+            return MMDBBackend(path)
+        return CompiledGeoDB(path)
+    except (OSError, ValueError, RuntimeError) as e:
+        logging.error(f"Failed to open geolocation database {path}: {str(e)}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile a CSV geolocation dataset for RIPEScanner')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    compile_parser = subparsers.add_parser('compile', help='compile CSV into the mmap-able format')
+    compile_parser.add_argument('input', help='CSV with network (or start_ip,end_ip), city, region, '
+                                              'country, timezone, postal, latitude, longitude, org columns')
+    compile_parser.add_argument('output', help='compiled database path')
+    args = parser.parse_args()
+
+    with open(args.input, newline='', encoding='utf-8') as handle:
+        v4, v6, records = CompiledGeoDB.compile(csv.DictReader(handle), args.output)
+    print(f"Wrote {args.output}: {v4} IPv4 ranges, {v6} IPv6 ranges, {records} distinct locations")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+SQLite-backed background batch jobs
+Usage: python jobs.py [PATH] [--ttl SECONDS] [--vacuum]   (purges finished jobs)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class JobLost(Exception):
+    """Raised when another worker has taken over a job this worker was writing"""
+
+
+class JobStore:
+    """SQLite (WAL mode) store for batch jobs and their per-line results"""
+
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            errors INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            heartbeat REAL,
+            owner TEXT,
+            error TEXT,
+            input BLOB NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (job_id, position)
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, heartbeat)',
+        'CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at)'
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+        conn = self._connection()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _encode(value: Any) -> bytes:
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def _decode(payload: bytes) -> Any:
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+    def create(self, lines: List[str], owner: Optional[str] = None) -> str:
+        """Insert a job for the given input lines and return its id
+
+        With an owner the job starts out running and claimed by it, heartbeat included.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        claimed = now if owner else None
+        self._connection().execute(
+            '''INSERT INTO jobs (id, status, total, created_at, started_at, heartbeat, owner, input)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+            (job_id, 'running' if owner else 'queued', len(lines), now, claimed, claimed, owner,
+             self._encode(lines))
+        )
+        return job_id
+
+    def claim(self, job_id: str, owner: str, stale_after: float) -> bool:
+        """Atomically take ownership of a queued job, or of a running job whose owner went silent"""
+        now = time.time()
+        cursor = self._connection().execute(
+            '''UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?,
+                   started_at = COALESCE(started_at, ?)
+               WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat < ?))''',
+            (owner, now, now, job_id, now - stale_after)
+        )
+        return cursor.rowcount == 1
+
+    def claimable(self, stale_after: float) -> List[str]:
+        """Ids of queued jobs and of running jobs with a stale heartbeat"""
+        rows = self._connection().execute(
+            '''SELECT id FROM jobs
+               WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?)
+               ORDER BY created_at''',
+            (time.time() - stale_after,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def load_input(self, job_id: str) -> List[str]:
+        row = self._connection().execute('SELECT input FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self._decode(row[0]) if row else []
+
+    def done_positions(self, job_id: str) -> set:
+        rows = self._connection().execute(
+            'SELECT position FROM job_results WHERE job_id = ?', (job_id,)
+        ).fetchall()
+        return {row[0] for row in rows}
+
+    def add_results(self, job_id: str, rows: List[tuple], owner: Optional[str] = None):
+        """Store (position, kind, value) rows and advance the job's counters and heartbeat
+
+        With an owner, nothing is written and JobLost is raised unless that owner still holds the job.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if owner is not None:
+                row = conn.execute('SELECT owner FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                if not row or row[0] != owner:
+                    raise JobLost(job_id)
+            # Replayed positions are ignored; only rows actually inserted are counted
+            inserted = errors = 0
+            for position, kind, value in rows:
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO job_results (job_id, position, kind, payload) VALUES (?, ?, ?, ?)',
+                    (job_id, position, kind, self._encode(value))
+                )
+                if cursor.rowcount:
+                    inserted += 1
+                    errors += kind == 'error'
+            conn.execute(
+                '''UPDATE jobs SET completed = completed + ?, errors = errors + ?, heartbeat = ?
+                   WHERE id = ?''',
+                (inserted, errors, time.time(), job_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def heartbeat(self, job_id: str, owner: str) -> bool:
+        """Refresh a running job's heartbeat; False once the owner no longer holds it"""
+        cursor = self._connection().execute(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ? AND status = 'running'",
+            (time.time(), job_id, owner)
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None, owner: Optional[str] = None) -> bool:
+        """Record a job's final status; with an owner, only if that owner still holds the job"""
+        query = 'UPDATE jobs SET status = ?, error = ?, finished_at = ?, heartbeat = ? WHERE id = ?'
+        params = [status, error, time.time(), time.time(), job_id]
+        if owner is not None:
+            query += ' AND owner = ?'
+            params.append(owner)
+        return self._connection().execute(query, params).rowcount == 1
+
+    def purge_finished(self, older_than: float) -> int:
+        """Delete jobs that finished more than `older_than` seconds ago, with their results"""
+        conn = self._connection()
+        cutoff = time.time() - older_than
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM job_results WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)', (cutoff,)
+            )
+            removed = conn.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,)).rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return removed
+
+    def vacuum(self):
+        """Checkpoint the WAL and reclaim free pages"""
+        conn = self._connection()
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('VACUUM')
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job row without its input"""
+        conn = self._connection()
+        row = conn.execute(
+            '''SELECT id, status, total, completed, errors, created_at, started_at, finished_at, error
+               FROM jobs WHERE id = ?''',
+            (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        keys = ('id', 'status', 'total', 'completed', 'errors', 'created_at', 'started_at', 'finished_at', 'error')
+        return dict(zip(keys, row))
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """A page of results ordered by input position"""
+        rows = self._connection().execute(
+            '''SELECT position, kind, payload FROM job_results
+               WHERE job_id = ? AND position >= ? ORDER BY position LIMIT ?''',
+            (job_id, offset, limit)
+        ).fetchall()
+        return [{'index': position, kind: self._decode(payload)} for position, kind, payload in rows]
+
+    def iter_results(self, job_id: str, kind: Optional[str] = None, batch_size: int = 500) -> Iterator[Any]:
+        """Stream stored values in position order, a keyset page at a time"""
+        conn = self._connection()
+        position = -1
+        while True:
+            rows = conn.execute(
+                '''SELECT position, kind, payload FROM job_results
+                   WHERE job_id = ? AND position > ? ORDER BY position LIMIT ?''',
+                (job_id, position, batch_size)
+            ).fetchall()
+            for position, row_kind, payload in rows:
+                if kind is None or row_kind == kind:
+                    yield self._decode(payload)
+            if len(rows) < batch_size:
+                return
+
+
+class JobManager:
+    """Runs stored batch jobs on a local worker pool and recovers jobs orphaned by dead workers"""
+
+    # Seconds finished jobs and their results are kept, and how often the watchdog purges them
+    DEFAULT_TTL = 7 * 86400
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, store: JobStore, batch_service: Any, workers: int = 2, stale_after: float = 120,
+                 ttl: Optional[float] = None):
+        self.store = store
+        self.batch_service = batch_service
+        self.stale_after = stale_after
+        self.ttl = self.DEFAULT_TTL if ttl is None else ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch-job')
+
+        # Jobs this worker is running -> event set when another worker has taken them over
+        self._held: Dict[str, threading.Event] = {}
+        self._held_lock = threading.Lock()
+        # Jobs waiting for or running on the local pool, so the watchdog does not queue them twice
+        self._queued = set()
+
+        # Periodically pick up queued jobs and jobs whose worker stopped heartbeating
+        self._watchdog = threading.Thread(target=self._watch, name='batch-job-watchdog', daemon=True)
+        self._watchdog.start()
+
+        # Heartbeats come from a timer, not from progress, so a long upstream wait
+        # (Retry-After backoff, a slow registry) does not make a live job look orphaned
+        self._heartbeat = threading.Thread(target=self._beat, name='batch-job-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    @classmethod
+    def from_env(cls, batch_service: Any, default_path: str) -> 'JobManager':
+        """Build a manager from RIPESCANNER_JOBS_PATH, BATCH_JOB_WORKERS and RIPESCANNER_JOBS_TTL"""
+        path = os.environ.get('RIPESCANNER_JOBS_PATH', default_path)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        return cls(JobStore(path), batch_service, workers=int(os.environ.get('BATCH_JOB_WORKERS', 2)),
+                   ttl=float(os.environ.get('RIPESCANNER_JOBS_TTL', cls.DEFAULT_TTL)))
+
+    def submit(self, ip_list: List[str]) -> str:
+        """Queue a batch and return its job id"""
+        lines = [ip.strip() for ip in ip_list if ip.strip()]
+        job_id = self.store.create(lines)
+        self._enqueue(job_id)
+        return job_id
+
+    def _enqueue(self, job_id: str):
+        """Run a job on the local pool unless it is already waiting or running there"""
+        with self._held_lock:
+            if job_id in self._queued:
+                return
+            self._queued.add(job_id)
+        self._executor.submit(self._run_queued, job_id)
+
+    def _run_queued(self, job_id: str):
+        try:
+            self._run(job_id)
+        finally:
+            with self._held_lock:
+                self._queued.discard(job_id)
+
+    def _watch(self):
+        last_purge = 0.0
+        while True:
+            time.sleep(self.stale_after / 2)
+            try:
+                for job_id in self.store.claimable(self.stale_after):
+                    self._enqueue(job_id)
+                # Finished jobs expire (RIPESCANNER_JOBS_TTL=0 keeps them)
+                if self.ttl > 0 and time.monotonic() - last_purge >= self.PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    removed = self.store.purge_finished(self.ttl)
+                    if removed:
+                        logging.info(f"Purged {removed} finished batch jobs")
+            except Exception as e:
+                logging.error(f"Batch job watchdog failed: {str(e)}")
+
+    def _beat(self):
+        while True:
+            time.sleep(self.stale_after / 4)
+            with self._held_lock:
+                held = list(self._held.items())
+            for job_id, lost in held:
+                try:
+                    if not self.store.heartbeat(job_id, self.owner):
+                        lost.set()
+                except Exception as e:
+                    logging.error(f"Batch job heartbeat failed: {str(e)}")
+
+    @contextmanager
+    def hold(self, job_id: str) -> Iterator[threading.Event]:
+        """Heartbeat a job this worker owns until the block exits
+
+        The yielded event is set if the job is found taken over by another worker.
+        """
+        lost = threading.Event()
+        with self._held_lock:
+            self._held[job_id] = lost
+        try:
+            yield lost
+        finally:
+            with self._held_lock:
+                self._held.pop(job_id, None)
+
+    def _run(self, job_id: str):
+        """Execute a job, skipping lines a previous owner already stored"""
+        if not self.store.claim(job_id, self.owner, self.stale_after):
+            return
+
+        try:
+            with self.hold(job_id) as lost:
+                lines = self.store.load_input(job_id)
+                done = self.store.done_positions(job_id)
+                remaining = [position for position in range(len(lines)) if position not in done]
+
+                pending = []
+                last_flush = time.monotonic()
+                for event in self.batch_service.iter_batch([lines[position] for position in remaining]):
+                    if lost.is_set():
+                        raise JobLost(job_id)
+                    if event['type'] in ('result', 'error'):
+                        position = remaining[event['index']]
+                        pending.append((position, event['type'], event[event['type']]))
+
+                    # Write in small transactions
+                    now = time.monotonic()
+                    if pending and (len(pending) >= 50 or now - last_flush >= 1):
+                        self.store.add_results(job_id, pending, self.owner)
+                        pending = []
+                        last_flush = now
+
+                if pending:
+                    self.store.add_results(job_id, pending, self.owner)
+                self.store.finish(job_id, 'done', owner=self.owner)
+
+        except JobLost:
+            logging.warning(f"Batch job {job_id} was taken over by another worker; stopping")
+        except Exception as e:
+            logging.error(f"Batch job {job_id} failed: {str(e)}")
+            self.store.finish(job_id, 'failed', str(e), owner=self.owner)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job progress with throughput and ETA"""
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+
+        throughput = None
+        eta = None
+        if job['started_at']:
+            elapsed = (job['finished_at'] or time.time()) - job['started_at']
+            if elapsed > 0 and job['completed']:
+                throughput = round(job['completed'] / elapsed, 2)
+                eta = round((job['total'] - job['completed']) / throughput, 1) if job['status'] == 'running' else 0
+
+        for key in ('created_at', 'started_at', 'finished_at'):
+            if job[key]:
+                job[key] = datetime.fromtimestamp(job[key]).isoformat()
+
+        job['progress'] = round(100.0 * job['completed'] / job['total'], 1) if job['total'] else 100.0
+        job['throughput'] = throughput
+        job['eta_seconds'] = eta
+        return job
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Purge finished jobs from the RIPEScanner job store')
+    parser.add_argument('path', nargs='?', default=os.environ.get('RIPESCANNER_JOBS_PATH'),
+                        help='job database (defaults to RIPESCANNER_JOBS_PATH)')
+    parser.add_argument('--ttl', type=float,
+                        default=float(os.environ.get('RIPESCANNER_JOBS_TTL', JobManager.DEFAULT_TTL)),
+                        help='delete jobs finished more than this many seconds ago (default RIPESCANNER_JOBS_TTL)')
+    parser.add_argument('--vacuum', action='store_true', help='also checkpoint the WAL and VACUUM')
+    args = parser.parse_args()
+
+    if not args.path:
+        parser.error('no job store path given and RIPESCANNER_JOBS_PATH is not set')
+
+    store = JobStore(args.path)
+    removed = store.purge_finished(args.ttl)
+    if args.vacuum:
+        store.vacuum()
+    print(f"Removed {removed} finished jobs")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
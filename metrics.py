@@ -0,0 +1,259 @@
+import bisect
+import math
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# (name, type, help, samples) as produced by metrics and collectors; a sample is
+# (labels, value) or (labels, value, name suffix) such as '_bucket'
+Family = Tuple[str, str, str, List[tuple]]
+
+
+class _Value:
+    """A counter or gauge value for one label set"""
+
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = float(value)
+
+
+class _Buckets:
+    """Histogram bucket counts, sum and count for one label set"""
+
+    __slots__ = ('bounds', 'counts', 'sum', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus the +Inf bucket; counts are per bucket, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _Metric:
+    """A named metric with one child value per label set"""
+
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> Any:
+        return _Value()
+
+    def labels(self, *values: str) -> Any:
+        """Return the child for a label set, creating it on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self) -> List[Tuple[Dict[str, str], Any]]:
+        with self._lock:
+            children = list(self._children.items())
+        return [(dict(zip(self.labelnames, values)), child) for values, child in children]
+
+    def collect(self) -> Iterator[Family]:
+        yield self.name, self.type_name, self.documentation, [
+            (labels, child.value) for labels, child in self._items()
+        ]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type_name = 'counter'
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, such as requests in flight"""
+
+    type_name = 'gauge'
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets"""
+
+    type_name = 'histogram'
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Optional[Sequence[float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets or self.DEFAULT_BUCKETS))
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def collect(self) -> Iterator[Family]:
+        samples = []
+        for labels, child in self._items():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((dict(labels, le=_format_value(bound)), cumulative, '_bucket'))
+            samples.append((labels, total, '_sum'))
+            samples.append((labels, cumulative, '_count'))
+        yield self.name, self.type_name, self.documentation, samples
+
+
+class Registry:
+    """Metrics and scrape-time collectors rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Optional[Sequence[float]] = None) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]):
+        """Add a callable that reports state (pool sizes, limiter tokens) when scraped"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> Iterator[Family]:
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for metric in metrics:
+            yield from metric.collect()
+        for collector in collectors:
+            yield from collector()
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, type_name, documentation, samples in self.collect():
+            lines.append(f'# HELP {name} {_escape_help(documentation)}')
+            lines.append(f'# TYPE {name} {type_name}')
+            for sample in samples:
+                labels, value = sample[0], sample[1]
+                suffix = sample[2] if len(sample) > 2 else ''
+                if labels:
+                    label_text = ','.join(f'{key}="{_escape_label(str(val))}"' for key, val in labels.items())
+                    lines.append(f'{name}{suffix}{{{label_text}}} {_format_value(value)}')
+                else:
+                    lines.append(f'{name}{suffix} {_format_value(value)}')
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _escape_label(text: str) -> str:
+    return text.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(value)
+
+
+# Process-wide registry served by /metrics; each gunicorn worker reports its own values
+REGISTRY = Registry()
+
+UPSTREAM_LATENCY = REGISTRY.histogram(
+    'ripescanner_upstream_request_duration_seconds',
+    'Latency of upstream HTTP requests, per attempt',
+    ('upstream', 'rir'),
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+UPSTREAM_ERRORS = REGISTRY.counter(
+    'ripescanner_upstream_errors_total',
+    'Failed upstream requests by reason (timeout, connection, throttled, http_4xx, http_5xx)',
+    ('upstream', 'rir', 'reason')
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    'ripescanner_upstream_in_flight',
+    'Upstream HTTP requests currently waiting for a response',
+    ('upstream',)
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    'ripescanner_cache_requests_total',
+    'Cache and local database lookups by layer (range, disk, local) and result (hit, miss)',
+    ('cache', 'kind', 'result')
+)
+RDAP_REROUTES = REGISTRY.counter(
+    'ripescanner_rdap_reroutes_total',
+    'RDAP queries sent to another registry (referral, probe) and routes learned from them (learned)',
+    ('kind',)
+)
+BATCH_LINES = REGISTRY.counter(
+    'ripescanner_batch_lines_total',
+    'Batch input lines completed, by outcome (ok, error)',
+    ('outcome',)
+)
+BATCHES = REGISTRY.counter(
+    'ripescanner_batches_total',
+    'Batches run to completion'
+)
+BATCHES_IN_PROGRESS = REGISTRY.gauge(
+    'ripescanner_batches_in_progress',
+    'Batches currently being processed'
+)
+BATCH_DURATION = REGISTRY.histogram(
+    'ripescanner_batch_duration_seconds',
+    'Wall time of completed batches',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+)
@@ -0,0 +1,225 @@
+import bisect
+import heapq
+import socket
+import ipaddress
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PrefixIndex:
+    """Compiled longest-prefix-match index over IPv4 and IPv6 prefixes"""
+
+    def __init__(self, prefixes: Iterable[Tuple[str, Any]]):
+        ranges = []
+        for prefix, label in prefixes:
+            try:
+                network = ipaddress.ip_network(prefix, strict=False)
+            except ValueError:
+                continue
+            ranges.append((network.version, int(network.network_address),
+                           int(network.broadcast_address), label))
+        self._build(ranges)
+
+    @classmethod
+    def from_mapping(cls, mapping: Dict[Any, List[str]]) -> 'PrefixIndex':
+        """Build an index from a {label: [prefix, ...]} mapping"""
+        return cls((prefix, label) for label, prefixes in mapping.items() for prefix in prefixes)
+
+    @classmethod
+    def from_ranges(cls, ranges: Iterable[Tuple[int, int, int, Any]]) -> 'PrefixIndex':
+        """Build an index from (version, first, last, label) integer ranges, skipping prefix parsing"""
+        index = cls.__new__(cls)
+        index._build(ranges)
+        return index
+
+    def _build(self, ranges: Iterable[Tuple[int, int, int, Any]]):
+        # Distinct values are stored once and referenced by integer code
+        self.labels: List[Any] = []
+        label_codes: Dict[Any, int] = {}
+
+        intervals = {4: [], 6: []}
+        for version, start, end, label in ranges:
+            code = label_codes.get(label)
+            if code is None:
+                code = label_codes[label] = len(self.labels)
+                self.labels.append(label)
+            intervals[version].append((start, end, code))
+
+        # IPv4 bounds fit in 32-bit arrays, IPv6 bounds stay as Python ints
+        self._tables = {
+            4: self._compile(intervals[4], array('I'), array('I')),
+            6: self._compile(intervals[6], [], [])
+        }
+        self._np_tables = None
+
+    @staticmethod
+    def _compile(intervals: list, starts, ends) -> tuple:
+        """Flatten overlapping ranges into disjoint segments owned by the narrowest range covering them
+
+        Nested prefixes resolve to the most specific one. Ranges that overlap only partially
+        resolve the same way RangeCache does: the narrower range wins and equal widths keep the
+        range given first. A range given twice counts only where it was given last.
+        """
+        codes = array('I')
+
+        def emit(start: int, end: int, code: int):
+            # Merge with the previous segment when contiguous and identically labelled
+            if codes and codes[-1] == code and ends[-1] + 1 == start:
+                ends[-1] = end
+                return
+            starts.append(start)
+            ends.append(end)
+            codes.append(code)
+
+        entries = sorted([(start, end - start, order, end, code)
+                          for order, (start, end, code) in enumerate(intervals)])
+
+        # Sweep in address order with a heap of the ranges covering the cursor, narrowest on
+        # top. The owner only changes when a range starts or the top one ends
+        covering = []
+        cursor = 0
+
+        def advance(limit: int):
+            nonlocal cursor
+            while covering and cursor < limit:
+                span, order, end, code = covering[0]
+                if end < cursor:
+                    heapq.heappop(covering)
+                    continue
+                stop = min(end, limit - 1)
+                emit(cursor, stop, code)
+                cursor = stop + 1
+
+        for (start, span, order, end, code), following in zip(entries, entries[1:] + [(None, None)]):
+            # Only the last copy of a repeated range counts
+            if following[0] == start and following[1] == span:
+                continue
+            advance(start)
+            cursor = start
+            heapq.heappush(covering, (span, order, end, code))
+        advance(1 << 128)
+
+        return starts, ends, codes
+
+    def lookup_int(self, value: int, version: int) -> Optional[Any]:
+        """Return the label of the most specific prefix containing an integer address"""
+        starts, ends, codes = self._tables[version]
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return self.labels[codes[i]]
+        return None
+
+    def segment_int(self, value: int, version: int) -> Optional[Tuple[int, int, Any]]:
+        """Return (start, end, label) of the compiled segment containing an integer address"""
+        starts, ends, codes = self._tables[version]
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return starts[i], ends[i], self.labels[codes[i]]
+        return None
+
+    def segments(self, version: int) -> Iterable[Tuple[int, int, Any]]:
+        """Yield the compiled (start, end, label) segments of one IP version in address order"""
+        starts, ends, codes = self._tables[version]
+        for start, end, code in zip(starts, ends, codes):
+            yield start, end, self.labels[code]
+
+    def lookup(self, ip: Any) -> Optional[Any]:
+        """Return the label of the most specific prefix containing an ipaddress object"""
+        return self.lookup_int(int(ip), ip.version)
+
+    def _numpy_tables(self) -> dict:
+        """Build NumPy copies of the compiled segments on first vectorized use"""
+        if self._np_tables is None:
+            v4_starts, v4_ends, v4_codes = self._tables[4]
+            v6_starts, v6_ends, v6_codes = self._tables[6]
+            # IPv6 bounds are compared as 16-byte big-endian strings, which sort numerically
+            self._np_tables = {
+                4: (np.array(v4_starts, dtype=np.uint32),
+                    np.array(v4_ends, dtype=np.uint32),
+                    np.array(v4_codes, dtype=np.int32)),
+                6: (np.array([value.to_bytes(16, 'big') for value in v6_starts], dtype='S16'),
+                    np.array([value.to_bytes(16, 'big') for value in v6_ends], dtype='S16'),
+                    np.array(v6_codes, dtype=np.int32))
+            }
+        return self._np_tables
+
+    def _classify_packed(self, values, version: int):
+        """Vectorized lookup of packed addresses, returning label codes or -1"""
+        starts, ends, codes = self._numpy_tables()[version]
+        if not len(starts):
+            return np.full(len(values), -1, dtype=np.int32)
+        i = np.searchsorted(starts, values, side='right') - 1
+        clipped = np.maximum(i, 0)
+        matched = (i >= 0) & (values <= ends[clipped])
+        return np.where(matched, codes[clipped], -1).astype(np.int32)
+
+    def classify_many(self, ips: Any):
+        """Classify many addresses in one vectorized pass, returning label codes or -1"""
+        if np is None:
+            raise RuntimeError('NumPy is required for vectorized prefix lookups')
+
+        # Integer arrays are taken to be IPv4 addresses already in host order
+        if isinstance(ips, np.ndarray) and ips.dtype.kind in 'ui':
+            return self._classify_packed(ips.astype(np.uint32, copy=False), 4)
+
+        return self.classify_packed(pack_addresses(ips))
+
+    def classify_packed(self, packed: tuple):
+        """Classify the output of pack_addresses, so several indexes can share one parsing pass"""
+        v4_positions, v4_packed, v6_positions, v6_packed, count = packed
+        result = np.full(count, -1, dtype=np.int32)
+        if v4_positions:
+            values = np.frombuffer(bytes(v4_packed), dtype='>u4').astype(np.uint32)
+            result[v4_positions] = self._classify_packed(values, 4)
+        if v6_positions:
+            values = np.frombuffer(bytes(v6_packed), dtype='S16')
+            result[v6_positions] = self._classify_packed(values, 6)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._tables[4][2]) + len(self._tables[6][2])
+
+
+def pack_addresses(ips: Iterable[Any]) -> tuple:
+    """Split addresses into packed IPv4 and IPv6 buffers with their input positions"""
+    v4_positions, v6_positions = [], []
+    v4_packed, v6_packed = bytearray(), bytearray()
+    count = 0
+
+    for position, ip in enumerate(ips):
+        count = position + 1
+        if isinstance(ip, bytes):
+            ip = ip.decode('ascii', 'ignore')
+
+        # inet_pton handles the common spellings without building ipaddress objects
+        try:
+            v4_packed += socket.inet_pton(socket.AF_INET, ip)
+            v4_positions.append(position)
+            continue
+        except (OSError, TypeError):
+            pass
+        try:
+            v6_packed += socket.inet_pton(socket.AF_INET6, ip)
+            v6_positions.append(position)
+            continue
+        except (OSError, TypeError):
+            pass
+
+        # CIDR notation and other spellings classify by their network address
+        try:
+            address = ipaddress.ip_network(ip, strict=False).network_address
+        except (ValueError, TypeError):
+            continue
+        if address.version == 4:
+            v4_packed += address.packed
+            v4_positions.append(position)
+        else:
+            v6_packed += address.packed
+            v6_positions.append(position)
+
+    return v4_positions, v4_packed, v6_positions, v6_packed, count
@@ -0,0 +1,204 @@
+import heapq
+import bisect
+import time
+import ipaddress
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class RangeCache:
+    """TTL cache keyed by address intervals, answering any address inside a cached range"""
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 50000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # (version, start, end) -> (value, expires_at)
+        self._entries: Dict[Tuple[int, int, int], Tuple[Any, float]] = {}
+        # (expires_at, key) min-heap; refreshed or removed keys leave stale items behind
+        # that are skipped when popped
+        self._expiry: List[Tuple[float, Tuple[int, int, int]]] = []
+
+        # Disjoint segments per IP version; each segment lists the intervals
+        # covering it, most specific (smallest) first
+        self._segments = {4: ([], [], []), 6: ([], [], [])}
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+        # Bumped whenever an interval is added or removed, so derived indexes know to rebuild
+        self.changes = 0
+
+    def _find(self, value: int, version: int) -> Optional[Tuple[Any]]:
+        """Return (value,) for the most specific live interval containing value, dropping expired ones"""
+        starts, ends, owners = self._segments[version]
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            now = time.monotonic()
+            for key in list(owners[i]):
+                cached, expires_at = self._entries[key]
+                if expires_at > now:
+                    return (cached,)
+                self._remove(key)
+        return None
+
+    def get(self, ip: Any) -> Optional[Any]:
+        """Return the value of the most specific live interval containing an ipaddress object"""
+        with self._lock:
+            found = self._find(int(ip), ip.version)
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return found[0]
+
+    def covers(self, ip: Any) -> bool:
+        """Whether a live interval contains the address, without touching the hit counters"""
+        with self._lock:
+            return self._find(int(ip), ip.version) is not None
+
+    def put(self, start_ip: Any, end_ip: Any, value: Any, ttl: Optional[float] = None):
+        """Cache a value for every address from start_ip to end_ip inclusive"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or start_ip.version != end_ip.version or int(start_ip) > int(end_ip):
+            return
+
+        key = (start_ip.version, int(start_ip), int(end_ip))
+        with self._lock:
+            known = key in self._entries
+            expires_at = time.monotonic() + ttl
+            self._entries[key] = (value, expires_at)
+            heapq.heappush(self._expiry, (expires_at, key))
+            self.changes += 1
+            if len(self._expiry) > 2 * len(self._entries) + 1024:
+                self._compact_expiry()
+            if not known:
+                self._index(key)
+                if len(self._entries) > self.max_entries:
+                    self._evict()
+
+    def _split(self, version: int, point: int):
+        """Make point the start of a segment boundary if it falls inside a segment"""
+        starts, ends, owners = self._segments[version]
+        i = bisect.bisect_right(starts, point) - 1
+        if i >= 0 and starts[i] < point <= ends[i]:
+            starts.insert(i + 1, point)
+            ends.insert(i + 1, ends[i])
+            owners.insert(i + 1, list(owners[i]))
+            ends[i] = point - 1
+
+    def _index(self, key: Tuple[int, int, int]):
+        """Add an interval to the segment index"""
+        version, start, end = key
+        span = end - start
+        starts, ends, owners = self._segments[version]
+
+        self._split(version, start)
+        self._split(version, end + 1)
+
+        i = bisect.bisect_left(starts, start)
+        position = start
+        while position <= end:
+            if i < len(starts) and starts[i] == position:
+                # Keep owners ordered by span so the most specific interval is checked first
+                spans = [owner[2] - owner[1] for owner in owners[i]]
+                owners[i].insert(bisect.bisect_right(spans, span), key)
+                position = ends[i] + 1
+            else:
+                gap_end = min(end, starts[i] - 1) if i < len(starts) else end
+                starts.insert(i, position)
+                ends.insert(i, gap_end)
+                owners.insert(i, [key])
+                position = gap_end + 1
+            i += 1
+
+    def _remove(self, key: Tuple[int, int, int]):
+        """Drop an interval from the entries and the segment index"""
+        self._entries.pop(key, None)
+        self.changes += 1
+        version, start, end = key
+        starts, ends, owners = self._segments[version]
+
+        i = bisect.bisect_left(starts, start)
+        while i < len(starts) and starts[i] <= end:
+            if key in owners[i]:
+                owners[i].remove(key)
+            if not owners[i]:
+                del starts[i], ends[i], owners[i]
+            else:
+                i += 1
+
+    def _compact_expiry(self):
+        """Rebuild the expiry heap from live entries, dropping stale items"""
+        self._expiry = [(expires_at, key) for key, (_, expires_at) in self._entries.items()]
+        heapq.heapify(self._expiry)
+
+    def _evict(self):
+        """Drop expired intervals, then the oldest ones, until under capacity"""
+        self.purge_expired()
+        while len(self._entries) > self.max_entries:
+            # Dicts keep insertion order, so the first key is the oldest interval
+            self._remove(next(iter(self._entries)))
+
+    def purge_expired(self) -> int:
+        """Remove every expired interval and return how many were dropped"""
+        with self._lock:
+            now = time.monotonic()
+            removed = 0
+            # Only the expired prefix of the heap is touched, so a full cache costs O(k log n) per put
+            while self._expiry and self._expiry[0][0] <= now:
+                expires_at, key = heapq.heappop(self._expiry)
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == expires_at:
+                    self._remove(key)
+                    removed += 1
+            return removed
+
+    def clear(self):
+        """Remove every cached interval"""
+        with self._lock:
+            self._entries.clear()
+            self.changes += 1
+            self._expiry = []
+            self._segments = {4: ([], [], []), 6: ([], [], [])}
+
+    def intervals(self) -> List[Tuple[int, int, int, Any, float]]:
+        """Live (version, start, end, value, monotonic expiry) intervals"""
+        with self._lock:
+            now = time.monotonic()
+            return [(version, start, end, value, expires_at)
+                    for (version, start, end), (value, expires_at) in self._entries.items() if expires_at > now]
+
+    def stats(self) -> Dict[str, Any]:
+        """Entry count and hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'segments': len(self._segments[4][0]) + len(self._segments[6][0]),
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def rdap_response_range(rdap_data: Dict[str, Any]) -> Optional[Tuple[Any, Any]]:
+    """Extract the (start, end) address interval an RDAP IP network response covers"""
+    try:
+        if 'startAddress' in rdap_data and 'endAddress' in rdap_data:
+            return (ipaddress.ip_address(rdap_data['startAddress']),
+                    ipaddress.ip_address(rdap_data['endAddress']))
+
+        # Fall back to the span of the cidr0 extension blocks
+        networks: List[Any] = []
+        for block in rdap_data.get('cidr0_cidrs', []):
+            prefix = block.get('v4prefix') or block.get('v6prefix')
+            if prefix is not None:
+                networks.append(ipaddress.ip_network(f"{prefix}/{block.get('length')}", strict=False))
+        if networks and len({network.version for network in networks}) == 1:
+            return (min(network.network_address for network in networks),
+                    max(network.broadcast_address for network in networks))
+    except (ValueError, TypeError, AttributeError):
+        pass
+    return None
@@ -0,0 +1,153 @@
+import os
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+class TokenBucket:
+    """Token bucket that schedules callers instead of rejecting them"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # Set when the upstream tells us to back off (429 / Retry-After)
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+        # Counters exposed through RateLimiter.snapshot()
+        self.granted = 0
+        self.delayed = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return how long the caller must wait before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            # Tokens may go negative: each caller reserves its slot in the queue
+            self.tokens -= 1
+            delay = max(-self.tokens / self.rate if self.tokens < 0 else 0.0, self.blocked_until - now)
+            self.granted += 1
+            if delay > 0:
+                self.delayed += 1
+                self.wait_seconds += delay
+            return delay
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, seconds: float):
+        """Hold every caller back for at least the given number of seconds"""
+        with self.lock:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current bucket state and counters"""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'tokens': round(self.tokens, 3),
+                'blocked_for': round(max(0.0, self.blocked_until - now), 3),
+                'granted': self.granted,
+                'delayed': self.delayed,
+                'throttled': self.throttled,
+                'wait_seconds': round(self.wait_seconds, 3)
+            }
+
+
+class RateLimiter:
+    """Per-upstream token buckets keyed by RDAP registry and enrichment provider"""
+
+    # requests per second, burst; 'rdap' is the default for registries without their own entry
+    DEFAULT_LIMITS = {
+        'rdap': (5.0, 10.0),
+        'geolocation': (10.0, 20.0),
+        'asn': (1.0, 2.0)
+    }
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 backoff_base: float = 1.0, backoff_cap: float = 60.0):
+        self.limits = dict(self.DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> 'RateLimiter':
+        """Build a limiter from RATE_LIMITS, e.g. "rdap:RIPE=10/20,asn=0.5/1" (rate/burst)"""
+        limits = {}
+        for item in os.environ.get('RATE_LIMITS', '').split(','):
+            if '=' not in item:
+                continue
+            key, value = item.split('=', 1)
+            rate, _, burst = value.partition('/')
+            limits[key.strip()] = (float(rate), float(burst or rate))
+        return cls(limits)
+
+    def bucket(self, key: str) -> TokenBucket:
+        """Return the bucket for an upstream key such as 'rdap:RIPE' or 'asn'"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate, burst = self.limits.get(key) or self.limits.get(key.split(':')[0], (5.0, 10.0))
+                    bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def acquire(self, key: str):
+        """Wait for a token from the upstream's bucket"""
+        self.bucket(key).acquire()
+
+    def backoff(self, key: str, attempt: int, retry_after: Optional[str] = None) -> float:
+        """Record a throttling response and return the delay imposed on the upstream"""
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            # Exponential backoff with jitter so workers do not retry in lockstep
+            delay = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+        delay = min(delay, self.backoff_cap)
+        self.bucket(key).penalize(delay)
+        return delay
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """State of every bucket that has seen traffic"""
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.snapshot() for key, bucket in sorted(buckets.items())}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given as delta-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
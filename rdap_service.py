@@ -1,89 +1,112 @@
+import io
+import os
+import csv
+import json
+import time
+import functools
 import ipaddress
+import threading
+import contextvars
 import requests
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from typing import Dict, Any, Union
+from typing import Dict, Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple, Union
+from urllib.parse import urljoin
+from bootstrap import load_bootstrap, rir_for_url
+from prefix_index import PrefixIndex, np, pack_addresses
+from range_cache import RangeCache, rdap_response_range
+from disk_cache import DiskCache
+from singleflight import SingleFlight
+from batch_planner import BatchPlan
+from asn_index import AsnIndex
+from countries import country_name
+from records import BatchRecord, as_dict
+from transport import HTTPTransport, get_default_transport
+from timing import phase, sampled
+from metrics import CACHE_REQUESTS, RDAP_REROUTES, BATCH_LINES, BATCHES, BATCHES_IN_PROGRESS, BATCH_DURATION
 
 class RDAPService:
     """Service for handling RDAP lookups with automatic RIR detection"""
     
-    def __init__(self):
-        # RDAP endpoints for different RIRs
-        self.rdap_endpoints = {
-            'ARIN': 'https://rdap.arin.net/registry/ip/',
-            'RIPE': 'https://rdap.db.ripe.net/ip/',
-            'APNIC': 'https://rdap.apnic.net/ip/',
-            'LACNIC': 'https://rdap.lacnic.net/rdap/ip/',
-            'AFRINIC': 'https://rdap.afrinic.net/rdap/ip/'
-        }
+    # Compact codes returned by detect_rir_many; unknown registries are appended per instance
+    RIR_CODES = ('ARIN', 'RIPE', 'APNIC', 'LACNIC', 'AFRINIC')
+    
+    # RDAP 3xx referrals followed for one query before giving up
+    MAX_REFERRALS = 3
+    # Other registries asked after a 404 before the address is reported as not found
+    MAX_PROBES = 2
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    
+    def __init__(self, bootstrap_dir: Optional[str] = None, transport: Optional[HTTPTransport] = None,
+                 range_cache: Optional[RangeCache] = None, disk_cache: Optional[DiskCache] = None):
+        # Pooled keep-alive HTTP transport shared with the other services
+        self.transport = transport or get_default_transport()
         
-        # IP ranges for each RIR (simplified ranges for demonstration)
-        # In production, you would use IANA's bootstrap registry
-        self.rir_ranges = {
-            'ARIN': [
-                # North America
-                '3.0.0.0/8', '4.0.0.0/8', '6.0.0.0/8', '7.0.0.0/8', '8.0.0.0/8',
-                '9.0.0.0/8', '11.0.0.0/8', '12.0.0.0/8', '13.0.0.0/8', '15.0.0.0/8',
-                '16.0.0.0/8', '17.0.0.0/8', '18.0.0.0/8', '19.0.0.0/8', '20.0.0.0/8',
-                '21.0.0.0/8', '22.0.0.0/8', '23.0.0.0/8', '24.0.0.0/8', '26.0.0.0/8',
-                '28.0.0.0/8', '29.0.0.0/8', '30.0.0.0/8', '32.0.0.0/8', '33.0.0.0/8',
-                '34.0.0.0/8', '35.0.0.0/8', '38.0.0.0/8', '40.0.0.0/8', '44.0.0.0/8',
-                '47.0.0.0/8', '48.0.0.0/8', '50.0.0.0/8', '52.0.0.0/8', '54.0.0.0/8',
-                '55.0.0.0/8', '56.0.0.0/8', '63.0.0.0/8', '64.0.0.0/8', '65.0.0.0/8',
-                '66.0.0.0/8', '67.0.0.0/8', '68.0.0.0/8', '69.0.0.0/8', '70.0.0.0/8',
-                '71.0.0.0/8', '72.0.0.0/8', '73.0.0.0/8', '74.0.0.0/8', '75.0.0.0/8',
-                '76.0.0.0/8', '96.0.0.0/8', '97.0.0.0/8', '98.0.0.0/8', '99.0.0.0/8',
-                '100.0.0.0/8', '104.0.0.0/8', '107.0.0.0/8', '108.0.0.0/8', '173.0.0.0/8',
-                '174.0.0.0/8', '184.0.0.0/8', '192.0.0.0/8', '198.0.0.0/8', '199.0.0.0/8',
-                '204.0.0.0/8', '205.0.0.0/8', '206.0.0.0/8', '207.0.0.0/8', '208.0.0.0/8',
-                '209.0.0.0/8', '216.0.0.0/8',
-                # IPv6 ranges for ARIN
-                '2001:400::/23', '2001:1800::/23', '2600::/12', '2610::/23', '2620::/23'
-            ],
-            'RIPE': [
-                # Europe, Middle East, Central Asia
-                '2.0.0.0/8', '5.0.0.0/8', '25.0.0.0/8', '31.0.0.0/8', '37.0.0.0/8',
-                '46.0.0.0/8', '51.0.0.0/8', '53.0.0.0/8', '57.0.0.0/8', '62.0.0.0/8',
-                '77.0.0.0/8', '78.0.0.0/8', '79.0.0.0/8', '80.0.0.0/8', '81.0.0.0/8',
-                '82.0.0.0/8', '83.0.0.0/8', '84.0.0.0/8', '85.0.0.0/8', '86.0.0.0/8',
-                '87.0.0.0/8', '88.0.0.0/8', '89.0.0.0/8', '90.0.0.0/8', '91.0.0.0/8',
-                '92.0.0.0/8', '93.0.0.0/8', '94.0.0.0/8', '95.0.0.0/8', '109.0.0.0/8',
-                '176.0.0.0/8', '178.0.0.0/8', '185.0.0.0/8', '188.0.0.0/8', '193.0.0.0/8',
-                '194.0.0.0/8', '195.0.0.0/8', '212.0.0.0/8', '213.0.0.0/8', '217.0.0.0/8',
-                # IPv6 ranges for RIPE
-                '2001:600::/23', '2001:1400::/23', '2001:2000::/19', '2a00::/12'
-            ],
-            'APNIC': [
-                # Asia Pacific
-                '1.0.0.0/8', '14.0.0.0/8', '27.0.0.0/8', '36.0.0.0/8', '39.0.0.0/8',
-                '42.0.0.0/8', '43.0.0.0/8', '49.0.0.0/8', '58.0.0.0/8', '59.0.0.0/8',
-                '60.0.0.0/8', '61.0.0.0/8', '101.0.0.0/8', '103.0.0.0/8', '106.0.0.0/8',
-                '110.0.0.0/8', '111.0.0.0/8', '112.0.0.0/8', '113.0.0.0/8', '114.0.0.0/8',
-                '115.0.0.0/8', '116.0.0.0/8', '117.0.0.0/8', '118.0.0.0/8', '119.0.0.0/8',
-                '120.0.0.0/8', '121.0.0.0/8', '122.0.0.0/8', '123.0.0.0/8', '124.0.0.0/8',
-                '125.0.0.0/8', '126.0.0.0/8', '133.0.0.0/8', '150.0.0.0/8', '153.0.0.0/8',
-                '163.0.0.0/8', '171.0.0.0/8', '175.0.0.0/8', '180.0.0.0/8', '182.0.0.0/8',
-                '183.0.0.0/8', '202.0.0.0/8', '203.0.0.0/8', '210.0.0.0/8', '211.0.0.0/8',
-                '218.0.0.0/8', '219.0.0.0/8', '220.0.0.0/8', '221.0.0.0/8', '222.0.0.0/8',
-                '223.0.0.0/8',
-                # IPv6 ranges for APNIC
-                '2001:200::/23', '2001:c00::/23', '2400::/12'
-            ],
-            'LACNIC': [
-                # Latin America and Caribbean
-                '177.0.0.0/8', '179.0.0.0/8', '181.0.0.0/8', '186.0.0.0/8', '187.0.0.0/8',
-                '189.0.0.0/8', '190.0.0.0/8', '191.0.0.0/8', '200.0.0.0/8', '201.0.0.0/8',
-                # IPv6 ranges for LACNIC
-                '2001:1200::/23', '2800::/12'
-            ],
-            'AFRINIC': [
-                # Africa
-                '41.0.0.0/8', '102.0.0.0/8', '105.0.0.0/8', '154.0.0.0/8', '155.0.0.0/8',
-                '156.0.0.0/8', '196.0.0.0/8', '197.0.0.0/8',
-                # IPv6 ranges for AFRINIC
-                '2001:4200::/23', '2c00::/12'
-            ]
-        }
+        # Optional SQLite cache shared with other worker processes
+        self.disk_cache = disk_cache
+        
+        # Identical in-flight queries wait on a single upstream request
+        self.inflight = SingleFlight()
+        
+        # RDAP responses cached by the address range they describe (RDAP_CACHE_TTL=0 disables)
+        self.range_cache = range_cache or RangeCache(
+            ttl=float(os.environ.get('RDAP_CACHE_TTL', 86400)),
+            max_entries=int(os.environ.get('RDAP_CACHE_SIZE', 50000))
+        )
+        
+        # Serialises bootstrap reloads; readers never take the lock
+        self._routing_lock = threading.Lock()
+        self.rir_codes = list(self.RIR_CODES)
+        
+        # RDAP endpoints and IP ranges for each RIR come from IANA's bootstrap registry
+        self.reload_bootstrap(bootstrap_dir or os.environ.get('RDAP_BOOTSTRAP_DIR'))
+        
+        # Registries learned from referrals and probes, consulted before the bootstrap
+        # (RDAP_ROUTE_TTL=0 disables learning); persisted in the disk cache when configured
+        self.route_ttl = float(os.environ.get('RDAP_ROUTE_TTL', 30 * 86400))
+        self.route_overrides = RangeCache(ttl=self.route_ttl,
+                                          max_entries=int(os.environ.get('RDAP_ROUTE_OVERRIDES', 100000)))
+        # (changes, first expiry, (PrefixIndex, RIR codes)) built by _learned_route_index
+        self._compiled_routes = None
+        
+        # Addresses no registry knows, answered with the original 404 until RDAP_NEGATIVE_TTL
+        # passes (0 disables), so repeated lookups and range scans do not probe every registry again
+        self.max_probes = int(os.environ.get('RDAP_MAX_PROBES', self.MAX_PROBES))
+        self.not_found = RangeCache(ttl=float(os.environ.get('RDAP_NEGATIVE_TTL', 3600)),
+                                    max_entries=int(os.environ.get('RDAP_NEGATIVE_SIZE', 50000)))
+        if self.disk_cache:
+            for start_ip, end_ip, rir, ttl in self.disk_cache.iter_routes():
+                self.route_overrides.put(start_ip, end_ip, rir, ttl=min(ttl, self.route_ttl))
+    
+    def reload_bootstrap(self, bootstrap_dir: Optional[str] = None):
+        """Load the IANA bootstrap registry and hot-swap the routing table"""
+        ranges, endpoints = load_bootstrap(bootstrap_dir)
+        
+        # RDAP_ENDPOINT_TEMPLATE (e.g. "http://127.0.0.1:8099/rdap/{rir}/ip/") redirects every
+        # registry, for pointing the service at a local upstream simulator
+        template = os.environ.get('RDAP_ENDPOINT_TEMPLATE')
+        if template:
+            endpoints = {rir: template.format(rir=rir) for rir in endpoints}
+        
+        # Compile the ranges once into a longest-prefix-match index
+        rir_index = PrefixIndex.from_mapping(ranges)
+        
+        # Swap whole objects so concurrent lookups see either the old or the new table
+        with self._routing_lock:
+            for rir in rir_index.labels:
+                if rir not in self.rir_codes:
+                    self.rir_codes.append(rir)
+            # Index label codes translate to RIR codes; the trailing entry is the ARIN fallback
+            code_table = [self.rir_codes.index(rir) for rir in rir_index.labels]
+            code_table.append(self.rir_codes.index('ARIN'))
+            
+            self.rdap_endpoints = endpoints
+            self.rir_ranges = ranges
+            self._rir_code_table = (rir_index, code_table)
+            self.rir_index = rir_index
+        
+        logging.info(f"RDAP routing table loaded: {len(rir_index)} segments, {len(endpoints)} registries")
     
     def validate_ip(self, ip_input: str) -> Dict[str, Any]:
         """Validate IP address or network"""
@@ -124,64 +147,230 @@ class RDAPService:
                 # It's an IP address
                 ip = ipaddress.ip_address(ip_input)
             
-            # Check against each RIR's ranges
-            for rir, ranges in self.rir_ranges.items():
-                for range_str in ranges:
-                    try:
-                        range_network = ipaddress.ip_network(range_str)
-                        if ip in range_network:
-                            return rir
-                    except ValueError:
-                        continue
+            # A registry learned from an earlier referral wins over the bootstrap
+            rir = self.learned_rir(ip) or self.rir_index.lookup(ip)
+            if rir:
+                return rir
             
-            # Default fallback - try ARIN first for unknown ranges
+            # Default fallback - try ARIN first for unknown ranges; a 404 there probes the others
             return 'ARIN'
             
         except ValueError:
             # If we can't parse the IP, default to ARIN
             return 'ARIN'
     
+    def detect_rir_many(self, ips: Any):
+        """Detect the RIR for many addresses at once, returning an array of RIR codes"""
+        if np is None:
+            raise RuntimeError('NumPy is required for bulk RIR detection')
+        
+        rir_index, code_table = self._rir_code_table
+        code_table = np.asarray(code_table, dtype=np.uint8)
+        overrides = self._learned_route_index()
+        
+        # Addresses are parsed once and classified against both the bootstrap and the learned routes
+        if isinstance(ips, np.ndarray) and ips.dtype.kind in 'ui':
+            found = rir_index.classify_many(ips)
+            learned = overrides[0].classify_many(ips) if overrides else None
+        else:
+            packed = pack_addresses(ips)
+            found = rir_index.classify_packed(packed)
+            learned = overrides[0].classify_packed(packed) if overrides else None
+        
+        # Unmatched addresses come back as -1, which selects the ARIN fallback entry
+        codes = code_table[found]
+        if learned is not None:
+            # A registry learned from an earlier referral wins over the bootstrap
+            codes = np.where(learned >= 0, overrides[1][np.maximum(learned, 0)], codes)
+        return codes
+    
+    def _learned_route_index(self) -> Optional[Tuple[PrefixIndex, Any]]:
+        """Learned routes compiled for vectorized lookups, as (index, RIR code per label)
+        
+        Rebuilt when a route is learned or dropped, or when the first compiled route expires.
+        """
+        if not len(self.route_overrides):
+            return None
+        compiled = self._compiled_routes
+        if compiled is not None and compiled[0] == self.route_overrides.changes and time.monotonic() < compiled[1]:
+            return compiled[2]
+        
+        changes = self.route_overrides.changes
+        intervals = self.route_overrides.intervals()
+        if not intervals:
+            return None
+        index = PrefixIndex.from_ranges((version, start, end, rir) for version, start, end, rir, _ in intervals)
+        with self._routing_lock:
+            for rir in index.labels:
+                if rir not in self.rir_codes:
+                    self.rir_codes.append(rir)
+        rir_codes = np.asarray([self.rir_codes.index(rir) for rir in index.labels], dtype=np.uint8)
+        self._compiled_routes = (changes, min(expires_at for *_, expires_at in intervals), (index, rir_codes))
+        return index, rir_codes
+    
+    def learned_rir(self, ip: Any) -> Optional[str]:
+        """Return the registry a referral taught us for an ipaddress object, if any"""
+        if not len(self.route_overrides):
+            return None
+        return self.route_overrides.get(ip)
+    
+    def learn_route(self, start_ip: Any, end_ip: Any, rir: str):
+        """Route every address from start_ip to end_ip to the registry that answered for them"""
+        if self.route_ttl <= 0:
+            return
+        self.route_overrides.put(start_ip, end_ip, rir)
+        if self.disk_cache:
+            self.disk_cache.put_route(start_ip, end_ip, rir, self.route_ttl)
+        RDAP_REROUTES.labels('learned').inc()
+        logging.info(f"Learned RDAP route {start_ip} - {end_ip} -> {rir}")
+    
+    def registry_for_url(self, url: str) -> Optional[str]:
+        """Return the registry whose RDAP service a referral URL points at"""
+        location = url.split('://', 1)[-1]
+        for rir, base_url in self.rdap_endpoints.items():
+            if location.startswith(base_url.split('://', 1)[-1]):
+                return rir
+        rir = rir_for_url(url)
+        return rir if rir in self.rdap_endpoints else None
+    
     def query_rdap(self, ip_input: str, rir: str) -> Dict[str, Any]:
         """Query RDAP endpoint for the given IP and RIR"""
+        return self.resolve_rdap(ip_input, rir)[0]
+    
+    def resolve_rdap(self, ip_input: str, rir: str) -> Tuple[Dict[str, Any], str]:
+        """Query RDAP starting at the given RIR; return the response and the registry that answered"""
         try:
             # Extract IP address from input
             if '/' in ip_input:
-                network = ipaddress.ip_network(ip_input, strict=False)
-                ip = str(network.network_address)
+                address = ipaddress.ip_network(ip_input, strict=False).network_address
             else:
-                ip = str(ipaddress.ip_address(ip_input))
+                address = ipaddress.ip_address(ip_input)
+            ip = str(address)
             
-            # Construct RDAP URL
-            base_url = self.rdap_endpoints.get(rir)
-            if not base_url:
-                return {'error': f'Unknown RIR: {rir}'}
+            with phase('rdap_cache'):
+                cached = self._cached_rdap(address)
+            if cached is not None:
+                return cached, rir
             
-            url = f"{base_url}{ip}"
+            missing = self.not_found.get(address) if len(self.not_found) else None
+            if missing is not None:
+                CACHE_REQUESTS.labels('negative', 'rdap', 'hit').inc()
+                return {'error': missing, 'status_code': 404}, rir
             
-            # Make the request
-            logging.info(f"Querying RDAP: {url}")
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
+            if rir not in self.rdap_endpoints:
+                return {'error': f'Unknown RIR: {rir}'}, rir
             
-            return response.json()
+            # Concurrent lookups for the same address and starting registry share one upstream
+            # request; a caller asking a different registry explicitly gets its own
+            with phase('rdap_fetch'):
+                return self.inflight.do((rir, ip), self._fetch_rdap, ip, rir)
             
         except requests.exceptions.RequestException as e:
             logging.error(f"RDAP request failed: {str(e)}")
-            return {'error': f'RDAP request failed: {str(e)}'}
+            error = {'error': f'RDAP request failed: {str(e)}'}
+            status_code = getattr(e.response, 'status_code', None)
+            if status_code is not None:
+                error['status_code'] = status_code
+            if isinstance(e, requests.exceptions.HTTPError) and status_code == 404:
+                self.not_found.put(address, address, error['error'])
+            return error, rir
         except Exception as e:
             logging.error(f"Unexpected error in RDAP query: {str(e)}")
-            return {'error': f'Unexpected error: {str(e)}'}
+            return {'error': f'Unexpected error: {str(e)}'}, rir
     
-    def format_rdap_response(self, rdap_data: Dict[str, Any], rir: str) -> Dict[str, Any]:
-        """Format RDAP response for display"""
+    def _cached_rdap(self, address: Any) -> Optional[Dict[str, Any]]:
+        """Answer from the range cache, then the shared disk cache"""
+        # An earlier response whose address range covers this IP answers it
+        cached = self.range_cache.get(address)
+        if cached is not None:
+            CACHE_REQUESTS.labels('range', 'rdap', 'hit').inc()
+            return cached
+        CACHE_REQUESTS.labels('range', 'rdap', 'miss').inc()
+        
+        # Another worker (or an earlier run) may already have fetched this range
+        if self.disk_cache:
+            cached = self.disk_cache.get_range(address)
+            if cached is not None:
+                CACHE_REQUESTS.labels('disk', 'rdap', 'hit').inc()
+                address_range = rdap_response_range(cached)
+                if address_range:
+                    self.range_cache.put(*address_range, cached)
+                return cached
+            CACHE_REQUESTS.labels('disk', 'rdap', 'miss').inc()
+        return None
+    
+    def _fetch_rdap(self, ip: str, rir: str) -> Tuple[Dict[str, Any], str]:
+        """Fetch an RDAP response, following referrals and probing other registries on 404
+        
+        When a registry other than the first one asked answers, its address range is
+        learned so later lookups in that range go straight to it.
+        """
+        url = f"{self.rdap_endpoints[rir]}{ip}"
+        first_rir = rir
+        tried = {rir}
+        referrals = 0
+        probes = 0
+        # The 404 from the registry routing chose, reported if no probe finds the address
+        not_found = None
+        
+        while True:
+            logging.info(f"Querying RDAP: {url}")
+            # Redirects are followed here so the answering registry is known and rate limited
+            response = self.transport.get(url, upstream=f'rdap:{rir}', allow_redirects=False)
+            location = response.headers.get('Location')
+            
+            if response.status_code in self.REDIRECT_STATUSES and location and referrals < self.MAX_REFERRALS:
+                referrals += 1
+                url = urljoin(url, location)
+                rir = self.registry_for_url(url) or rir
+                tried.add(rir)
+                RDAP_REROUTES.labels('referral').inc()
+                continue
+            
+            if response.status_code == 404:
+                if not_found is None:
+                    not_found = response
+                # The bootstrap (or ARIN fallback) may have guessed wrong; ask a few registries
+                # not tried yet. Private and reserved space is in no registry, so it is not probed
+                untried = [name for name in self.rdap_endpoints if name not in tried]
+                if untried and probes < self.max_probes and ipaddress.ip_address(ip).is_global:
+                    probes += 1
+                    rir = untried[0]
+                    tried.add(rir)
+                    url = f"{self.rdap_endpoints[rir]}{ip}"
+                    RDAP_REROUTES.labels('probe').inc()
+                    continue
+                response = not_found
+            
+            response.raise_for_status()
+            if response.status_code in self.REDIRECT_STATUSES:
+                raise requests.exceptions.TooManyRedirects(f'More than {self.MAX_REFERRALS} RDAP referrals for {ip}')
+            break
+        
+        rdap_data = response.json()
+        
+        # Remember the response for every address in its allocation
+        address_range = rdap_response_range(rdap_data)
+        if address_range:
+            self.range_cache.put(*address_range, rdap_data)
+            if self.disk_cache:
+                self.disk_cache.put_range(*address_range, rdap_data)
+            if rir != first_rir:
+                self.learn_route(*address_range, rir)
+        
+        return rdap_data, rir
+    
+    def format_rdap_response(self, rdap_data: Dict[str, Any], rir: str, lean: bool = False) -> Dict[str, Any]:
+        """Format RDAP response for display; lean results leave out raw_data"""
         if 'error' in rdap_data:
             return rdap_data
         
         formatted = {
             'rir': rir,
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC'),
-            'raw_data': rdap_data
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S UTC')
         }
+        if not lean:
+            formatted['raw_data'] = rdap_data
         
         # Extract key information
         if 'name' in rdap_data:
@@ -193,29 +382,48 @@ class RDAPService:
         if 'cidr0_cidrs' in rdap_data:
             formatted['cidr_blocks'] = rdap_data['cidr0_cidrs']
         
-        # Extract organization information
-        if 'entities' in rdap_data:
-            for entity in rdap_data['entities']:
-                if 'roles' in entity and 'registrant' in entity['roles']:
-                    if 'vcardArray' in entity:
-                        formatted['organization'] = self.parse_vcard(entity['vcardArray'])
-                    break
-        
-        # Extract contact information
-        formatted['contacts'] = []
-        if 'entities' in rdap_data:
-            for entity in rdap_data['entities']:
-                if 'roles' in entity:
-                    contact = {
-                        'roles': entity['roles'],
-                        'handle': entity.get('handle', 'N/A')
-                    }
-                    if 'vcardArray' in entity:
-                        contact.update(self.parse_vcard(entity['vcardArray']))
-                    formatted['contacts'].append(contact)
+        # Walk entities once, breadth first so top-level entities come before the
+        # ones nested inside them (e.g. abuse contacts under the registrant)
+        contacts = []
+        registrant_seen = False
+        entities = list(rdap_data.get('entities') or ())
+        for entity in entities:
+            if not isinstance(entity, dict):
+                continue
+            if entity.get('entities'):
+                entities.extend(entity['entities'])
+            
+            if 'roles' not in entity:
+                continue
+            roles = entity['roles']
+            vcard = self.parse_vcard(entity['vcardArray']) if 'vcardArray' in entity else None
+            
+            # Organization comes from the first registrant
+            if not registrant_seen and 'registrant' in roles:
+                registrant_seen = True
+                if vcard is not None:
+                    formatted['organization'] = dict(vcard)
+            
+            contact = {
+                'roles': roles,
+                'handle': entity.get('handle', 'N/A')
+            }
+            if vcard is not None:
+                contact.update(vcard)
+            contacts.append(contact)
         
+        formatted['contacts'] = contacts
         return formatted
     
+    # vCard properties copied into parsed contacts
+    VCARD_FIELDS = {
+        'fn': 'name',
+        'org': 'organization',
+        'email': 'email',
+        'tel': 'phone',
+        'adr': 'address'
+    }
+    
     def parse_vcard(self, vcard_array: list) -> Dict[str, str]:
         """Parse vCard data from RDAP response"""
         vcard_info = {}
@@ -223,53 +431,207 @@ class RDAPService:
         if len(vcard_array) < 2:
             return vcard_info
         
-        vcard_data = vcard_array[1]
-        
-        for item in vcard_data:
+        fields = self.VCARD_FIELDS
+        for item in vcard_array[1]:
             if len(item) >= 4:
-                field_name = item[0].lower()
+                key = fields.get(item[0].lower())
+                if key is None:
+                    continue
                 field_value = item[3]
-                
-                if field_name == 'fn':
-                    vcard_info['name'] = field_value
-                elif field_name == 'org':
-                    vcard_info['organization'] = field_value
-                elif field_name == 'email':
-                    vcard_info['email'] = field_value
-                elif field_name == 'tel':
-                    vcard_info['phone'] = field_value
-                elif field_name == 'adr':
-                    if isinstance(field_value, list):
-                        address_parts = [part for part in field_value if part]
-                        vcard_info['address'] = ', '.join(address_parts)
-                    else:
-                        vcard_info['address'] = field_value
+                if key == 'address' and isinstance(field_value, list):
+                    field_value = ', '.join(part for part in field_value if part)
+                vcard_info[key] = field_value
         
         return vcard_info
     
-    def lookup(self, ip_input: str) -> Dict[str, Any]:
+    def lookup(self, ip_input: str, lean: bool = False) -> Dict[str, Any]:
         """Perform complete RDAP lookup"""
         # Validate input
-        validation = self.validate_ip(ip_input)
+        with phase('validate'):
+            validation = self.validate_ip(ip_input)
         if not validation['valid']:
             return {'error': validation['message']}
         
         # Detect RIR
-        rir = self.detect_rir(ip_input)
+        with phase('detect_rir'):
+            rir = self.detect_rir(ip_input)
         
-        # Query RDAP
-        rdap_data = self.query_rdap(ip_input, rir)
+        # Query RDAP (timed as rdap_cache and rdap_fetch); a referral may change the registry
+        rdap_data, rir = self.resolve_rdap(ip_input, rir)
         
         # Format response
-        return self.format_rdap_response(rdap_data, rir)
+        with phase('format'):
+            return self.format_rdap_response(rdap_data, rir, lean)
+    
+    # Range scans stop after this many lookups so sparse IPv6 space cannot run away, or at
+    # the deadline (seconds); either way the result carries a cursor to resume from
+    SCAN_MAX_LOOKUPS = 4096
+    SCAN_DEADLINE = 30.0
+    SCAN_MAX_DEADLINE = 120.0
+    
+    def scan_range(self, prefix: str, max_workers: int = 8, max_lookups: Optional[int] = None,
+                   deadline: Optional[float] = None, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Map every distinct allocation inside a prefix by walking RDAP responses
+        
+        A walker queries one address and jumps to the endAddress + 1 of the network that
+        answers, so RDAP calls follow the number of allocations rather than addresses. The
+        prefix is split into sub-ranges walked in parallel under the usual rate limits; an
+        allocation straddling sub-ranges is reported once per call. Only the networks RDAP
+        returns at the walked addresses are seen, not more specific assignments nested inside
+        them. A scan cut short by the lookup budget or the deadline returns a `cursor`
+        listing the unwalked ranges; passing it back continues the scan.
+        """
+        try:
+            network = ipaddress.ip_network(prefix, strict=False)
+        except ValueError as e:
+            return {'error': f'Invalid IP network: {str(e)}'}
+        
+        started = time.monotonic()
+        address_type = ipaddress.IPv4Address if network.version == 4 else ipaddress.IPv6Address
+        lookup_limit = int(os.environ.get('RDAP_SCAN_MAX_LOOKUPS', self.SCAN_MAX_LOOKUPS))
+        max_lookups = min(max_lookups or lookup_limit, lookup_limit)
+        deadline = min(deadline or float(os.environ.get('RDAP_SCAN_DEADLINE', self.SCAN_DEADLINE)),
+                       self.SCAN_MAX_DEADLINE)
+        stop_at = started + deadline
+        
+        # Addresses without an answer are skipped a /24 (IPv4) or /48 (IPv6) at a time
+        gap_bits = 8 if network.version == 4 else 80
+        
+        if cursor:
+            ranges = self._parse_scan_cursor(cursor, network)
+            if isinstance(ranges, str):
+                return {'error': ranges}
+        else:
+            # Equal power-of-two sub-ranges, one per worker, no smaller than the gap step
+            split_bits = min((max(1, max_workers) - 1).bit_length(),
+                             max(0, network.max_prefixlen - gap_bits - network.prefixlen))
+            ranges = [(int(subnet.network_address), int(subnet.broadcast_address))
+                      for subnet in network.subnets(prefixlen_diff=split_bits)]
+        
+        allocations: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        # Unanswered /24s (/48s): gaps are confirmed (404, or no range in the answer), errors
+        # are failed lookups (throttling, timeouts, 5xx after the transport's retries)
+        gaps = []
+        errors = []
+        remaining = []
+        lock = threading.Lock()
+        budget = {'lookups': 0}
+        
+        def claim() -> bool:
+            with lock:
+                if budget['lookups'] >= max_lookups or time.monotonic() >= stop_at:
+                    return False
+                budget['lookups'] += 1
+                return True
+        
+        def walk(cursor: int, end: int):
+            while cursor <= end:
+                if not claim():
+                    with lock:
+                        remaining.append((cursor, end))
+                    return
+                ip = str(address_type(cursor))
+                # Allocations found by another walker come back from the range cache
+                rdap_data, rir = self.resolve_rdap(ip, self.detect_rir(ip))
+                address_range = None if 'error' in rdap_data else rdap_response_range(rdap_data)
+                
+                if address_range is None or not int(address_range[0]) <= cursor <= int(address_range[1]):
+                    gap_end = min(end, (((cursor >> gap_bits) + 1) << gap_bits) - 1)
+                    failed = 'error' in rdap_data and rdap_data.get('status_code') != 404
+                    with lock:
+                        (errors if failed else gaps).append(
+                            (cursor, gap_end, rdap_data.get('error', 'No address range in RDAP response')))
+                    cursor = gap_end + 1
+                    continue
+                
+                key = (int(address_range[0]), int(address_range[1]))
+                with lock:
+                    if key not in allocations:
+                        allocations[key] = self._allocation_entry(rdap_data, rir, *address_range)
+                cursor = key[1] + 1
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ranges))),
+                                thread_name_prefix='rdap-scan') as executor:
+            # Surface the first unexpected walker failure
+            for future in [executor.submit(walk, start, end) for start, end in ranges]:
+                future.result()
+        
+        def merged(spans):
+            """Merge neighbouring spans, keeping the first error"""
+            merged_spans = []
+            for start, end, error in sorted(spans):
+                if merged_spans and merged_spans[-1][1] + 1 == start:
+                    merged_spans[-1][1] = end
+                else:
+                    merged_spans.append([start, end, error])
+            return [{'start': str(address_type(start)), 'end': str(address_type(end)), 'error': error}
+                    for start, end, error in merged_spans]
+        
+        return {
+            'prefix': str(network),
+            'allocations': [allocations[key] for key in sorted(allocations)],
+            'gaps': merged(gaps),
+            'errors': merged(errors),
+            'lookups': budget['lookups'],
+            'truncated': bool(remaining),
+            'cursor': ','.join(f'{address_type(start)}-{address_type(end)}'
+                               for start, end in sorted(remaining)) or None,
+            'elapsed': round(time.monotonic() - started, 3)
+        }
+    
+    def _parse_scan_cursor(self, cursor: str, network: Any) -> Any:
+        """Ranges from a scan cursor ("start-end,..."), or an error message"""
+        ranges = []
+        try:
+            for span in cursor.split(','):
+                start, end = (ipaddress.ip_address(part.strip()) for part in span.split('-'))
+                if start > end or start not in network or end not in network:
+                    return f'Scan cursor range {span} is not inside {network}'
+                ranges.append((int(start), int(end)))
+        except ValueError as e:
+            return f'Invalid scan cursor: {str(e)}'
+        return ranges
+    
+    def _allocation_entry(self, rdap_data: Dict[str, Any], rir: str, start_ip: Any, end_ip: Any) -> Dict[str, Any]:
+        """Compact description of one allocation for a range scan"""
+        organization = self.format_rdap_response(rdap_data, rir, lean=True).get('organization') or {}
+        return {
+            'start': str(start_ip),
+            'end': str(end_ip),
+            'cidrs': [str(block) for block in ipaddress.summarize_address_range(start_ip, end_ip)],
+            'rir': rir,
+            'handle': rdap_data.get('handle'),
+            'name': rdap_data.get('name'),
+            'type': rdap_data.get('type'),
+            'country': rdap_data.get('country'),
+            'organization': organization.get('organization') or organization.get('name')
+        }
+
+
+def record_local_lookups(kind: str, answers: list):
+    """Count hits and misses of one bulk local-database pass"""
+    hits = sum(answer is not None for answer in answers)
+    CACHE_REQUESTS.labels('local', kind, 'hit').inc(hits)
+    CACHE_REQUESTS.labels('local', kind, 'miss').inc(len(answers) - hits)
 
 
 class GeolocationService:
     """Service for IP geolocation intelligence"""
     
-    def __init__(self):
+    def __init__(self, transport: Optional[HTTPTransport] = None, disk_cache: Optional[DiskCache] = None,
+                 database: Optional[Any] = None, http_fallback: Optional[bool] = None):
         # Using ipinfo.io as the primary geolocation service
-        self.ipinfo_url = "http://ipinfo.io/{}/json"
+        self.ipinfo_url = os.environ.get('GEOLOCATION_API_URL', "http://ipinfo.io/{}/json")
+        self.transport = transport or get_default_transport()
+        self.disk_cache = disk_cache
+        self.inflight = SingleFlight()
+        
+        # Optional memory-mapped local database (MMDB or compiled CSV); with one configured,
+        # misses only go to ipinfo.io when GEOLOCATION_HTTP_FALLBACK is set
+        self.database = database
+        if http_fallback is None:
+            http_fallback = os.environ.get('GEOLOCATION_HTTP_FALLBACK', '').lower() in ('1', 'true', 'yes')
+        self.http_fallback = http_fallback or database is None
         
     def get_location_data(self, ip_address: str) -> Dict[str, Any]:
         """Get geolocation data for an IP address"""
@@ -280,193 +642,570 @@ class GeolocationService:
             # Validate IP address
             ipaddress.ip_address(clean_ip)
             
-            # Query ipinfo.io for geolocation data
-            url = self.ipinfo_url.format(clean_ip)
-            response = requests.get(url, timeout=10)
+            if self.database:
+                location = self.database.lookup(clean_ip)
+                if location is not None:
+                    CACHE_REQUESTS.labels('local', 'geolocation', 'hit').inc()
+                    return location
+                CACHE_REQUESTS.labels('local', 'geolocation', 'miss').inc()
+                if not self.http_fallback:
+                    return {'success': False, 'error': 'IP address not found in local geolocation database'}
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Extract coordinates if available
-                coordinates = {}
-                if 'loc' in data:
-                    try:
-                        lat, lon = data['loc'].split(',')
-                        coordinates = {
-                            'latitude': float(lat),
-                            'longitude': float(lon)
-                        }
-                    except:
-                        coordinates = {}
-                
-                return {
-                    'ip': clean_ip,
-                    'city': data.get('city', 'Unknown'),
-                    'region': data.get('region', 'Unknown'),
-                    'country': data.get('country', 'Unknown'),
-                    'country_name': self._get_country_name(data.get('country', '')),
-                    'timezone': data.get('timezone', 'Unknown'),
-                    'coordinates': coordinates,
-                    'postal': data.get('postal', 'Unknown'),
-                    'asn': data.get('org', 'Unknown'),
-                    'success': True
-                }
-            else:
-                return {'success': False, 'error': f'Geolocation service returned status {response.status_code}'}
+            if self.disk_cache:
+                cached = self.disk_cache.get('geolocation', clean_ip)
+                if cached is not None:
+                    CACHE_REQUESTS.labels('disk', 'geolocation', 'hit').inc()
+                    return cached
+                CACHE_REQUESTS.labels('disk', 'geolocation', 'miss').inc()
+            
+            # Concurrent lookups for the same IP share one upstream request
+            return self.inflight.do(clean_ip, self._fetch_location, clean_ip)
                 
         except Exception as e:
             logging.error(f"Geolocation lookup failed: {str(e)}")
             return {'success': False, 'error': f'Geolocation lookup failed: {str(e)}'}
     
+    def lookup_offline_many(self, ips: list) -> list:
+        """Answer many IPs from the local database in one pass; None marks a miss"""
+        if not self.database:
+            return [None] * len(ips)
+        locations = self.database.lookup_many([ip.split('/')[0] for ip in ips])
+        record_local_lookups('geolocation', locations)
+        return locations
+    
+    def _fetch_location(self, clean_ip: str) -> Dict[str, Any]:
+        """Query ipinfo.io and shape the geolocation result"""
+        # Query ipinfo.io for geolocation data
+        url = self.ipinfo_url.format(clean_ip)
+        response = self.transport.get(url, upstream='geolocation')
+        
+        if response.status_code == 200:
+            data = response.json()
+            
+            # Extract coordinates if available
+            coordinates = {}
+            if 'loc' in data:
+                try:
+                    lat, lon = data['loc'].split(',')
+                    coordinates = {
+                        'latitude': float(lat),
+                        'longitude': float(lon)
+                    }
+                except:
+                    coordinates = {}
+            
+            location = {
+                'ip': clean_ip,
+                'city': data.get('city', 'Unknown'),
+                'region': data.get('region', 'Unknown'),
+                'country': data.get('country', 'Unknown'),
+                'country_name': self._get_country_name(data.get('country', '')),
+                'timezone': data.get('timezone', 'Unknown'),
+                'coordinates': coordinates,
+                'postal': data.get('postal', 'Unknown'),
+                'asn': data.get('org', 'Unknown'),
+                'success': True
+            }
+            
+            if self.disk_cache:
+                self.disk_cache.put('geolocation', clean_ip, location)
+            return location
+        else:
+            return {'success': False, 'error': f'Geolocation service returned status {response.status_code}'}
+    
     def _get_country_name(self, country_code: str) -> str:
         """Convert country code to full country name"""
-        country_names = {
-            'US': 'United States', 'CA': 'Canada', 'GB': 'United Kingdom',
-            'DE': 'Germany', 'FR': 'France', 'JP': 'Japan', 'CN': 'China',
-            'IN': 'India', 'BR': 'Brazil', 'AU': 'Australia', 'RU': 'Russia',
-            'IT': 'Italy', 'ES': 'Spain', 'KR': 'South Korea', 'NL': 'Netherlands',
-            'SE': 'Sweden', 'NO': 'Norway', 'DK': 'Denmark', 'FI': 'Finland',
-            'PL': 'Poland', 'CH': 'Switzerland', 'AT': 'Austria', 'BE': 'Belgium',
-            'IE': 'Ireland', 'PT': 'Portugal', 'GR': 'Greece', 'CZ': 'Czech Republic',
-            'HU': 'Hungary', 'RO': 'Romania', 'BG': 'Bulgaria', 'HR': 'Croatia',
-            'SK': 'Slovakia', 'SI': 'Slovenia', 'EE': 'Estonia', 'LV': 'Latvia',
-            'LT': 'Lithuania', 'LU': 'Luxembourg', 'MT': 'Malta', 'CY': 'Cyprus'
-        }
-        return country_names.get(country_code, country_code)
+        return country_name(country_code)
 
 
 class ASNService:
     """Service for Autonomous System Number lookups"""
     
-    def __init__(self):
-        self.asn_api_url = "https://api.hackertarget.com/aslookup/?q={}"
+    def __init__(self, transport: Optional[HTTPTransport] = None, disk_cache: Optional[DiskCache] = None,
+                 asn_index: Optional[AsnIndex] = None):
+        self.asn_api_url = os.environ.get('ASN_API_URL', "https://api.hackertarget.com/aslookup/?q={}")
+        self.transport = transport or get_default_transport()
+        self.disk_cache = disk_cache
+        self.inflight = SingleFlight()
+        
+        # Optional local pfx2as data answered before the rate-limited API
+        self.asn_index = asn_index
         
     def get_asn_data(self, ip_address: str) -> Dict[str, Any]:
         """Get ASN information for an IP address"""
         try:
             # Clean IP address
             clean_ip = ip_address.split('/')[0]
-            ipaddress.ip_address(clean_ip)
+            address = ipaddress.ip_address(clean_ip)
             
-            # Query ASN lookup API
-            url = self.asn_api_url.format(clean_ip)
-            response = requests.get(url, timeout=10)
+            if self.asn_index:
+                origin = self.asn_index.origin(address)
+                result = self.asn_index.to_result(clean_ip, origin) if origin is not None else None
+                if result is not None:
+                    CACHE_REQUESTS.labels('local', 'asn', 'hit').inc()
+                    return result
+                CACHE_REQUESTS.labels('local', 'asn', 'miss').inc()
             
-            if response.status_code == 200:
-                asn_text = response.text.strip()
-                
-                if 'AS' in asn_text and not 'error' in asn_text.lower():
-                    # Parse ASN response (format: "AS12345 ISP Name")
-                    parts = asn_text.split(' ', 1)
-                    asn_number = parts[0] if parts else 'Unknown'
-                    asn_name = parts[1] if len(parts) > 1 else 'Unknown'
-                    
-                    return {
-                        'ip': clean_ip,
-                        'asn_number': asn_number,
-                        'asn_name': asn_name,
-                        'asn_full': asn_text,
-                        'success': True
-                    }
-                else:
-                    return {'success': False, 'error': 'ASN not found for this IP'}
-            else:
-                return {'success': False, 'error': f'ASN service returned status {response.status_code}'}
+            if self.disk_cache:
+                cached = self.disk_cache.get('asn', clean_ip)
+                if cached is not None:
+                    CACHE_REQUESTS.labels('disk', 'asn', 'hit').inc()
+                    return cached
+                CACHE_REQUESTS.labels('disk', 'asn', 'miss').inc()
+            
+            # Concurrent lookups for the same IP share one upstream request
+            return self.inflight.do(clean_ip, self._fetch_asn, clean_ip)
                 
         except Exception as e:
             logging.error(f"ASN lookup failed: {str(e)}")
             return {'success': False, 'error': f'ASN lookup failed: {str(e)}'}
+    
+    def lookup_offline_many(self, ips: list) -> list:
+        """Answer many IPs from the local pfx2as data in one pass; None marks a miss"""
+        if not self.asn_index:
+            return [None] * len(ips)
+        clean_ips = [ip.split('/')[0] for ip in ips]
+        results = [
+            self.asn_index.to_result(ip, origin) if origin is not None else None
+            for ip, origin in zip(clean_ips, self.asn_index.origins_many(clean_ips))
+        ]
+        record_local_lookups('asn', results)
+        return results
+    
+    def _fetch_asn(self, clean_ip: str) -> Dict[str, Any]:
+        """Query the ASN lookup API and parse its answer"""
+        # Query ASN lookup API
+        url = self.asn_api_url.format(clean_ip)
+        response = self.transport.get(url, upstream='asn')
+        
+        if response.status_code == 200:
+            asn_text = response.text.strip()
+            
+            if 'AS' in asn_text and not 'error' in asn_text.lower():
+                # Parse ASN response (format: "AS12345 ISP Name")
+                parts = asn_text.split(' ', 1)
+                asn_number = parts[0] if parts else 'Unknown'
+                asn_name = parts[1] if len(parts) > 1 else 'Unknown'
+                
+                asn_data = {
+                    'ip': clean_ip,
+                    'asn_number': asn_number,
+                    'asn_name': asn_name,
+                    'asn_full': asn_text,
+                    'success': True
+                }
+                
+                if self.disk_cache:
+                    self.disk_cache.put('asn', clean_ip, asn_data)
+                return asn_data
+            else:
+                return {'success': False, 'error': 'ASN not found for this IP'}
+        else:
+            return {'success': False, 'error': f'ASN service returned status {response.status_code}'}
+
+
+class EnhancedLookupService:
+    """Runs RDAP, geolocation and ASN lookups for one IP concurrently under a single deadline"""
+    
+    # Seconds a caller may ask to wait at most
+    MAX_DEADLINE = 60.0
+    
+    def __init__(self, rdap_service: RDAPService, geo_service: GeolocationService, asn_service: ASNService,
+                 max_workers: Optional[int] = None, deadline: Optional[float] = None):
+        self.rdap_service = rdap_service
+        self.geo_service = geo_service
+        self.asn_service = asn_service
+        self.deadline = deadline or float(os.environ.get('ENHANCED_LOOKUP_DEADLINE', 10))
+        
+        # Long-lived pools, one per source, splitting the workers evenly. A call that misses
+        # the deadline keeps its thread until the upstream answers (and its answer still lands
+        # in the caches), but a hanging upstream can only use up its own source's threads
+        workers = max_workers or int(os.environ.get('ENHANCED_LOOKUP_WORKERS', 24))
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=max(1, workers // 3), thread_name_prefix=f'enhanced-{name}')
+            for name in ('rdap', 'geolocation', 'asn')
+        }
+    
+    def _run(self, name: str, fetch: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with phase(name), sampled():
+            return fetch()
+    
+    def lookup(self, ip_input: str, deadline: Optional[float] = None, lean: bool = False) -> Dict[str, Any]:
+        """Return {'rdap', 'geolocation', 'asn', 'sources'} with whatever finished within the deadline
+        
+        sources maps each lookup to 'ok', 'error' or 'timeout'; sources that did not finish
+        get an error result in their usual shape so callers can render them unchanged.
+        """
+        deadline = min(deadline or self.deadline, self.MAX_DEADLINE)
+        fetches = {
+            'rdap': functools.partial(self.rdap_service.lookup, ip_input, lean=lean),
+            'geolocation': functools.partial(self.geo_service.get_location_data, ip_input),
+            'asn': functools.partial(self.asn_service.get_asn_data, ip_input)
+        }
+        
+        # Each source runs in a copy of the caller's context so its phases reach the request
+        # timer and its stacks the request's profile
+        futures = {
+            self._executors[name].submit(contextvars.copy_context().run, self._run, name, fetch): name
+            for name, fetch in fetches.items()
+        }
+        done, not_done = wait(futures, timeout=deadline)
+        # Calls still queued behind busy threads are dropped rather than run for nobody
+        for future in not_done:
+            future.cancel()
+        
+        combined = {'sources': {}}
+        for future, name in futures.items():
+            if future not in done:
+                result, status = None, 'timeout'
+                error = f'{name} lookup did not finish within {deadline:g} seconds'
+            else:
+                try:
+                    result = future.result()
+                    failed = 'error' in result if name == 'rdap' else not result.get('success')
+                    status = 'error' if failed else 'ok'
+                except Exception as e:
+                    result, status, error = None, 'error', f'{name} lookup failed: {str(e)}'
+            
+            if result is None:
+                result = {'error': error} if name == 'rdap' else {'success': False, 'error': error}
+            combined[name] = result
+            combined['sources'][name] = status
+        
+        combined['partial'] = any(status != 'ok' for status in combined['sources'].values())
+        return combined
 
 
 class BatchService:
     """Service for batch IP address processing"""
     
-    def __init__(self, rdap_service: RDAPService):
+    # Maximum concurrent requests per upstream during a batch
+    DEFAULT_UPSTREAM_LIMITS = {'rdap': 8, 'geolocation': 4, 'asn': 2}
+    
+    def __init__(self, rdap_service: RDAPService, geo_service: Optional[GeolocationService] = None,
+                 asn_service: Optional[ASNService] = None, max_workers: Optional[int] = None,
+                 upstream_limits: Optional[Dict[str, int]] = None, lean: Optional[bool] = None):
         self.rdap_service = rdap_service
-        self.geo_service = GeolocationService()
-        self.asn_service = ASNService()
+        # Default services reuse the RDAP service's connection pools and disk cache
+        self.geo_service = geo_service or GeolocationService(rdap_service.transport, rdap_service.disk_cache)
+        self.asn_service = asn_service or ASNService(rdap_service.transport, rdap_service.disk_cache)
         
-    def process_batch(self, ip_list: list) -> Dict[str, Any]:
-        """Process multiple IP addresses in batch"""
-        results = []
-        errors = []
+        # Global cap on concurrent upstream requests across all batches
+        self.max_workers = max_workers or int(os.environ.get('BATCH_MAX_WORKERS', 16))
+        self._global_slots = threading.BoundedSemaphore(self.max_workers)
         
-        for ip in ip_list:
-            ip = ip.strip()
-            if not ip:
-                continue
-                
-            try:
-                # Validate IP
-                validation = self.rdap_service.validate_ip(ip)
-                if not validation['valid']:
-                    errors.append(f"{ip}: {validation['message']}")
+        # Per-upstream caps, e.g. BATCH_UPSTREAM_LIMITS="rdap=8,geolocation=4,asn=2"
+        self.upstream_limits = dict(self.DEFAULT_UPSTREAM_LIMITS)
+        for item in os.environ.get('BATCH_UPSTREAM_LIMITS', '').split(','):
+            if '=' in item:
+                name, limit = item.split('=', 1)
+                self.upstream_limits[name.strip()] = int(limit)
+        self.upstream_limits.update(upstream_limits or {})
+        
+        # One pool per upstream so a slow provider queues work instead of holding threads
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=max(1, min(limit, self.max_workers)),
+                                     thread_name_prefix=f'batch-{name}')
+            for name, limit in self.upstream_limits.items()
+        }
+        
+        # Default for batches that do not choose: lean results drop the raw RDAP payload
+        if lean is None:
+            lean = os.environ.get('BATCH_LEAN_RESULTS', '').lower() in ('1', 'true', 'yes')
+        self.lean = lean
+    
+    def _call_upstream(self, fetch: Callable[[str], Dict[str, Any]], ip: str) -> Dict[str, Any]:
+        """Run one upstream call inside the global concurrency limit"""
+        with self._global_slots:
+            return fetch(ip)
+    
+    def _iter_lookups(self, queries: Iterable[Tuple[int, str]],
+                      prefilled: Optional[Dict[int, Dict[str, Any]]] = None,
+                      lean: bool = False, gates: Optional[Sequence[Tuple[Any, ...]]] = None
+                      ) -> Iterator[Tuple[int, str, Optional[Dict[str, Any]], Optional[str]]]:
+        """Fan out RDAP, geolocation and ASN lookups, yielding (position, ip, result, error) as IPs complete
+        
+        prefilled maps a position to fields already answered locally, which are not fetched again.
+        gates maps a position to RDAP gate keys, coarsest first (see BatchPlan.gates). The first
+        RDAP lookup through a gate runs alone and the others wait for it, so neighbours in the
+        allocation it returns are answered from the range cache instead of racing it upstream.
+        """
+        prefilled = prefilled or {}
+        upstreams = (
+            ('rdap', functools.partial(self.rdap_service.lookup, lean=lean)),
+            ('geolocation', self.geo_service.get_location_data),
+            ('asn', self.asn_service.get_asn_data)
+        )
+        
+        queries = iter(queries)
+        pending = {}
+        in_flight = {}
+        
+        # Gate key -> position of the lookup holding it, and the lookups waiting behind it;
+        # a gate whose first lookup has finished is settled and no longer holds anyone
+        gate_leaders = {}
+        leading = {}
+        gate_waiting = {}
+        settled = set()
+        
+        def submit(position: int, field: str, fetch: Callable[[str], Dict[str, Any]], ip: str):
+            future = self._executors[field].submit(self._call_upstream, fetch, ip)
+            pending[future] = (position, field)
+        
+        def submit_rdap(position: int, ip: str):
+            for key in (gates[position] if gates else ()):
+                if key in settled:
                     continue
+                if key in gate_leaders:
+                    gate_waiting.setdefault(key, []).append((position, ip))
+                    return
+                gate_leaders[key] = position
+                leading[position] = key
+                break
+            submit(position, 'rdap', upstreams[0][1], ip)
+        
+        def release(position: int):
+            key = leading.pop(position, None)
+            if key is None:
+                return
+            del gate_leaders[key]
+            settled.add(key)
+            # Followers move on to their next, finer gate, or run if none is left
+            for follower, ip in gate_waiting.pop(key, ()):
+                submit_rdap(follower, ip)
+        
+        def submit_next() -> bool:
+            query = next(queries, None)
+            if query is None:
+                return False
+            position, ip = query
+            in_flight[position] = dict(prefilled.get(position, {}), ip=ip)
+            for field, fetch in upstreams:
+                if field in in_flight[position]:
+                    continue
+                if field == 'rdap':
+                    submit_rdap(position, ip)
+                else:
+                    submit(position, field, fetch, ip)
+            return True
+        
+        # Keep a bounded window of IPs in flight so memory does not grow with batch size
+        window = self.max_workers * 2
+        while len(in_flight) < window and submit_next():
+            pass
+        
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, field = pending.pop(future)
+                if field == 'rdap':
+                    release(position)
+                entry = in_flight[position]
+                try:
+                    entry[field] = future.result()
+                except Exception as e:
+                    entry.setdefault('error', str(e))
+                    entry[field] = None
                 
-                # Basic RDAP lookup
-                rdap_result = self.rdap_service.lookup(ip)
-                
-                # Enhanced data
-                geo_data = self.geo_service.get_location_data(ip)
-                asn_data = self.asn_service.get_asn_data(ip)
-                
-                result = {
-                    'ip': ip,
-                    'rdap': rdap_result,
-                    'geolocation': geo_data,
-                    'asn': asn_data,
-                    'processed_at': datetime.now().isoformat()
+                if all(name in entry for name, _ in upstreams):
+                    del in_flight[position]
+                    ip = entry['ip']
+                    if 'error' in entry:
+                        yield position, ip, None, entry['error']
+                    else:
+                        yield position, ip, {
+                            'ip': ip,
+                            'rdap': entry['rdap'],
+                            'geolocation': entry['geolocation'],
+                            'asn': entry['asn'],
+                            'processed_at': datetime.now().isoformat()
+                        }, None
+                    submit_next()
+    
+    def plan_batch(self, ip_list: list) -> BatchPlan:
+        """Canonicalize, deduplicate and group a batch before any network call"""
+        return BatchPlan(ip_list, self.rdap_service)
+    
+    def iter_batch(self, ip_list: list, progress_interval: float = 1.0,
+                   lean: Optional[bool] = None, records: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream batch events (plan, result, error, progress, done) as lookups finish
+        
+        With records=True results are compact BatchRecord objects instead of dicts, and
+        duplicate lines share one set of sub-records; call to_dict() at the edge.
+        """
+        BATCHES_IN_PROGRESS.inc()
+        try:
+            yield from self._iter_batch(ip_list, progress_interval, lean, records)
+        finally:
+            BATCHES_IN_PROGRESS.dec()
+    
+    def _iter_batch(self, ip_list: list, progress_interval: float, lean: Optional[bool],
+                    records: bool) -> Iterator[Dict[str, Any]]:
+        lean = self.lean if lean is None else lean
+        lines_ok = BATCH_LINES.labels('ok')
+        lines_failed = BATCH_LINES.labels('error')
+        started = time.monotonic()
+        plan = self.plan_batch(ip_list)
+        total = len(plan.lines)
+        
+        # Answer geolocation and ASN lookups from local data in one vectorized pass where possible
+        prefilled = {}
+        for field, answers in (('geolocation', self.geo_service.lookup_offline_many(plan.queries)),
+                               ('asn', self.asn_service.lookup_offline_many(plan.queries))):
+            for index, answer in enumerate(answers):
+                if answer is not None:
+                    prefilled.setdefault(index, {})[field] = answer
+                    plan.offline[field] += 1
+        completed = 0
+        processed = 0
+        
+        yield dict(plan.summary(), type='plan')
+        
+        for position, error in sorted(plan.errors.items()):
+            completed += 1
+            lines_failed.inc()
+            yield {'type': 'error', 'index': position, 'error': error}
+        
+        last_progress = time.monotonic()
+        # Each unique query runs once and fans back out to every line that asked for it
+        for index, query, result, error in self._iter_lookups(enumerate(plan.queries), prefilled, lean,
+                                                              plan.gates):
+            if records and result is not None:
+                result = BatchRecord.from_dict(result)
+            for position in plan.positions[index]:
+                line = plan.lines[position]
+                completed += 1
+                if error:
+                    lines_failed.inc()
+                    yield {'type': 'error', 'index': position, 'error': f"{line}: {error}"}
+                else:
+                    processed += 1
+                    lines_ok.inc()
+                    yield {
+                        'type': 'result',
+                        'index': position,
+                        'result': result.with_ip(line) if records else dict(result, ip=line)
+                    }
+            
+            now = time.monotonic()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                elapsed = now - started
+                yield {
+                    'type': 'progress',
+                    'completed': completed,
+                    'total': total,
+                    'elapsed': round(elapsed, 3),
+                    'rate': round(completed / elapsed, 2) if elapsed else None
                 }
-                
-                results.append(result)
-                
-            except Exception as e:
-                errors.append(f"{ip}: {str(e)}")
-                
+        
+        elapsed = time.monotonic() - started
+        BATCHES.inc()
+        BATCH_DURATION.observe(elapsed)
+        yield {
+            'type': 'done',
+            'total_processed': processed,
+            'total_errors': completed - processed,
+            'elapsed': round(elapsed, 3)
+        }
+    
+    def process_batch(self, ip_list: list, lean: Optional[bool] = None, records: bool = False) -> Dict[str, Any]:
+        """Process multiple IP addresses in batch; records=True keeps results as BatchRecord objects"""
+        results = {}
+        errors = {}
+        plan = None
+        
+        for event in self.iter_batch(ip_list, progress_interval=float('inf'), lean=lean, records=records):
+            if event['type'] == 'result':
+                results[event['index']] = event['result']
+            elif event['type'] == 'error':
+                errors[event['index']] = event['error']
+            elif event['type'] == 'plan':
+                plan = event
+                del plan['type']
+        
+        # Lookups complete out of order; positions restore the input order
+        results = [results[position] for position in sorted(results)]
+        errors = [errors[position] for position in sorted(errors)]
+        
         return {
             'total_processed': len(results),
             'total_errors': len(errors),
             'results': results,
             'errors': errors,
-            'success': len(results) > 0
+            'success': len(results) > 0,
+            'plan': plan
         }
     
+    # Columns written by CSV exports
+    CSV_HEADER = ['IP', 'RIR', 'Network', 'Organization', 'Country', 'ASN', 'ASN_Name', 'City', 'Region']
+    
+    def csv_row(self, result: Dict[str, Any]) -> list:
+        """Flatten one result into the CSV_HEADER columns"""
+        rdap = result.get('rdap') or {}
+        geo = result.get('geolocation') or {}
+        asn = result.get('asn') or {}
+        
+        organization = rdap.get('organization', '')
+        if isinstance(organization, dict):
+            organization = organization.get('organization') or organization.get('name', '')
+        
+        return [
+            result.get('ip', ''),
+            rdap.get('rir', ''),
+            rdap.get('network_name', ''),
+            organization,
+            geo.get('country_name', ''),
+            asn.get('asn_number', ''),
+            asn.get('asn_name', ''),
+            geo.get('city', ''),
+            geo.get('region', '')
+        ]
+    
     def export_results(self, results: Dict[str, Any], format_type: str = 'json') -> str:
         """Export batch results in various formats"""
-        if format_type == 'json':
-            return json.dumps(results, indent=2)
-        elif format_type == 'csv':
-            return self._to_csv(results)
-        else:
-            return json.dumps(results, indent=2)
-    
-    def _to_csv(self, results: Dict[str, Any]) -> str:
-        """Convert results to CSV format"""
-        if not results.get('results'):
+        if format_type == 'csv' and not results.get('results'):
             return "No results to export"
+        return ''.join(self.iter_export(results.get('results', []), format_type,
+                                        results.get('errors', []), results))
+    
+    def iter_export(self, results: Iterable[Dict[str, Any]], format_type: str = 'json',
+                    errors: Iterable[str] = (), summary: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Stream an export chunk by chunk so large result sets use constant memory"""
+        results = map(as_dict, results)
+        if format_type == 'csv':
+            return self._iter_csv(results)
+        return self._iter_json(results, errors, summary or {})
+    
+    def _iter_csv(self, results: Iterable[Dict[str, Any]]) -> Iterator[str]:
+        """Convert results to CSV rows with proper quoting"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
         
-        csv_lines = ['IP,RIR,Network,Organization,Country,ASN,ASN_Name,City,Region']
+        writer.writerow(self.CSV_HEADER)
+        for result in results:
+            writer.writerow(self.csv_row(result))
+            # Hand rows out in ~64 KB chunks
+            if buffer.tell() >= 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    
+    def _iter_json(self, results: Iterable[Dict[str, Any]], errors: Iterable[str],
+                   summary: Dict[str, Any]) -> Iterator[str]:
+        """Convert results to the batch JSON document one item at a time"""
+        yield '{\n'
+        for key in ('total_processed', 'total_errors'):
+            if key in summary:
+                yield f'  {json.dumps(key)}: {json.dumps(summary[key])},\n'
         
-        for result in results['results']:
-            ip = result.get('ip', '')
-            rdap = result.get('rdap', {})
-            geo = result.get('geolocation', {})
-            asn = result.get('asn', {})
-            
-            line = [
-                ip,
-                rdap.get('rir', ''),
-                rdap.get('network', ''),
-                rdap.get('organization', ''),
-                geo.get('country_name', ''),
-                asn.get('asn_number', ''),
-                asn.get('asn_name', ''),
-                geo.get('city', ''),
-                geo.get('region', '')
-            ]
-            
-            # Clean and escape CSV values
-            clean_line = [str(field).replace(',', ';').replace('\n', ' ') for field in line]
-            csv_lines.append(','.join(clean_line))
+        for key, items in (('results', results), ('errors', errors)):
+            yield f'  "{key}": ['
+            separator = '\n    '
+            for item in items:
+                yield separator + json.dumps(item)
+                separator = ',\n    '
+            yield '\n  ],\n'
         
-        return '\n'.join(csv_lines)
+        yield f'  "success": {json.dumps(summary.get("success", True))}\n}}\n'
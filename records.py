@@ -0,0 +1,244 @@
+import sys
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+
+def _intern(value: Any) -> Any:
+    """Intern strings that repeat across results (registries, countries, AS and org names)"""
+    return sys.intern(value) if type(value) is str else value
+
+
+def as_dict(value: Any) -> Any:
+    """Convert a record to its JSON-ready dict, passing plain values through"""
+    return value.to_dict() if hasattr(value, 'to_dict') else value
+
+
+class ContactRecord:
+    """One RDAP entity with the vCard fields format_rdap_response extracts"""
+
+    __slots__ = ('roles', 'handle', 'name', 'organization', 'email', 'phone', 'address')
+
+    # vCard-derived keys in the order they are emitted
+    VCARD_KEYS = ('name', 'organization', 'email', 'phone', 'address')
+
+    def __init__(self, roles: Tuple[str, ...], handle: Any, name: Any = None, organization: Any = None,
+                 email: Any = None, phone: Any = None, address: Any = None):
+        self.roles = roles
+        self.handle = handle
+        self.name = name
+        self.organization = organization
+        self.email = email
+        self.phone = phone
+        self.address = address
+
+    @classmethod
+    def from_dict(cls, contact: Dict[str, Any]) -> 'ContactRecord':
+        return cls(
+            tuple(_intern(role) for role in contact.get('roles', ())),
+            contact.get('handle', 'N/A'),
+            *(_intern(contact.get(key)) for key in cls.VCARD_KEYS)
+        )
+
+    def vcard(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self.VCARD_KEYS if getattr(self, key) is not None}
+
+    def to_dict(self) -> Dict[str, Any]:
+        contact = {'roles': list(self.roles), 'handle': self.handle}
+        contact.update(self.vcard())
+        return contact
+
+
+class RdapRecord:
+    """Formatted RDAP result; fields left as None are absent from the dict form"""
+
+    __slots__ = ('rir', 'timestamp', 'network_name', 'ip_range', 'cidr_blocks', 'organization',
+                 'contacts', 'raw_data', 'error', 'error_details')
+
+    def __init__(self, rir: Optional[str] = None, timestamp: Optional[str] = None,
+                 network_name: Optional[str] = None, ip_range: Optional[str] = None,
+                 cidr_blocks: Optional[list] = None, organization: Optional[ContactRecord] = None,
+                 contacts: Optional[Tuple[ContactRecord, ...]] = None, raw_data: Optional[dict] = None,
+                 error: Optional[str] = None, error_details: Optional[Dict[str, Any]] = None):
+        self.rir = rir
+        self.timestamp = timestamp
+        self.network_name = network_name
+        self.ip_range = ip_range
+        self.cidr_blocks = cidr_blocks
+        self.organization = organization
+        self.contacts = contacts
+        self.raw_data = raw_data
+        self.error = error
+        # Keys an error result carries besides the message, e.g. the upstream status_code
+        self.error_details = error_details
+
+    @classmethod
+    def from_dict(cls, rdap: Dict[str, Any]) -> 'RdapRecord':
+        if 'error' in rdap:
+            details = {key: value for key, value in rdap.items() if key != 'error'}
+            return cls(error=rdap['error'], error_details=details or None)
+
+        # The organization is a bare vCard; keep it in a contact record without roles
+        organization = rdap.get('organization')
+        if organization is not None:
+            organization = ContactRecord.from_dict(dict(organization, roles=(), handle=None))
+
+        return cls(
+            rir=_intern(rdap.get('rir')),
+            timestamp=_intern(rdap.get('timestamp')),
+            network_name=_intern(rdap.get('network_name')),
+            ip_range=rdap.get('ip_range'),
+            cidr_blocks=rdap.get('cidr_blocks'),
+            organization=organization,
+            contacts=tuple(ContactRecord.from_dict(contact) for contact in rdap.get('contacts', ())),
+            raw_data=rdap.get('raw_data')
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.error is not None:
+            return {'error': self.error, **(self.error_details or {})}
+
+        rdap = {'rir': self.rir, 'timestamp': self.timestamp}
+        if self.raw_data is not None:
+            rdap['raw_data'] = self.raw_data
+        if self.network_name is not None:
+            rdap['network_name'] = self.network_name
+        if self.ip_range is not None:
+            rdap['ip_range'] = self.ip_range
+        if self.cidr_blocks is not None:
+            rdap['cidr_blocks'] = self.cidr_blocks
+        if self.organization is not None:
+            rdap['organization'] = self.organization.vcard()
+        rdap['contacts'] = [contact.to_dict() for contact in self.contacts or ()]
+        return rdap
+
+
+class GeoRecord:
+    """Geolocation result in the shape GeolocationService returns"""
+
+    __slots__ = ('ip', 'city', 'region', 'country', 'country_name', 'timezone', 'latitude',
+                 'longitude', 'postal', 'asn', 'error')
+
+    FIELDS = ('ip', 'city', 'region', 'country', 'country_name', 'timezone')
+
+    def __init__(self, ip: Optional[str] = None, city: Optional[str] = None, region: Optional[str] = None,
+                 country: Optional[str] = None, country_name: Optional[str] = None,
+                 timezone: Optional[str] = None, latitude: Optional[float] = None,
+                 longitude: Optional[float] = None, postal: Optional[str] = None,
+                 asn: Optional[str] = None, error: Optional[str] = None):
+        self.ip = ip
+        self.city = city
+        self.region = region
+        self.country = country
+        self.country_name = country_name
+        self.timezone = timezone
+        self.latitude = latitude
+        self.longitude = longitude
+        self.postal = postal
+        self.asn = asn
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, location: Dict[str, Any]) -> 'GeoRecord':
+        if not location.get('success'):
+            return cls(error=location.get('error', 'Unknown error'))
+
+        coordinates = location.get('coordinates') or {}
+        return cls(
+            *(_intern(location.get(key)) for key in cls.FIELDS),
+            latitude=coordinates.get('latitude'),
+            longitude=coordinates.get('longitude'),
+            postal=_intern(location.get('postal')),
+            asn=_intern(location.get('asn'))
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.error is not None:
+            return {'success': False, 'error': self.error}
+
+        location = {key: getattr(self, key) for key in self.FIELDS}
+        location['coordinates'] = ({'latitude': self.latitude, 'longitude': self.longitude}
+                                   if self.latitude is not None else {})
+        location['postal'] = self.postal
+        location['asn'] = self.asn
+        location['success'] = True
+        return location
+
+
+class AsnRecord:
+    """ASN result in the shape ASNService returns"""
+
+    __slots__ = ('ip', 'asn_number', 'asn_name', 'asn_full', 'origins', 'source', 'error')
+
+    def __init__(self, ip: Optional[str] = None, asn_number: Optional[str] = None,
+                 asn_name: Optional[str] = None, asn_full: Optional[str] = None,
+                 origins: Optional[str] = None, source: Optional[str] = None, error: Optional[str] = None):
+        self.ip = ip
+        self.asn_number = asn_number
+        self.asn_name = asn_name
+        self.asn_full = asn_full
+        self.origins = origins
+        self.source = source
+        self.error = error
+
+    @classmethod
+    def from_dict(cls, asn: Dict[str, Any]) -> 'AsnRecord':
+        if not asn.get('success'):
+            return cls(error=asn.get('error', 'Unknown error'))
+        return cls(*(_intern(asn.get(key)) for key in cls.__slots__[:-1]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.error is not None:
+            return {'success': False, 'error': self.error}
+
+        asn = {
+            'ip': self.ip,
+            'asn_number': self.asn_number,
+            'asn_name': self.asn_name,
+            'asn_full': self.asn_full
+        }
+        # Offline pfx2as answers also report the raw origin field and their source
+        if self.source is not None:
+            asn['origins'] = self.origins
+            asn['source'] = self.source
+        asn['success'] = True
+        return asn
+
+
+class BatchRecord:
+    """One batch line; lines that resolve to the same query share their sub-records"""
+
+    __slots__ = ('ip', 'rdap', 'geolocation', 'asn', 'processed_at')
+
+    def __init__(self, ip: str, rdap: Any, geolocation: Any, asn: Any, processed_at: datetime):
+        self.ip = ip
+        self.rdap = rdap
+        self.geolocation = geolocation
+        self.asn = asn
+        self.processed_at = processed_at
+
+    @classmethod
+    def from_dict(cls, result: Dict[str, Any]) -> 'BatchRecord':
+        """Build a record from a BatchService result dict; failed sub-lookups stay None"""
+        processed_at = result.get('processed_at')
+        if isinstance(processed_at, str):
+            processed_at = datetime.fromisoformat(processed_at)
+        return cls(
+            result['ip'],
+            RdapRecord.from_dict(result['rdap']) if result.get('rdap') is not None else None,
+            GeoRecord.from_dict(result['geolocation']) if result.get('geolocation') is not None else None,
+            AsnRecord.from_dict(result['asn']) if result.get('asn') is not None else None,
+            processed_at
+        )
+
+    def with_ip(self, ip: str) -> 'BatchRecord':
+        """A record for another input line answered by the same lookups"""
+        return BatchRecord(ip, self.rdap, self.geolocation, self.asn, self.processed_at)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'ip': self.ip,
+            'rdap': as_dict(self.rdap),
+            'geolocation': as_dict(self.geolocation),
+            'asn': as_dict(self.asn),
+            'processed_at': self.processed_at.isoformat()
+        }
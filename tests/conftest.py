@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Tests import the root-level modules directly, like the app and the CLIs do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep importing app.py from creating instance/jobs.db in the checkout
+os.environ.setdefault('RIPESCANNER_JOBS_PATH', os.path.join(tempfile.mkdtemp(prefix='ripescanner-tests-'), 'jobs.db'))
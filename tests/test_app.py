@@ -0,0 +1,46 @@
+import pytest
+
+from app import app, request_deadline
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_timings_flag_in_json_body(client):
+    response = client.get('/api/stats', json={'timings': True})
+    assert response.status_code == 200
+    assert 'total' in response.get_json()['timings']
+    assert 'Server-Timing' in response.headers
+
+
+@pytest.mark.parametrize('body', [[1], [1, 2], 'text', 3])
+def test_non_object_json_body_is_ignored(client, body):
+    response = client.get('/api/stats', json=body)
+    assert response.status_code == 200
+    assert 'timings' not in response.get_json()
+
+
+@pytest.mark.parametrize('body, expected', [({'deadline': 2.5}, 2.5), ({'deadline': 0}, None), ([2.5], None), ('2.5', None)])
+def test_request_deadline_from_json_body(body, expected):
+    with app.test_request_context('/enhanced_lookup', method='POST', json=body):
+        assert request_deadline() == expected
+
+
+def test_enhanced_lookup_with_non_object_body(client):
+    response = client.post('/enhanced_lookup', json=['8.8.8.8'])
+    assert response.status_code == 200
+    assert response.get_json() == {'success': False, 'error': 'Please provide an IP address'}
+
+
+def test_scan_range_with_non_object_body(client):
+    response = client.post('/scan_range', json=['185.0.0.0/16'])
+    assert response.status_code == 200
+    assert response.get_json() == {'success': False, 'error': 'Please provide a network prefix'}
+
+
+def test_submit_job_with_non_object_body(client):
+    response = client.post('/jobs', json=['192.0.2.1'])
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
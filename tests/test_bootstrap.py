@@ -0,0 +1,46 @@
+import os
+
+import pytest
+
+from bootstrap import load_bootstrap
+from prefix_index import np
+from rdap_service import RDAPService
+
+SNAPSHOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'bootstrap')
+
+# Addresses inside each registry's IANA allocations, IPv4 and IPv6
+KNOWN = [
+    ('8.8.8.8', 'ARIN'), ('2600:1f18::1', 'ARIN'),
+    ('193.0.6.139', 'RIPE'), ('2a00:1450::1', 'RIPE'),
+    ('1.1.1.1', 'APNIC'), ('2400:cb00::1', 'APNIC'),
+    ('200.160.0.8', 'LACNIC'), ('2800:3f0::1', 'LACNIC'),
+    ('41.0.0.1', 'AFRINIC'), ('2c0f:f248::1', 'AFRINIC'),
+]
+
+
+@pytest.fixture(scope='module')
+def service():
+    return RDAPService(bootstrap_dir=SNAPSHOT)
+
+
+def test_snapshot_lists_every_registry():
+    ranges, endpoints = load_bootstrap(SNAPSHOT)
+    assert set(ranges) == {'ARIN', 'RIPE', 'APNIC', 'LACNIC', 'AFRINIC'}
+    assert all(url.startswith('https://') and url.endswith('/ip/') for url in endpoints.values())
+
+
+@pytest.mark.parametrize('ip, rir', KNOWN)
+def test_detect_rir_from_snapshot(service, ip, rir):
+    assert service.detect_rir(ip) == rir
+
+
+def test_detect_rir_falls_back_to_arin(service):
+    assert service.detect_rir('not an ip') == 'ARIN'
+
+
+@pytest.mark.skipif(np is None, reason='NumPy not installed')
+def test_detect_rir_many_from_snapshot(service):
+    ips = [ip for ip, _ in KNOWN] + ['10.0.0.1', 'not an ip']
+    codes = service.detect_rir_many(ips)
+    assert [service.rir_codes[code] for code in codes] == [service.detect_rir(ip) for ip in ips]
+    assert [service.rir_codes[code] for code in codes[:len(KNOWN)]] == [rir for _, rir in KNOWN]
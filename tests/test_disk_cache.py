@@ -0,0 +1,52 @@
+import random
+import ipaddress
+
+import pytest
+
+from disk_cache import DiskCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiskCache(str(tmp_path / 'cache.db'))
+
+
+def put(cache, start, end, value):
+    cache.put_range(ipaddress.ip_address(start), ipaddress.ip_address(end), value)
+
+
+def test_wide_range_found_behind_many_narrower_rows(cache):
+    put(cache, '10.0.0.0', '10.255.255.255', 'slash8')
+    for block in range(40):
+        put(cache, f'10.{block}.0.0', f'10.{block}.0.255', f'slash24-{block}')
+    assert cache.get_range(ipaddress.ip_address('10.39.1.5')) == 'slash8'
+    assert cache.get_range(ipaddress.ip_address('10.39.0.5')) == 'slash24-39'
+    assert cache.get_range(ipaddress.ip_address('11.0.0.1')) is None
+
+
+def test_expired_ranges_are_skipped(cache):
+    put(cache, '10.0.0.0', '10.255.255.255', 'slash8')
+    cache.ttls['rdap'] = -1
+    put(cache, '10.1.0.0', '10.1.255.255', 'expired')
+    assert cache.get_range(ipaddress.ip_address('10.1.2.3')) == 'slash8'
+    assert cache.purge_expired() == 1
+    assert cache.get_range(ipaddress.ip_address('10.1.2.3')) == 'slash8'
+
+
+@pytest.mark.parametrize('version', [4, 6])
+def test_random_ranges_match_narrowest_covering(cache, version):
+    rng = random.Random(version)
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    base = 0x0A000000 if version == 4 else 1 << 120
+    ranges = {}
+    for number in range(400):
+        start = base + rng.randrange(0, 1 << 20)
+        end = start + rng.randrange(0, 1 << rng.randrange(0, 20))
+        ranges[(start, end)] = f'range-{number}'
+        cache.put_range(address(start), address(end), ranges[(start, end)])
+
+    for _ in range(500):
+        value = base + rng.randrange(0, 1 << 21)
+        covering = [(end - start, -start, label) for (start, end), label in ranges.items() if start <= value <= end]
+        expected = min(covering)[2] if covering else None
+        assert cache.get_range(address(value)) == expected
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import pytest
+
+import app as app_module
+from jobs import JobStore, JobManager, JobLost
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / 'jobs.db'))
+
+
+def test_add_results_counts_only_inserted_rows(store):
+    job_id = store.create(['192.0.2.1', '192.0.2.2'], owner='me')
+    store.add_results(job_id, [(0, 'result', {'ip': '192.0.2.1'})], owner='me')
+    store.add_results(job_id, [(0, 'result', {'ip': '192.0.2.1'}), (1, 'error', 'bad')], owner='me')
+    job = store.get(job_id)
+    assert (job['completed'], job['errors']) == (2, 1)
+
+
+def test_add_results_rejects_other_owner(store):
+    job_id = store.create(['192.0.2.1'], owner='me')
+    with pytest.raises(JobLost):
+        store.add_results(job_id, [(0, 'result', {})], owner='someone else')
+    assert store.results(job_id) == []
+
+
+def test_purge_finished_removes_old_jobs_and_results(store):
+    old = store.create(['192.0.2.1'], owner='me')
+    store.add_results(old, [(0, 'result', {'ip': '192.0.2.1'})], owner='me')
+    store.finish(old, 'done', owner='me')
+    running = store.create(['192.0.2.2'], owner='me')
+    recent = store.create(['192.0.2.3'], owner='me')
+    store.finish(recent, 'done', owner='me')
+    store._connection().execute('UPDATE jobs SET finished_at = ? WHERE id = ?', (time.time() - 7200, old))
+
+    assert store.purge_finished(3600) == 1
+    assert store.get(old) is None
+    assert store.results(old) == []
+    assert store.get(running) is not None
+    assert store.get(recent) is not None
+
+
+def test_inline_batch_stops_when_job_is_taken_over(monkeypatch):
+    consumed = []
+
+    def iter_batch(lines, **kwargs):
+        for index, line in enumerate(lines):
+            consumed.append(index)
+            if index == 1:
+                # The heartbeat thread found the job owned by another worker
+                for lost in app_module.job_manager._held.values():
+                    lost.set()
+            yield {'type': 'result', 'index': index, 'result': {'ip': line}}
+
+    monkeypatch.setattr(app_module.batch_service, 'iter_batch', iter_batch)
+    response = app_module.app.test_client().post(
+        '/batch_lookup', data={'ip_list': '\n'.join(f'192.0.2.{n}' for n in range(10))})
+    body = response.get_json()
+    assert body['success'] is False
+    assert 'taken over' in body['error']
+    assert consumed == [0, 1]
+
+
+class BlockingBatchService:
+    """Answers every line, holding the first job until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def iter_batch(self, lines, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(10)
+        for index, line in enumerate(lines):
+            yield {'type': 'result', 'index': index, 'result': {'ip': line}}
+
+
+def test_watchdog_does_not_queue_waiting_jobs_twice(store, monkeypatch):
+    claims = []
+    claim = store.claim
+    monkeypatch.setattr(store, 'claim', lambda job_id, *args: claims.append(job_id) or claim(job_id, *args))
+
+    service = BlockingBatchService()
+    manager = JobManager(store, service, workers=1, stale_after=0.2)
+    job_ids = [manager.submit([f'192.0.2.{n}']) for n in range(3)]
+    # Several watchdog passes while two jobs wait behind the blocked one
+    time.sleep(1)
+    service.release.set()
+
+    deadline = time.monotonic() + 10
+    while any(store.get(job_id)['status'] != 'done' for job_id in job_ids) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert [store.get(job_id)['status'] for job_id in job_ids] == ['done'] * 3
+    assert sorted(claims) == sorted(job_ids)
+    assert service.calls == 3
@@ -0,0 +1,69 @@
+import random
+import ipaddress
+
+import pytest
+
+from prefix_index import PrefixIndex, np
+from range_cache import RangeCache
+from rdap_service import RDAPService
+
+
+def range_cache_of(ranges):
+    cache = RangeCache(ttl=3600, max_entries=len(ranges) + 1)
+    for version, start, end, label in ranges:
+        address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        cache.put(address(start), address(end), label)
+    return cache
+
+
+def test_nested_prefixes_resolve_to_most_specific():
+    index = PrefixIndex([('10.0.0.0/8', 'outer'), ('10.1.0.0/16', 'middle'), ('10.1.2.0/24', 'inner')])
+    assert index.lookup(ipaddress.ip_address('10.9.9.9')) == 'outer'
+    assert index.lookup(ipaddress.ip_address('10.1.9.9')) == 'middle'
+    assert index.lookup(ipaddress.ip_address('10.1.2.3')) == 'inner'
+    assert index.lookup(ipaddress.ip_address('11.0.0.0')) is None
+
+
+def test_partially_overlapping_ranges_match_range_cache():
+    ranges = [(4, 0, 30, 'A'), (4, 5, 10, 'B'), (4, 8, 20, 'C'), (4, 25, 28, 'D')]
+    index = PrefixIndex.from_ranges(ranges)
+    cache = range_cache_of(ranges)
+    assert index.lookup_int(15, 4) == 'C'
+    for value in range(0, 40):
+        assert index.lookup_int(value, 4) == cache.get(ipaddress.IPv4Address(value)), value
+
+
+@pytest.mark.parametrize('version', [4, 6])
+def test_random_overlapping_ranges_match_range_cache(version):
+    rng = random.Random(version)
+    base = 0 if version == 4 else 1 << 100
+    ranges = []
+    for number in range(300):
+        start = base + rng.randrange(0, 5000)
+        ranges.append((version, start, start + rng.randrange(0, 400), f'L{number % 7}'))
+    index = PrefixIndex.from_ranges(ranges)
+    cache = range_cache_of(ranges)
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    for value in range(base, base + 5500):
+        assert index.lookup_int(value, version) == cache.get(address(value)), value
+
+
+def test_repeated_range_takes_last_label():
+    index = PrefixIndex.from_ranges([(4, 0, 255, 'first'), (4, 0, 255, 'second')])
+    assert index.lookup_int(7, 4) == 'second'
+    assert len(index) == 1
+
+
+@pytest.mark.skipif(np is None, reason='NumPy not installed')
+def test_detect_rir_many_matches_detect_rir_with_overlapping_learned_routes():
+    service = RDAPService()
+    learned = [('8.0.0.0', '8.255.255.255', 'RIPE'), ('8.8.0.0', '8.8.255.255', 'APNIC'),
+               ('8.8.128.0', '8.9.127.255', 'LACNIC'), ('8.9.0.0', '8.9.0.255', 'AFRINIC')]
+    for start, end, rir in learned:
+        service.learn_route(ipaddress.ip_address(start), ipaddress.ip_address(end), rir)
+
+    rng = random.Random(0)
+    ips = [str(ipaddress.IPv4Address(rng.randrange(0x07F00000, 0x0A000000))) for _ in range(5000)]
+    ips += ['8.8.8.8', '8.8.200.1', '8.9.0.5', '8.9.100.1', '8.200.0.1', '2001:db8::1', 'not an ip']
+    codes = service.detect_rir_many(ips)
+    assert [service.rir_codes[code] for code in codes] == [service.detect_rir(ip) for ip in ips]
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from records import BatchRecord, RdapRecord
+
+
+def test_rdap_error_keeps_every_key():
+    error = {'error': 'RDAP request failed: 404 Client Error', 'status_code': 404}
+    assert RdapRecord.from_dict(error).to_dict() == error
+    assert RdapRecord.from_dict({'error': 'Unknown RIR: XX'}).to_dict() == {'error': 'Unknown RIR: XX'}
+
+
+def test_batch_record_round_trips_an_rdap_error():
+    result = {
+        'ip': '192.0.2.1',
+        'rdap': {'error': 'RDAP request failed: 503 Server Error', 'status_code': 503},
+        'geolocation': {'success': False, 'error': 'Geolocation service returned status 500'},
+        'asn': {'success': False, 'error': 'ASN not found for this IP'},
+        'processed_at': datetime(2024, 1, 1).isoformat()
+    }
+    assert BatchRecord.from_dict(result).to_dict() == result
@@ -0,0 +1,137 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from ratelimit import RateLimiter
+from rdap_service import RDAPService, GeolocationService, ASNService, BatchService
+from transport import HTTPTransport, StubResponse, StubTransport
+
+
+def rdap_body(start, end, name='EXAMPLE-NET'):
+    return {'objectClassName': 'ip network', 'handle': f'{start} - {end}', 'startAddress': start,
+            'endAddress': end, 'name': name, 'country': 'ZZ', 'entities': []}
+
+
+def rdap_service(transport):
+    service = RDAPService(transport=transport)
+    service.rdap_endpoints = {rir: f'https://rdap.test/{rir}/ip/' for rir in service.rdap_endpoints}
+    return service
+
+
+def test_range_answer_serves_neighbours_without_new_requests():
+    transport = StubTransport()
+    transport.add('https://rdap.test/ARIN/ip/', body=rdap_body('8.8.8.0', '8.8.8.255', 'GOGL'))
+    service = rdap_service(transport)
+
+    first = service.lookup('8.8.8.8')
+    second = service.lookup('8.8.8.200')
+    assert (first['rir'], first['network_name']) == ('ARIN', 'GOGL')
+    assert second['network_name'] == 'GOGL'
+    assert transport.requests == ['https://rdap.test/ARIN/ip/8.8.8.8']
+
+
+def test_not_found_probes_other_registries_and_reports_the_first():
+    transport = StubTransport()
+    service = rdap_service(transport)
+
+    result = service.lookup('8.8.8.8')
+    assert result['status_code'] == 404
+    assert 'rdap.test/ARIN/ip/8.8.8.8' in result['error']
+    assert len(transport.requests) == 1 + service.max_probes
+
+    # The 404 is remembered, so asking again costs nothing
+    assert service.lookup('8.8.8.8')['status_code'] == 404
+    assert len(transport.requests) == 1 + service.max_probes
+
+
+def test_server_errors_keep_their_status_and_are_not_cached():
+    transport = StubTransport()
+    transport.add('https://rdap.test/', status_code=503, body={'errorCode': 503})
+    service = rdap_service(transport)
+
+    assert service.lookup('8.8.8.8')['status_code'] == 503
+    assert service.lookup('8.8.8.8')['status_code'] == 503
+    assert len(transport.requests) == 2
+
+
+def test_retry_after_delays_the_retry():
+    answers = [StubResponse(429, {'errorCode': 429}, {'Retry-After': '0.3'}),
+               StubResponse(200, rdap_body('8.8.8.0', '8.8.8.255'))]
+    transport = StubTransport(handler=lambda url: answers.pop(0),
+                              rate_limiter=RateLimiter({'rdap': (1000.0, 1000.0)}))
+    service = rdap_service(transport)
+
+    started = time.monotonic()
+    result = service.lookup('8.8.8.8')
+    assert time.monotonic() - started >= 0.3
+    assert result['network_name'] == 'EXAMPLE-NET'
+    assert len(transport.requests) == 2
+
+
+def test_throttling_past_the_retry_budget_is_an_error():
+    transport = StubTransport(handler=lambda url: StubResponse(429, {'errorCode': 429}, {'Retry-After': '0'}, url),
+                              rate_limiter=RateLimiter({'rdap': (1000.0, 1000.0)}), max_throttle_retries=2)
+    service = rdap_service(transport)
+
+    assert service.lookup('8.8.8.8')['status_code'] == 429
+    assert len(transport.requests) == 3
+
+
+def test_batch_shares_one_transport_and_deduplicates():
+    transport = StubTransport()
+    transport.add('https://rdap.test/ARIN/ip/', body=rdap_body('8.8.8.0', '8.8.8.255'))
+    transport.add('https://geo.test/', body={'city': 'Example City', 'country': 'US', 'loc': '1.0,2.0'})
+    transport.add('https://asn.test/', body='AS15169 GOOGLE, US')
+    service = rdap_service(transport)
+    geo_service = GeolocationService(transport)
+    geo_service.ipinfo_url = 'https://geo.test/{}/json'
+    asn_service = ASNService(transport)
+    asn_service.asn_api_url = 'https://asn.test/?q={}'
+
+    batch = BatchService(service, geo_service, asn_service).process_batch(
+        ['8.8.8.8', '8.8.8.9', '8.8.8.8', 'not-an-ip'])
+    assert batch['total_processed'] == 3
+    assert batch['total_errors'] == 1
+    assert [result['asn']['asn_number'] for result in batch['results']] == ['AS15169'] * 3
+
+    # One RDAP call answers the /24; geolocation and ASN are asked once per unique address
+    hosts = [url.split('/')[2] for url in transport.requests]
+    assert (hosts.count('rdap.test'), hosts.count('geo.test'), hosts.count('asn.test')) == (1, 2, 2)
+
+
+def test_default_services_reuse_the_rdap_transport():
+    transport = StubTransport()
+    batch = BatchService(rdap_service(transport))
+    assert batch.geo_service.transport is transport
+    assert batch.asn_service.transport is transport
+
+
+@pytest.mark.parametrize('scheme', ['http', 'https'])
+def test_http_transport_pool_sizes(scheme):
+    transport = HTTPTransport(pool_connections=4, pool_maxsize=8)
+    adapter = transport.session.get_adapter(f'{scheme}://rdap.example/')
+    assert (adapter._pool_connections, adapter._pool_maxsize) == (4, 8)
+
+
+def test_concurrent_lookups_share_a_request_only_for_the_same_registry():
+    release = threading.Event()
+
+    def handler(url):
+        release.wait(5)
+        return StubResponse(200, rdap_body('8.8.8.0', '8.8.8.255', url.split('/')[3]), url=url)
+
+    transport = StubTransport(handler=handler)
+    service = rdap_service(transport)
+    service.range_cache.ttl = 0
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(service.resolve_rdap, '8.8.8.8', rir) for rir in ('ARIN', 'ARIN', 'RIPE')]
+        time.sleep(0.2)
+        release.set()
+        answers = [future.result() for future in futures]
+
+    assert [rir for _, rir in answers] == ['ARIN', 'ARIN', 'RIPE']
+    assert [data['name'] for data, _ in answers] == ['ARIN', 'ARIN', 'RIPE']
+    assert sorted(transport.requests) == ['https://rdap.test/ARIN/ip/8.8.8.8', 'https://rdap.test/RIPE/ip/8.8.8.8']
@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional
+
+# The timer of the request being handled; code outside a request (jobs, batch workers) sees None
+_current_timer: contextvars.ContextVar = contextvars.ContextVar('request_timer', default=None)
+# The profiler and sample counts of the request being profiled; worker threads running in a
+# copy of the request's context see it too
+_current_profile: contextvars.ContextVar = contextvars.ContextVar('request_profile', default=None)
+
+
+class PhaseTimer:
+    """Accumulated wall time per named phase of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # Phases keep first-seen order; repeated phases add up
+        self.phases: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self, total: Optional[float] = None) -> Dict[str, float]:
+        """Phase durations in milliseconds, plus the request total"""
+        with self._lock:
+            timings = {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+        timings['total'] = round((self.elapsed() if total is None else total) * 1000, 3)
+        return timings
+
+    def server_timing(self, total: Optional[float] = None) -> str:
+        """Format the phases as a Server-Timing header value"""
+        return ', '.join(f'{name};dur={ms}' for name, ms in self.as_dict(total).items())
+
+
+def start_request() -> PhaseTimer:
+    """Start timing the current request"""
+    timer = PhaseTimer()
+    _current_timer.set(timer)
+    return timer
+
+
+def finish_request():
+    _current_timer.set(None)
+
+
+def current_timer() -> Optional[PhaseTimer]:
+    return _current_timer.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a block under `name` on the current request's timer; free outside a request"""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.record(name, time.perf_counter() - start)
+
+
+@contextmanager
+def sampled() -> Iterator[None]:
+    """Sample the calling worker thread into the current request's profile while the block runs"""
+    current = _current_profile.get()
+    if current is None:
+        yield
+        return
+    profiler, samples = current
+    if not profiler.attach(samples):
+        # Already sampled for this request (the block runs on the request thread itself)
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.detach()
+
+
+class SamplingProfiler:
+    """Samples the stacks of request threads and dumps the profile of slow requests
+
+    A daemon thread reads sys._current_frames() every `interval` seconds and counts the
+    stack of each thread currently serving a request, and of each worker thread inside
+    sampled() on its behalf. Requests slower than `threshold`
+    are written to `directory` in collapsed-stack format (one "frame;frame;frame count"
+    line per stack), which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, directory: str, threshold: float, interval: float = 0.005):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self._active: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_env(cls) -> Optional['SamplingProfiler']:
+        """Build a profiler from RIPESCANNER_PROFILE_SLOW_MS, if set"""
+        threshold = os.environ.get('RIPESCANNER_PROFILE_SLOW_MS')
+        if not threshold:
+            return None
+        return cls(
+            os.environ.get('RIPESCANNER_PROFILE_DIR', 'profiles'),
+            float(threshold) / 1000,
+            float(os.environ.get('RIPESCANNER_PROFILE_INTERVAL_MS', 5)) / 1000
+        )
+
+    def begin(self):
+        """Start sampling the calling thread"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                    self._thread.start()
+        samples = Counter()
+        with self._lock:
+            self._active[threading.get_ident()] = samples
+        _current_profile.set((self, samples))
+
+    def end(self, label: str, seconds: float) -> Optional[str]:
+        """Stop sampling the calling thread; return the dump path if the request was slow"""
+        _current_profile.set(None)
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or seconds < self.threshold:
+            return None
+
+        name = ''.join(char if char.isalnum() else '_' for char in label).strip('_')[:80]
+        path = os.path.join(self.directory, f"{datetime.now():%Y%m%dT%H%M%S.%f}-{name}-{seconds * 1000:.0f}ms.folded")
+        with open(path, 'w') as handle:
+            for stack, count in samples.most_common():
+                handle.write(f'{stack} {count}\n')
+        logging.warning(f"Slow request {label} took {seconds * 1000:.0f} ms; profile written to {path}")
+        return path
+
+    def attach(self, samples: Counter) -> bool:
+        """Count the calling thread's stacks into another thread's samples; False if it already is"""
+        ident = threading.get_ident()
+        with self._lock:
+            if ident in self._active:
+                return False
+            self._active[ident] = samples
+        return True
+
+    def detach(self):
+        """Stop sampling a thread attached with attach()"""
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None and ident != me:
+                        samples[_collapse(frame)] += 1
+
+
+def _collapse(frame) -> str:
+    """Render a frame's stack root-first as "function (file:line);..." """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
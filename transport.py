@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import threading
+import requests
+from typing import Any, Callable, Dict, List, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from ratelimit import RateLimiter
+import metrics
+
+
+class HTTPTransport:
+    """Shared keep-alive HTTP transport with per-host connection pools and retries"""
+
+    # Responses that mean the upstream wants us to slow down
+    THROTTLE_STATUSES = (429,)
+
+    def __init__(self, pool_connections: int = 16, pool_maxsize: int = 32, max_retries: int = 2,
+                 backoff_factor: float = 0.3, timeout: float = 10,
+                 rate_limiter: Optional[RateLimiter] = None, max_throttle_retries: int = 3):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_throttle_retries = max_throttle_retries
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'RIPEScanner/2.0'
+
+        # Retry connection failures and transient gateway errors on idempotent requests;
+        # 429 / Retry-After handling is left to the rate limiter
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=False,
+            raise_on_status=False
+        )
+
+        # pool_connections is the number of per-host pools kept alive,
+        # pool_maxsize the number of reusable connections inside each pool
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                              max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_env(cls) -> 'HTTPTransport':
+        """Build a transport configured from RIPESCANNER_HTTP_* environment variables"""
+        return cls(
+            pool_connections=int(os.environ.get('RIPESCANNER_HTTP_POOL_CONNECTIONS', 16)),
+            pool_maxsize=int(os.environ.get('RIPESCANNER_HTTP_POOL_MAXSIZE', 32)),
+            max_retries=int(os.environ.get('RIPESCANNER_HTTP_RETRIES', 2)),
+            backoff_factor=float(os.environ.get('RIPESCANNER_HTTP_BACKOFF', 0.3)),
+            timeout=float(os.environ.get('RIPESCANNER_HTTP_TIMEOUT', 10)),
+            rate_limiter=RateLimiter.from_env()
+        )
+
+    def get(self, url: str, timeout: Optional[float] = None, upstream: Optional[str] = None,
+            **kwargs) -> requests.Response:
+        """Issue a GET request over a pooled connection, paced by the upstream's rate limit"""
+        if not (upstream and self.rate_limiter):
+            return self._send(url, timeout, upstream, **kwargs)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(upstream)
+            response = self._send(url, timeout, upstream, **kwargs)
+            if response.status_code not in self.THROTTLE_STATUSES or attempt >= self.max_throttle_retries:
+                return response
+
+            # Queue the retry behind the upstream's Retry-After window
+            self.rate_limiter.backoff(upstream, attempt, response.headers.get('Retry-After'))
+            response.close()
+            attempt += 1
+
+    def _send(self, url: str, timeout: Optional[float], upstream: Optional[str], **kwargs) -> requests.Response:
+        """Send one request, recording its latency and outcome under the upstream's metrics labels"""
+        if upstream is None:
+            return self.session.get(url, timeout=timeout or self.timeout, **kwargs)
+
+        # 'rdap:RIPE' is labelled upstream="rdap", rir="RIPE"
+        name, _, rir = upstream.partition(':')
+        in_flight = metrics.UPSTREAM_IN_FLIGHT.labels(name)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, timeout=timeout or self.timeout, **kwargs)
+        except requests.exceptions.Timeout:
+            metrics.UPSTREAM_ERRORS.labels(name, rir, 'timeout').inc()
+            raise
+        except requests.exceptions.RequestException:
+            metrics.UPSTREAM_ERRORS.labels(name, rir, 'connection').inc()
+            raise
+        finally:
+            in_flight.dec()
+            metrics.UPSTREAM_LATENCY.labels(name, rir).observe(time.perf_counter() - start)
+
+        status = response.status_code
+        if status >= 400:
+            reason = 'throttled' if status in self.THROTTLE_STATUSES else f'http_{status // 100}xx'
+            metrics.UPSTREAM_ERRORS.labels(name, rir, reason).inc()
+        return response
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+
+_default_transport: Optional[HTTPTransport] = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport() -> HTTPTransport:
+    """Return the process-wide transport shared by services that are not given one"""
+    global _default_transport
+    if _default_transport is None:
+        with _default_transport_lock:
+            if _default_transport is None:
+                _default_transport = HTTPTransport.from_env()
+    return _default_transport
+
+
+class StubResponse:
+    """Minimal stand-in for requests.Response returned by StubTransport"""
+
+    def __init__(self, status_code: int = 200, body: Any = '', headers: Optional[Dict[str, str]] = None,
+                 url: str = ''):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = url
+        self.text = json.dumps(body) if isinstance(body, (dict, list)) else body
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} Error for url: {self.url}', response=self)
+
+    def close(self):
+        pass
+
+
+class StubTransport(HTTPTransport):
+    """In-process transport that answers from canned routes, for tests and benchmarks
+
+    Only the network send is replaced: rate limiting, Retry-After backoff and upstream
+    metrics run exactly as they do over HTTP.
+    """
+
+    def __init__(self, handler: Optional[Callable[[str], StubResponse]] = None,
+                 rate_limiter: Optional[RateLimiter] = None, max_throttle_retries: int = 3):
+        super().__init__(rate_limiter=rate_limiter, max_throttle_retries=max_throttle_retries)
+        self.handler = handler
+        self.routes: Dict[str, StubResponse] = {}
+        self.requests: List[str] = []
+        self._requests_lock = threading.Lock()
+
+    def add(self, url_prefix: str, status_code: int = 200, body: Any = '',
+            headers: Optional[Dict[str, str]] = None):
+        """Answer every URL starting with url_prefix with a canned response"""
+        self.routes[url_prefix] = StubResponse(status_code, body, headers)
+
+    def _send(self, url: str, timeout: Optional[float], upstream: Optional[str], **kwargs) -> StubResponse:
+        """Record the request and return the matching canned response"""
+        with self._requests_lock:
+            self.requests.append(url)
+        if self.handler:
+            return self.handler(url)
+
+        # Longest matching prefix wins
+        matches = [prefix for prefix in self.routes if url.startswith(prefix)]
+        if not matches:
+            return StubResponse(404, {'errorCode': 404, 'title': 'Not Found'}, url=url)
+        canned = self.routes[max(matches, key=len)]
+        return StubResponse(canned.status_code, canned.text, canned.headers, url)